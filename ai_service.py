@@ -1,15 +1,32 @@
 import os
 import logging
 import time
-import json
-import re
-
-from groq import Groq
-
-from schemas import Lead
-from prompts import PROMPTS
-
-from typing import Optional
+import asyncio
+import threading
+
+from schemas import Lead, render_json
+from prompts import DEFAULT_NICHE
+from prompt_registry import PromptRegistry, CompiledPrompt
+from niche_router import NicheRouter, NicheCandidate
+from spam_filter import SpamFilter, SpamVerdict
+from lead_cache import LeadCache
+from input_cleaner import InputCleaner, estimate_tokens
+from retry_policy import RetryPolicy, CircuitBreaker, classify_error, sdk_errors, PARSE
+from model_cascade import ModelCascade, PARSE_FAILED
+from llm_limiter import LLMLimiter
+from singleflight import SingleFlight
+from near_duplicates import NearDuplicateIndex, Probe
+from lead_parser import LeadParser, LeadParseError, failed_generation
+from lead_packer import LeadPacker
+from lead_stream import CompletionReader, StreamStats, FieldCallback
+from http_pool import HttpPool
+import text_rules
+import metrics
+
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import groq
 
 
 logging.basicConfig(level=logging.INFO)
@@ -17,63 +34,132 @@ logger = logging.getLogger(__name__)
 
 
 class AIService:
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        self.model = "llama-3.1-8b-instant"
-        self.prompts = PROMPTS
+    def __init__(self, http_pool: Optional[HttpPool] = None):
+        # Clients (and the groq SDK) are created on first use, see client / async_client
+        self.api_key = os.getenv("GROQ_API_KEY")
+        # Shared connection pool (main.Services); without it the SDK keeps its own
+        self.http_pool = http_pool
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+        # Models tried in order, the next one only for uncertain answers (LLM_MODELS)
+        self.cascade = ModelCascade.from_env()
+        self.model = self.cascade.models[0]
+        # Groq JSON mode (response_format json_object); off for models that do not support it
+        self.json_mode = os.getenv("LLM_JSON_MODE", "true").lower() in ("1", "true", "yes")
+        self.parser = LeadParser()
+        # Opt-in: read completions as a stream and stop at the end of the JSON object
+        self.streaming = os.getenv("LLM_STREAMING_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.stream_stats = StreamStats()
+        # Opt-in: short messages of one niche share a prompt in /process-leads
+        self.packer = LeadPacker.from_env()
+        # Precompiled niche prompts + keyword router, from prompts.py or PROMPTS_DIR (hot reload).
+        # Fails fast when NICHE_KEYWORDS / DEFAULT_NICHE name a niche without a prompt
+        self.prompt_registry = PromptRegistry.from_env()
+        self.cache = LeadCache.from_env()
+        self.spam_filter = SpamFilter.from_env()
+        self.input_cleaner = InputCleaner.from_env()
+        self.retry_policy = RetryPolicy.from_env()
+        self.circuit_breaker = CircuitBreaker.from_env()
+        # Shared by all requests of this worker: AIMD concurrency + requests/tokens per minute
+        self.limiter = LLMLimiter.from_env()
+        # Identical texts arriving at the same time share one LLM call
+        self.singleflight = SingleFlight.from_env()
+        # Opt-in: near-duplicates of a recent lead reuse its answer (NEAR_DUP_ENABLED)
+        self.near_duplicates = NearDuplicateIndex.from_env()
+
+    @property
+    def prompts(self) -> dict[str, str]:
+        """Niche -> prompt template of the current registry version."""
+        return self.prompt_registry.current.templates
+
+    @prompts.setter
+    def prompts(self, templates: dict[str, str]) -> None:
+        self.prompt_registry.replace_templates(templates)
+
+    @property
+    def router(self) -> NicheRouter:
+        return self.prompt_registry.current.router
+
+    def _pool_options(self, sync: bool) -> dict:
+        if self.http_pool is None:
+            return {}
+        return {
+            "http_client": self.http_pool.client if sync else self.http_pool.async_client,
+            "timeout": self.http_pool.timeout(self.http_pool.llm_timeout),
+        }
+
+    @property
+    def client(self) -> "groq.Groq":
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from groq import Groq  # deferred: the SDK takes ~70 ms to import
+                    # SDK-level retries are off: RetryPolicy and CircuitBreaker decide instead
+                    self._client = Groq(api_key=self.api_key, max_retries=0, **self._pool_options(sync=True))
+        return self._client
+
+    @client.setter
+    def client(self, value) -> None:
+        self._client = value
+
+    @client.deleter
+    def client(self) -> None:
+        self._client = None
+
+    @property
+    def async_client(self) -> "groq.AsyncGroq":
+        if self._async_client is None:
+            with self._client_lock:
+                if self._async_client is None:
+                    from groq import AsyncGroq
+                    self._async_client = AsyncGroq(api_key=self.api_key, max_retries=0, **self._pool_options(sync=False))
+        return self._async_client
+
+    @async_client.setter
+    def async_client(self, value) -> None:
+        self._async_client = value
+
+    @async_client.deleter
+    def async_client(self) -> None:
+        self._async_client = None
+
+    async def warm_up(self) -> None:
+        """Create the async client and open a pooled connection to Groq (one cheap GET /models)."""
+        try:
+            await self.async_client.models.list()
+        except Exception as e:
+            # Any HTTP answer leaves the connection open; only log what did not work
+            logger.warning(f"Groq warm-up request failed: {str(e)}")
 
     def _initialize_prompts(self) -> dict:
       # prompts are now provided by the external module 'prompts'
       pass
 
     def _contains_profanity(self, text: str) -> bool:
-        normalized = (text or "").lower()
-        profanity_patterns = self._profanity_patterns()
-        return any(re.search(pattern, normalized, re.IGNORECASE) for pattern in profanity_patterns)
+        return text_rules.contains_profanity(text)
 
     def _profanity_patterns(self) -> tuple[str, ...]:
-        # Lightweight profanity detector (PL). Intentionally conservative.
-        return (
-            r"\bkurw\w*\b",
-            r"\bchuj\w*\b",
-            r"\bjeb\w*\b",
-            r"\bpierdol\w*\b",
-            r"\bskurw\w*\b",
-            r"\bspierdol\w*\b",
-        )
+        return text_rules.PROFANITY_PATTERNS
 
     def _remove_profanity_terms(self, text: Optional[str]) -> Optional[str]:
-        if not text:
-            return text
-
-        sanitized = text
-        for pattern in self._profanity_patterns():
-            sanitized = re.sub(pattern, "", sanitized, flags=re.IGNORECASE)
-        sanitized = re.sub(r"\s{2,}", " ", sanitized).strip()
-        sanitized = re.sub(r"\s+([,.;:!?])", r"\1", sanitized)
-        return sanitized
+        return text_rules.remove_profanity_terms(text)
 
     def _fix_common_summary_typos(self, summary: Optional[str]) -> Optional[str]:
-        if not summary:
-            return summary
-
-        fixed = summary
-        fixed = re.sub(r"fotowoltaj", "fotowoltaic", fixed, flags=re.IGNORECASE)
-        fixed = re.sub(r"fotowoltai", "fotowoltaic", fixed, flags=re.IGNORECASE)
-        fixed = fixed.strip()
-        if fixed and fixed[0].islower():
-            fixed = fixed[0].upper() + fixed[1:]
-        if fixed and fixed[-1] not in ".!?":
-            fixed += "."
-        return fixed
+        return text_rules.fix_common_summary_typos(summary)
 
     def _postprocess_lead(self, lead: Lead, source_text: str) -> Lead:
-      if self._contains_profanity(source_text):
+      started = time.perf_counter()
+      # One pass over the source text collects profanity, email and phone
+      scan = text_rules.scan_text(source_text)
+
+      if scan.has_profanity:
+        metrics.PROFANITY_HITS.inc()
         lead.summary = self._remove_profanity_terms(lead.summary)
 
       lead.summary = self._fix_common_summary_typos(lead.summary)
 
-      if self._contains_profanity(source_text):
+      if scan.has_profanity:
         note = "Wiadomość zawiera wulgarny język."
         if lead.summary:
           if note.lower() not in lead.summary.lower():
@@ -104,184 +190,525 @@ class AIService:
         lead.name = None
 
       # Backfill email/phone from source text if missing
-      try:
-        if not lead.email:
-          lead.email = self._extract_email(source_text)
-      except Exception:
-        pass
-      try:
-        if not lead.phone:
-          lead.phone = self._extract_phone(source_text)
-      except Exception:
-        pass
+      if not lead.email:
+        lead.email = scan.email
+      if not lead.phone:
+        lead.phone = scan.phone
 
+      metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="postprocess")
       return lead
 
     def _sanitize_name(self, name: Optional[str]) -> Optional[str]:
-      if not name:
-        return None
-      s = name.strip()
-      if not s:
-        return None
-      if len(s) > 60:
-        return None
-      if any(ch.isdigit() for ch in s):
-        return None
-      if "@" in s:
-        return None
-      s_l = s.lower()
-      noise_keywords = (
-        "pokoi", "pokoj", "pokoje", "wyceny", "wycena", "grupy", "grupa", "osób", "osoby", "osoba",
-        "tydzie", "dla", "proszę", "prosze", "rezerwac", "nocleg", "hotel", "klimatyz", "fotowolt",
-        "pompa", "rekuper", "budżet", "budzet", "termin", "ofert"
-      )
-      if any(k in s_l for k in noise_keywords):
-        return None
-      # Accept names like Jan, Jan Kowalski, Jan A. Kowalski (basic heuristic)
-      name_regex = re.compile(r"^[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+( [A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż\.]+){0,2}$")
-      if name_regex.match(s):
-        return s
-      return None
+      return text_rules.sanitize_name(name)
 
     def _extract_email(self, text: str) -> Optional[str]:
-      if not text:
-        return None
-      m = re.search(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", text)
-      return m.group(0) if m else None
+      return text_rules.extract_email(text)
 
     def _extract_phone(self, text: str) -> Optional[str]:
-      if not text:
-        return None
-      m = re.search(r"\+?\d[\d\s\-()]{6,}\d", text)
-      return m.group(0).strip() if m else None
+      return text_rules.extract_phone(text)
+
+    def _off_topic_lead(self, text: str) -> Lead:
+        # Neutral score-1 lead; post-processing sets the summary and pulls contacts from the text
+        return self._postprocess_lead(Lead(score=1), text)
+
+    def _prefilter(self, text: str) -> tuple[Optional[SpamVerdict], Optional[Lead]]:
+        """Spam filter verdict, plus the lead to return instead of calling the LLM (mode 'on')."""
+        if self.spam_filter.mode == "off":
+            return None, None
+        verdict = self.spam_filter.classify(text)
+        if verdict.is_spam and self.spam_filter.mode == "on":
+            logger.info(f"Spam filter short-circuit ({verdict.confidence}, {','.join(verdict.reasons)})")
+            self.spam_filter.record_short_circuit()
+            return verdict, self._off_topic_lead(text)
+        return verdict, None
 
     def process_lead_text(self, text: str) -> Lead:
         """Default entrypoint: auto-detect niche based on text."""
+        verdict, short_circuit = self._prefilter(text)
+        if short_circuit is not None:
+            return short_circuit
+
+        niche = self._detect_niche(text)
+        lead = self.process_lead_niche(text, niche=niche)
+        if verdict is not None:
+            self.spam_filter.record_shadow(verdict, lead.score)
+        return lead
+
+    async def process_lead_text_async(self, text: str, on_field: Optional[FieldCallback] = None) -> Lead:
+        """Async counterpart of process_lead_text; never blocks the event loop."""
+        verdict, short_circuit = self._prefilter(text)
+        if short_circuit is not None:
+            return short_circuit
+
         niche = self._detect_niche(text)
-        return self.process_lead_niche(text, niche=niche)
+        lead = await self.process_lead_niche_async(text, niche=niche, on_field=on_field)
+        if verdict is not None:
+            self.spam_filter.record_shadow(verdict, lead.score)
+        return lead
+
+    async def process_leads_async(self, texts: list[str], max_concurrency: int = 8) -> list:
+        """
+        Process many texts concurrently, at most max_concurrency at a time.
+
+        Results keep input order; a failed item is returned in place as its exception.
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        if self.packer.enabled:
+            return await self._process_leads_packed_async(texts, semaphore)
+
+        async def run(text: str) -> Lead:
+            async with semaphore:
+                return await self.process_lead_text_async(text)
+
+        return await asyncio.gather(*(run(text) for text in texts), return_exceptions=True)
+
+    async def _process_leads_packed_async(self, texts: list[str], semaphore: asyncio.Semaphore) -> list:
+        """
+        Packed variant of process_leads_async: short uncached messages are grouped by
+        niche, up to packer.max_items per call; long ones, items missing from a packed
+        answer and answers the model cascade would escalate go through
+        process_lead_niche_async.
+        """
+        results: list = [None] * len(texts)
+        verdicts: dict[int, Optional[SpamVerdict]] = {}
+        niches: dict[int, str] = {}
+        groups: dict[str, list[tuple[int, str, str, Optional[Probe]]]] = {}
+        singles: list[int] = []
+
+        for index, text in enumerate(texts):
+            try:
+                verdict, short_circuit = self._prefilter(text)
+                if short_circuit is not None:
+                    results[index] = short_circuit
+                    continue
+                verdicts[index] = verdict
+                prompt = self.prompt_registry.current.get(self._detect_niche(text))
+                niche = niches[index] = prompt.niche
+                cleaned = self.input_cleaner.clean(text).text
+                if not self.packer.is_short(cleaned):
+                    singles.append(index)
+                    continue
+                cache_key = self._cache_key(cleaned, niche, prompt)
+                probe = self.near_duplicates.probe(cleaned, prompt.hash)
+                cached_lead = self._near_duplicate_lead(probe, cleaned) or await self._cached_lead_async(cache_key, cleaned)
+                if cached_lead is not None:
+                    metrics.LEADS_BY_NICHE.inc(niche=niche)
+                    results[index] = cached_lead
+                else:
+                    groups.setdefault(niche, []).append((index, cleaned, cache_key, probe))
+            except Exception as e:
+                results[index] = e
+
+        def finish(index: int, lead: Lead) -> None:
+            results[index] = lead
+            if verdicts.get(index) is not None:
+                self.spam_filter.record_shadow(verdicts[index], lead.score)
+
+        async def single(index: int) -> None:
+            try:
+                async with semaphore:
+                    finish(index, await self.process_lead_niche_async(texts[index], niche=niches[index]))
+            except Exception as e:
+                results[index] = e
+
+        async def packed(niche: str, chunk: list[tuple[int, str, str, Optional[Probe]]]) -> None:
+            if len(chunk) == 1:
+                return await single(chunk[0][0])
+            async with semaphore:
+                leads = await self._complete_packed_async(niche, [item[1] for item in chunk], [item[2] for item in chunk],
+                                                          [item[3] for item in chunk])
+            fallbacks = []
+            for (index, _, _, _), lead in zip(chunk, leads):
+                if lead is None:
+                    fallbacks.append(single(index))
+                else:
+                    metrics.LEADS_BY_NICHE.inc(niche=niche)
+                    finish(index, lead)
+            await asyncio.gather(*fallbacks)
+
+        await asyncio.gather(
+            *(single(index) for index in singles),
+            *(packed(niche, chunk) for niche, items in groups.items() for chunk in self.packer.chunks(items)),
+        )
+        return results
+
+    async def _complete_packed_async(self, niche: str, texts: list[str], cache_keys: list[str],
+                                     probes: Optional[list[Optional[Probe]]] = None) -> list[Optional[Lead]]:
+        """One call for several messages; None marks an item to redo with a single call."""
+        if not self.circuit_breaker.allow_request():
+            return [None] * len(texts)
+        with metrics.stage("prompt_build"):
+            prompt = self.packer.build_prompt(self.prompt_registry.current.get(niche).template, texts)
+        max_tokens = self.packer.max_tokens(len(texts))
+        try:
+            try:
+                async with self.limiter.slot_async(niche, estimate_tokens(prompt) + max_tokens) as permit:
+                    with metrics.stage("llm_call"):
+                        response = await self.async_client.chat.completions.create(
+                            **self._completion_kwargs(prompt, max_tokens=max_tokens)
+                        )
+                    permit.record_usage(response)
+                raw_content = response.choices[0].message.content
+            except sdk_errors("groq", "BadRequestError") as e:
+                raw_content = self._rejected_generation(e)
+            self.circuit_breaker.record_success()
+            entries = self.packer.parse_items(raw_content, len(texts))
+        except Exception as e:
+            logger.error(f"Packed call for {len(texts)} leads failed ({classify_error(e)}): {str(e)}")
+            self.circuit_breaker.record_failure(e)
+            self.packer.record(len(texts), len(texts), failed=True)
+            return [None] * len(texts)
+
+        leads: list[Optional[Lead]] = []
+        probes = probes or [None] * len(texts)
+        escalated = 0
+        for number, (text, cache_key, probe) in enumerate(zip(texts, cache_keys, probes), start=1):
+            entry = entries.get(number)
+            try:
+                lead = self.parser.validate(entry) if entry is not None else None
+            except LeadParseError:
+                lead = None
+            # Packed calls go to the first model only: an answer the cascade would escalate is
+            # neither cached nor indexed, its single call runs the whole cascade
+            if lead is not None and self.cascade.has_next(0) and self.cascade.escalation_reason(lead, text):
+                lead = None
+                escalated += 1
+            if lead is not None:
+                answer = render_json(lead)
+                await self.cache.aset(cache_key, answer)
+                lead = self._remember_near_duplicate(probe, answer, self._postprocess_lead(lead, text))
+            leads.append(lead)
+        missing = leads.count(None)
+        if missing - escalated:
+            logger.warning(f"Packed call: {missing - escalated} of {len(texts)} leads missing or invalid, falling back to single calls")
+        if escalated:
+            logger.info(f"Packed call: {escalated} of {len(texts)} leads to escalate, falling back to single calls")
+        self.packer.record(len(texts), missing)
+        return leads
+
+    def rank_niches(self, text: str) -> list[NicheCandidate]:
+        """Scored candidate niches (best first) with confidence = share of keyword hits."""
+        return self.router.rank(text)
 
     def _detect_niche(self, text: str) -> str:
         """Lightweight router so '/process-lead' works without passing niche explicitly."""
-        normalized = (text or "").lower()
-
-        # Hotel/hospitality keywords
-        hotel_keywords = (
-            "hotel",
-            "nocleg",
-            "pokój",
-            "pokoje",
-            "pokoj",
-            "pokoi",
-            "rezerwacj",
-            "zakwaterowanie",
-            "konferencj",
-            "event",
-        )
-        if any(keyword in normalized for keyword in hotel_keywords):
-            return "hotelarstwo"
-
-        # HVAC keywords
-        hvac_keywords = (
-            "klimatyz",
-            "klimatyzator",
-            "klima",
-            "split",
-            "multisplit",
-            "rekuper",
-            "rekuperator",
-            "wentyl",
-            "hvac",
-        )
-        if any(keyword in normalized for keyword in hvac_keywords):
-            return "klimatyzacja_rekuperacja"
+        with metrics.stage("niche_detection"):
+            return self.router.route(text)
 
-        return "fotowoltaika_pompy_ciepla"
+    def _resolve_niche(self, niche: str) -> str:
+        # Validate niche
+        return self.prompt_registry.current.get(niche).niche
+
+    def _cache_key(self, text: str, niche: str, prompt: Optional[CompiledPrompt] = None) -> str:
+        # The prompt hash covers the whole template, so editing a prompt invalidates old entries.
+        # prompt: the niche's compiled prompt when the caller holds one (one registry version per lead)
+        prompt = prompt or self.prompt_registry.current.get(niche)
+        return self.cache.make_key(text, prompt.niche, self.cascade.cache_id, prompt.hash)
+
+    def _cached_lead(self, cache_key: str, text: str) -> Optional[Lead]:
+        return self._lead_from_cache(self.cache.get(cache_key), text)
+
+    async def _cached_lead_async(self, cache_key: str, text: str) -> Optional[Lead]:
+        return self._lead_from_cache(await self.cache.aget(cache_key), text)
+
+    def _lead_from_cache(self, cached: Optional[dict], text: str) -> Optional[Lead]:
+        if cached is None:
+            return None
+        logger.info("Lead served from cache")
+        return self._postprocess_lead(Lead(**cached), text)
+
+    def _near_duplicate_lead(self, probe: Optional[Probe], text: str) -> Optional[Lead]:
+        """The answer of a recent near-duplicate, post-processed against this text (no LLM call)."""
+        if probe is None:
+            return None
+        match = self.near_duplicates.find(probe)
+        if match is None:
+            return None
+        answer = Lead.model_validate_json(match.answer)
+        # Numbers and e-mails are equal (the index key); a name is not: the same form text
+        # signed by someone else is another lead
+        if answer.name and not all(word in text.lower() for word in answer.name.lower().split()):
+            self.near_duplicates.record_name_mismatch()
+            return None
+        logger.info(f"Near-duplicate of a lead from {match.age:.0f}s ago "
+                    f"(similarity {match.similarity:.2f}), reusing its answer")
+        return self.near_duplicates.mark(self._postprocess_lead(answer, text), match.group)
+
+    def _remember_near_duplicate(self, probe: Optional[Probe], answer: bytes, lead: Lead) -> Lead:
+        # Index the answer (before post-processing) so later near-duplicates reuse it
+        if probe is not None:
+            self.near_duplicates.mark(lead, self.near_duplicates.add(probe, answer))
+        return lead
+
+    def _completion_kwargs(self, prompt: str, max_tokens: int = 500, model: Optional[str] = None,
+                           stream: bool = False) -> dict:
+        return {
+            "messages": [
+                {"role": "system", "content": "Jesteś pomocnym asystentem, który zawsze zwraca prawidłowy JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            "model": model or self.model,
+            "temperature": 0.1,  # Niska temperatura dla spójności
+            "max_tokens": max_tokens,
+            # Groq does not stream in JSON mode; a streamed object is cut out of the text instead
+            **({"stream": True} if stream else {"response_format": {"type": "json_object"}} if self.json_mode else {}),
+        }
+
+    def _stream_completion(self, prompt: str, model: str) -> str:
+        """Streamed answer, closed as soon as its JSON object is complete."""
+        reader = CompletionReader(model)
+        stream = self.client.chat.completions.create(**self._completion_kwargs(prompt, model=model, stream=True))
+        stopped_early = False
+        try:
+            for chunk in stream:
+                if reader.feed(chunk):
+                    # Whatever the model writes after the closing brace is not needed
+                    stopped_early = True
+                    break
+        finally:
+            stream.close()
+        self.stream_stats.record(reader, stopped_early)
+        return reader.content
+
+    async def _stream_completion_async(self, prompt: str, model: str, on_field: Optional[FieldCallback] = None) -> str:
+        reader = CompletionReader(model, on_field)
+        stream = await self.async_client.chat.completions.create(**self._completion_kwargs(prompt, model=model, stream=True))
+        stopped_early = False
+        try:
+            async for chunk in stream:
+                if reader.feed(chunk):
+                    stopped_early = True
+                    break
+        finally:
+            await stream.close()
+        self.stream_stats.record(reader, stopped_early)
+        return reader.content
+
+    def _token_estimate(self, prompt: str) -> int:
+        # Charged against the tokens/min bucket up front; corrected with response.usage
+        return estimate_tokens(prompt) + self._completion_kwargs("")["max_tokens"]
+
+    def _rejected_generation(self, error: "groq.BadRequestError") -> str:
+        # JSON mode rejected the answer on Groq's side; its text comes with the error
+        # and is usually repairable locally, which saves a round trip
+        generation = failed_generation(error)
+        if generation is None:
+            raise error
+        logger.info("JSON mode rejected the answer, parsing failed_generation")
+        return generation
+
+    def _retry_delay(self, attempt: int, error: Exception, raw_content: Optional[str]) -> Optional[float]:
+        """Log the failed attempt, feed the breaker and return the backoff (None = give up)."""
+        logger.exception(f"Error during AI processing on attempt {attempt + 1} ({classify_error(error)}): {str(error)}")
+        if raw_content:
+            logger.error(f"Raw AI content (truncated): {raw_content[:2000]}")
+        self.circuit_breaker.record_failure(error)
+        delay = self.retry_policy.next_delay(attempt, error)
+        if delay is None:
+            logger.error("Not retrying, returning manual verification lead")
+        else:
+            logger.info(f"Retrying in {delay:.2f}s")
+            metrics.LLM_RETRIES.inc(error=classify_error(error))
+        return delay
+
+    def _manual_verification_lead(self, reason: str) -> Lead:
+        metrics.MANUAL_VERIFICATION.inc(reason=reason)
+        # Return a lead indicating manual verification needed
+        return Lead(
+            name=None,
+            company=None,
+            email=None,
+            phone=None,
+            product=None,
+            budget_est=None,
+            urgency=None,
+            city=None,
+            summary="Requires manual verification - AI processing failed",
+            score=1
+        )
 
-    def process_lead_niche(self, text: str, niche: str = "fotowoltaika_pompy_ciepla") -> Lead:
+    def process_lead_niche(self, text: str, niche: str = DEFAULT_NICHE) -> Lead:
         """
         Process lead text with niche-specific prompt.
         
-        Available niches: fotowoltaika_pompy_ciepla, klimatyzacja_rekuperacja
+        Available niches: keys of the prompt registry (prompts.PROMPTS or PROMPTS_DIR)
         """
-        # Validate niche
-        if niche not in self.prompts:
-            logger.warning(f"Unknown niche '{niche}', using default 'fotowoltaika_pompy_ciepla'")
-            niche = "fotowoltaika_pompy_ciepla"
-        
-        # Build prompt with user text
-        prompt = f"""{self.prompts[niche]}
-
-        IMPORTANT OUTPUT RULES:
-        - Return ONLY a single JSON object. No markdown, no commentary, no backticks.
-        - The JSON MUST contain exactly these keys:
-          name, company, email, phone, product, budget_est, urgency, city, summary, score
-        - Use null (without quotes) for unknown/missing values.
-        - Do NOT invent email/phone. If not present, set to null.
-        - score is REQUIRED and MUST be an integer from 1 to 10.
-        - summary MUST be in Polish, 1 sentence, correct grammar and spacing; fix obvious typos (e.g. missing spaces).
-        - summary should be human-readable (not copied raw); include the requested product/service and any numbers/budget mentioned.
-        - NEVER include profanity/vulgar words in the summary (do not quote them).
-
-        INPUT TEXT:
-        "{text}"
-
-        OUTPUT JSON:
+        # One registry version for the whole lead, even if prompts are reloaded meanwhile
+        compiled = self.prompt_registry.current.get(niche)
+        niche = compiled.niche
+        metrics.LEADS_BY_NICHE.inc(niche=niche)
+        # Quoted replies, signatures, footers, HTML and tracking URLs cost tokens, not quality
+        text = self.input_cleaner.clean(text).text
+        with metrics.stage("prompt_build"):
+            prompt = compiled.render(text)
+
+        cache_key = self._cache_key(text, niche, compiled)
+        # Checked before the exact cache: a resubmit within the window is linked to the first row too
+        probe = self.near_duplicates.probe(text, compiled.hash)
+        cached_lead = self._near_duplicate_lead(probe, text) or self._cached_lead(cache_key, text)
+        if cached_lead is not None:
+            return cached_lead
+
+        lead, shared = self.singleflight.do(cache_key, lambda: self._complete_lead(text, niche, prompt, cache_key, probe))
+        return self._coalesced_copy(lead) if shared else lead
+
+    def _coalesced_copy(self, lead: Lead) -> Lead:
+        # Callers must not share (and mutate) one Lead instance
+        logger.info("Lead coalesced with an identical in-flight request")
+        return lead.model_copy(deep=True)
+
+    def _complete_lead(self, text: str, niche: str, prompt: str, cache_key: str, probe: Optional[Probe] = None) -> Lead:
+        # Cheap model first; stronger ones only for uncertain answers (model_cascade.py)
+        answer, answer_tier, failure = None, None, None
+        for tier, model in enumerate(self.cascade.models):
+            started = time.perf_counter()
+            can_escalate = self.cascade.has_next(tier)
+            lead, failure = self._call_model(niche, prompt, model, can_escalate)
+            reason = self._escalation_reason(lead, failure, text) if can_escalate else None
+            self.cascade.record(tier, time.perf_counter() - started, escalated=reason, failed=lead is None)
+            if lead is not None:
+                answer, answer_tier = lead, tier
+            if reason is None:
+                break
+            logger.info(f"Escalating lead from {model} to {self.cascade.models[tier + 1]} ({reason})")
+        return self._finish_cascade(answer, answer_tier, tier, failure, text, cache_key, probe)
+
+    def _escalation_reason(self, lead: Optional[Lead], failure: Optional[str], text: str) -> Optional[str]:
+        if lead is None:
+            # Provider failures (breaker open, retries exhausted) are not the model's fault
+            return PARSE_FAILED if failure == PARSE_FAILED else None
+        return self.cascade.escalation_reason(lead, text)
+
+    def _finish_cascade(self, answer: Optional[Lead], answer_tier: Optional[int], last_tier: int,
+                        failure: Optional[str], text: str, cache_key: Optional[str],
+                        probe: Optional[Probe] = None) -> Lead:
+        """cache_key=None: the caller has cached the answer already (async path)."""
+        if answer is None:
+            self.cascade.record_lead()
+            return self._manual_verification_lead(failure or "llm_failed")
+        # A stronger tier failed outright: the cheaper, uncertain answer beats manual verification
+        self.cascade.record_lead(kept_cheaper=answer_tier < last_tier)
+        answer_json = render_json(answer)
+        if cache_key is not None:
+            self.cache.set(cache_key, answer_json)
+        lead = self._remember_near_duplicate(probe, answer_json, self._postprocess_lead(answer, text))
+        logger.info("Successfully processed lead")
+        return lead
+
+    def _call_model(self, niche: str, prompt: str, model: str, can_escalate: bool) -> tuple[Optional[Lead], Optional[str]]:
+        """One model's parsed answer (before post-processing), or None and why it failed."""
+        for attempt in range(self.retry_policy.max_attempts):
+          if not self.circuit_breaker.allow_request():
+            logger.error("LLM circuit breaker is open, returning manual verification lead")
+            return None, "circuit_open"
+          raw_content = None
+          try:
+            logger.info(f"Processing lead text with {model}, attempt {attempt + 1}")
+            rejected = False
+            try:
+              with self.limiter.slot(niche, self._token_estimate(prompt)) as permit:
+                with metrics.stage("llm_call"):
+                  if self.streaming:
+                    # A stream stopped early reports no usage: the slot keeps its estimate
+                    raw_content = self._stream_completion(prompt, model)
+                  else:
+                    response = self.client.chat.completions.create(**self._completion_kwargs(prompt, model=model))
+                    permit.record_usage(response)
+                    raw_content = response.choices[0].message.content
+            except sdk_errors("groq", "BadRequestError") as e:
+              raw_content, rejected = self._rejected_generation(e), True
+            self.circuit_breaker.record_success()
+
+            # Tolerant parsing: extraction, repairs and per-field validation
+            return self.parser.parse(raw_content, json_mode_rejected=rejected), None
+          except Exception as e:
+            if can_escalate and classify_error(e) == PARSE:
+              # The next model is likelier to answer properly than this one on a retry
+              logger.warning(f"Answer of {model} did not parse: {str(e)}")
+              return None, PARSE_FAILED
+            delay = self._retry_delay(attempt, e, raw_content)
+            if delay is None:
+              return None, "llm_failed"
+            time.sleep(delay)
+        return None, "llm_failed"
+
+    async def process_lead_niche_async(self, text: str, niche: str = DEFAULT_NICHE,
+                                       on_field: Optional[FieldCallback] = None) -> Lead:
         """
+        Async variant of process_lead_niche using the async Groq client and non-blocking backoff.
 
-        max_retries = 3
-        for attempt in range(max_retries):
+        on_field: the completion is streamed and on_field(model, field, value) is called for
+        each field of the answer as it arrives (not for cache hits or coalesced requests).
+        """
+        # One registry version for the whole lead, even if prompts are reloaded meanwhile
+        compiled = self.prompt_registry.current.get(niche)
+        niche = compiled.niche
+        metrics.LEADS_BY_NICHE.inc(niche=niche)
+        # Quoted replies, signatures, footers, HTML and tracking URLs cost tokens, not quality
+        text = self.input_cleaner.clean(text).text
+        with metrics.stage("prompt_build"):
+            prompt = compiled.render(text)
+
+        cache_key = self._cache_key(text, niche, compiled)
+        # Checked before the exact cache: a resubmit within the window is linked to the first row too
+        probe = self.near_duplicates.probe(text, compiled.hash)
+        cached_lead = self._near_duplicate_lead(probe, text) or await self._cached_lead_async(cache_key, text)
+        if cached_lead is not None:
+            return cached_lead
+
+        lead, shared = await self.singleflight.do_async(
+            cache_key, lambda: self._complete_lead_async(text, niche, prompt, cache_key, on_field, probe)
+        )
+        return self._coalesced_copy(lead) if shared else lead
+
+    async def _complete_lead_async(self, text: str, niche: str, prompt: str, cache_key: str,
+                                   on_field: Optional[FieldCallback] = None, probe: Optional[Probe] = None) -> Lead:
+        answer, answer_tier, failure = None, None, None
+        for tier, model in enumerate(self.cascade.models):
+            started = time.perf_counter()
+            can_escalate = self.cascade.has_next(tier)
+            lead, failure = await self._call_model_async(niche, prompt, model, can_escalate, on_field)
+            reason = self._escalation_reason(lead, failure, text) if can_escalate else None
+            self.cascade.record(tier, time.perf_counter() - started, escalated=reason, failed=lead is None)
+            if lead is not None:
+                answer, answer_tier = lead, tier
+            if reason is None:
+                break
+            logger.info(f"Escalating lead from {model} to {self.cascade.models[tier + 1]} ({reason})")
+        if answer is not None:
+            await self.cache.aset(cache_key, render_json(answer))
+        return self._finish_cascade(answer, answer_tier, tier, failure, text, cache_key=None, probe=probe)
+
+    async def _call_model_async(self, niche: str, prompt: str, model: str, can_escalate: bool,
+                                on_field: Optional[FieldCallback] = None) -> tuple[Optional[Lead], Optional[str]]:
+        for attempt in range(self.retry_policy.max_attempts):
+          if not self.circuit_breaker.allow_request():
+            logger.error("LLM circuit breaker is open, returning manual verification lead")
+            return None, "circuit_open"
           raw_content = None
           try:
-            logger.info(f"Processing lead text, attempt {attempt + 1}")
-            response = self.client.chat.completions.create(
-              messages=[
-                {"role": "system", "content": "Jesteś pomocnym asystentem, który zawsze zwraca prawidłowy JSON."},
-                {"role": "user", "content": prompt}
-              ],
-              model=self.model,
-              temperature=0.1,  # Niska temperatura dla spójności
-              max_tokens=500
-            )
-
-            raw_content = response.choices[0].message.content.strip()
-
-            # Remove possible markdown ```json
-            if raw_content.startswith("```json"):
-              raw_content = raw_content[7:]
-            if raw_content.endswith("```"):
-              raw_content = raw_content[:-3]
-            raw_content = raw_content.strip()
-
-            # Try to find JSON object if extra text exists
-            json_match = re.search(r"\{.*\}", raw_content, re.DOTALL)
-            if json_match:
-              raw_content = json_match.group(0)
-
-            data = json.loads(raw_content)
-
-            # Validate with Pydantic
-            lead = Lead(**data)
-            lead = self._postprocess_lead(lead, text)
-            logger.info("Successfully processed lead")
-            return lead
+            logger.info(f"Processing lead text with {model} (async), attempt {attempt + 1}")
+            rejected = False
+            try:
+              async with self.limiter.slot_async(niche, self._token_estimate(prompt)) as permit:
+                with metrics.stage("llm_call"):
+                  if self.streaming or on_field is not None:
+                    raw_content = await self._stream_completion_async(prompt, model, on_field)
+                  else:
+                    response = await self.async_client.chat.completions.create(**self._completion_kwargs(prompt, model=model))
+                    permit.record_usage(response)
+                    raw_content = response.choices[0].message.content
+            except sdk_errors("groq", "BadRequestError") as e:
+              raw_content, rejected = self._rejected_generation(e), True
+            self.circuit_breaker.record_success()
+
+            return self.parser.parse(raw_content, json_mode_rejected=rejected), None
           except Exception as e:
-            logger.exception(f"Error during AI processing on attempt {attempt + 1}: {str(e)}")
-            if raw_content:
-              logger.error(f"Raw AI content (truncated): {raw_content[:2000]}")
-            if attempt < max_retries - 1:
-              time.sleep(1)  # Wait before retry
-            else:
-              logger.error("All retries failed, returning manual verification lead")
-              # Return a lead indicating manual verification needed
-              return Lead(
-                name=None,
-                company=None,
-                email=None,
-                phone=None,
-                product=None,
-                budget_est=None,
-                urgency=None,
-                city=None,
-                summary="Requires manual verification - AI processing failed",
-                score=1
-              )
+            if can_escalate and classify_error(e) == PARSE:
+              logger.warning(f"Answer of {model} did not parse: {str(e)}")
+              return None, PARSE_FAILED
+            delay = self._retry_delay(attempt, e, raw_content)
+            if delay is None:
+              return None, "llm_failed"
+            await asyncio.sleep(delay)  # Wait before retry without blocking the loop
+        return None, "llm_failed"
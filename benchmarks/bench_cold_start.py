@@ -0,0 +1,97 @@
+"""
+Cold start of one uvicorn worker: time from process spawn to the first successful
+response, against the local Groq/Supabase stubs (stub_servers.py).
+
+Each run starts `uvicorn main:app` and polls GET / until it answers (worker ready),
+then sends one POST /process-lead and waits for a 200 (first successful lead: the
+first LLM call and insert, including any client creation and SDK import still left
+for it). Runs with the warm-up off and on (WARMUP_ENABLED).
+
+To compare with another revision, point --app-dir at a checkout of it:
+
+    git worktree add /tmp/app-before <commit>
+    python benchmarks/bench_cold_start.py --app-dir /tmp/app-before --runs 10
+    python benchmarks/bench_cold_start.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import free_port, stop_process  # noqa: E402
+from benchmarks.stub_servers import StubLLM, StubSupabase  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_start(app_dir: str, llm_url: str, db_url: str, extra_env: dict, timeout: float = 60) -> dict:
+    port = free_port()
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "cold-start", "GROQ_BASE_URL": llm_url,
+        "SUPABASE_URL": db_url, "SUPABASE_KEY": "cold-start",
+        "LEAD_CACHE_SIZE": "0",
+        **extra_env,
+    }
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--no-access-log"]
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"App exited with code {process.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("App did not become ready")
+                try:
+                    if client.get(f"{base}/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.005)
+            ready = time.perf_counter() - started
+            response = client.post(f"{base}/process-lead", json={"text": "Dzień dobry, proszę o wycenę fotowoltaiki 8 kW. Jan"})
+            response.raise_for_status()
+            first_lead = time.perf_counter() - started
+    finally:
+        stop_process(process)
+    return {"ready_s": ready, "first_lead_s": first_lead, "first_request_s": first_lead - ready}
+
+
+def summarize(runs: list[dict]) -> dict:
+    return {key: round(statistics.median(run[key] for run in runs), 3) for key in runs[0]}
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", default=ROOT, help="directory with main.py to start")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with StubLLM(latency=args.llm_latency) as llm, StubSupabase() as db:
+        for label, extra_env in (("default", {}), ("warm-up", {"WARMUP_ENABLED": "true"})):
+            runs = [cold_start(args.app_dir, llm.url, db.url, extra_env) for _ in range(args.runs)]
+            results[label] = summarize(runs)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.app_dir}: median of {args.runs} runs")
+    print(f"{'mode':<9} {'ready':>8} {'first lead':>11} {'first request':>14}")
+    for label, row in results.items():
+        print(f"{label:<9} {row['ready_s'] * 1000:>6.0f}ms {row['first_lead_s'] * 1000:>9.0f}ms {row['first_request_s'] * 1000:>12.0f}ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,127 @@
+"""
+Concurrent-request throughput of a single worker: blocking vs async /process-lead.
+
+Groq and Supabase are replaced with in-process fakes that take a fixed amount of
+time per call (time.sleep for the sync clients, asyncio.sleep for the async ones),
+so the numbers show how much the event loop is able to overlap, not API speed.
+Each request text is unique, so the response cache and request coalescing do not
+answer them.
+
+Usage:
+    python benchmarks/bench_concurrency.py --requests 50 --concurrency 50 --llm-latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GROQ_API_KEY", "bench-key")
+os.environ.setdefault("SUPABASE_URL", "https://bench.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "bench-key")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+import main  # noqa: E402
+from schemas import Lead, LeadInput  # noqa: E402
+
+LEAD_JSON = json.dumps({
+    "name": "Jan Kowalski", "company": None, "email": "jan@example.com", "phone": None,
+    "product": "Fotowoltaika", "budget_est": "30 000 PLN", "urgency": None, "city": "Kraków",
+    "summary": "Klient pyta o instalację fotowoltaiczną.", "score": 7,
+})
+SAMPLE_TEXT = "Dzień dobry, jestem Jan Kowalski z Krakowa, proszę o wycenę fotowoltaiki. jan@example.com"
+
+
+def _completion():
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=LEAD_JSON))])
+
+
+def install_fakes(llm_latency: float, db_latency: float) -> None:
+    services = main.get_services()
+    ai_service, db_service = services.ai, services.db
+    ai_service.prompts = {niche: "PROMPT" for niche in ai_service.prompts}
+
+    def sync_create(**kwargs):
+        time.sleep(llm_latency)
+        return _completion()
+
+    async def async_create(**kwargs):
+        await asyncio.sleep(llm_latency)
+        return _completion()
+
+    ai_service.client = MagicMock()
+    ai_service.client.chat.completions.create.side_effect = sync_create
+    ai_service.async_client = MagicMock()
+    ai_service.async_client.chat.completions.create = AsyncMock(side_effect=async_create)
+
+    def sync_execute():
+        time.sleep(db_latency)
+        return SimpleNamespace(data=[{"id": 1}])
+
+    async def async_execute():
+        await asyncio.sleep(db_latency)
+        return SimpleNamespace(data=[{"id": 1}])
+
+    db_service.supabase = MagicMock()
+    db_service.supabase.table.return_value.insert.return_value.execute.side_effect = sync_execute
+    db_service.async_supabase = MagicMock()
+    db_service.async_supabase.table.return_value.insert.return_value.execute = AsyncMock(side_effect=async_execute)
+
+
+def blocking_app() -> FastAPI:
+    """The previous handler: async def that calls the synchronous services directly."""
+    app = FastAPI()
+
+    @app.post("/process-lead", response_model=Lead)
+    async def process_lead(input_data: LeadInput):
+        services = main.get_services()
+        lead = services.ai.process_lead_text(input_data.text)
+        services.db.insert_lead(lead)
+        return lead
+
+    return app
+
+
+async def run_load(app: FastAPI, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    run_id = uuid.uuid4().hex[:8]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(n: int):
+            async with semaphore:
+                text = f"{SAMPLE_TEXT} (zapytanie {run_id}-{n})"
+                response = await client.post("/process-lead", json={"text": text})
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(total)))
+        return time.perf_counter() - started
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    install_fakes(args.llm_latency, args.db_latency)
+
+    for label, app in (("blocking (before)", blocking_app()), ("async (after)", main.app)):
+        elapsed = asyncio.run(run_load(app, args.requests, args.concurrency))
+        print(f"{label:<18} {args.requests} req in {elapsed:.2f}s -> {args.requests / elapsed:.1f} req/s")
+
+
+if __name__ == "__main__":
+    main_cli()
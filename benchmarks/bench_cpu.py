@@ -0,0 +1,207 @@
+"""
+CPU microbenchmarks of the local per-lead work: niche routing and post-processing.
+
+For every function and corpus kind (short / long / pathological, see lead_corpus.py)
+reports ns per call and the average transient allocation per call (peak traced
+memory during the call, via tracemalloc). A scaling check runs the pathological
+corpus at --size and 4x --size: linear code takes ~4x as long, a ratio above
+--max-scaling points at regex backtracking and fails the run.
+
+Timings are also stored relative to a fixed pure-Python calibration loop sampled
+during the same measurement, so a baseline recorded on one machine (or on a busy
+one) can be checked on another:
+
+    python benchmarks/bench_cpu.py --save-baseline benchmarks/baselines/cpu.json
+    python benchmarks/bench_cpu.py --check benchmarks/baselines/cpu.json --tolerance 0.5
+
+With --check the exit code is 1 if any function got slower than baseline by more
+than the tolerance (after calibration) or scales superlinearly.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GROQ_API_KEY", "bench-key")
+
+from ai_service import AIService  # noqa: E402
+from benchmarks.lead_corpus import generate  # noqa: E402
+
+KINDS = ("short", "long", "pathological")
+
+
+def functions(ai: AIService) -> dict[str, tuple[str, Callable]]:
+    """Benchmarked function -> (record field it takes, callable)."""
+    return {
+        "_detect_niche": ("text", ai._detect_niche),
+        "_contains_profanity": ("text", ai._contains_profanity),
+        "_remove_profanity_terms": ("summary", ai._remove_profanity_terms),
+        "_fix_common_summary_typos": ("summary", ai._fix_common_summary_typos),
+        "_sanitize_name": ("name", ai._sanitize_name),
+        "_extract_email": ("text", ai._extract_email),
+        "_extract_phone": ("text", ai._extract_phone),
+    }
+
+
+def calibration_ns() -> int:
+    """Fixed pure-Python workload, the unit timings are compared in across machines."""
+    started = time.perf_counter_ns()
+    total = 0
+    for i in range(20_000):
+        total += i * i % 7
+    return time.perf_counter_ns() - started
+
+
+def measure(fn: Callable, inputs: list, min_seconds: float, rounds: int) -> tuple[float, float]:
+    """
+    (ns per call, ns per calibration loop): best of `rounds` short rounds, each looping
+    over the inputs for at least min_seconds. The calibration loop is sampled between
+    the rounds, so drift in machine speed (noisy neighbours, frequency scaling) during
+    the measurement affects both numbers alike.
+    """
+    best, best_calibration = float("inf"), float("inf")
+    for _ in range(rounds):
+        best_calibration = min(best_calibration, calibration_ns())
+        ops = 0
+        started = time.perf_counter_ns()
+        while True:
+            for value in inputs:
+                fn(value)
+            ops += len(inputs)
+            elapsed = time.perf_counter_ns() - started
+            if elapsed >= min_seconds * 1e9:
+                break
+        best = min(best, elapsed / ops)
+    return best, best_calibration
+
+
+def alloc_per_op(fn: Callable, inputs: list, limit: int = 200) -> float:
+    """Average bytes allocated at the peak of a call (temporary copies included)."""
+    inputs = inputs[:limit]
+    total = 0
+    tracemalloc.start()
+    try:
+        for value in inputs:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn(value)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / len(inputs)
+
+
+def run_suite(args) -> dict:
+    ai = AIService()
+    corpora = {
+        "short": generate("short", args.short, args.seed),
+        "long": generate("long", args.long, args.seed),
+        "pathological": generate("pathological", args.pathological, args.seed, args.size),
+    }
+    large = generate("pathological", args.pathological, args.seed, args.size * 4)
+    results: dict[str, dict] = {}
+    for name, (field, fn) in functions(ai).items():
+        row: dict[str, dict] = {}
+        for kind in KINDS:
+            inputs = [record[field] for record in corpora[kind]]
+            ns, calibration = measure(fn, inputs, args.min_time, args.rounds)
+            row[kind] = {
+                "ns_per_op": round(ns, 1),
+                # Calls per calibration loop x 1e6; what --check compares
+                "relative": round(ns / calibration * 1e6, 1),
+                "alloc_bytes_per_op": round(alloc_per_op(fn, inputs)),
+            }
+        large_ns, _ = measure(fn, [record[field] for record in large], args.min_time, args.rounds)
+        row["scaling_4x"] = round(large_ns / row["pathological"]["ns_per_op"], 2)
+        results[name] = row
+    return {
+        "calibration_ns": min(calibration_ns() for _ in range(args.rounds)),
+        "corpus": {"short": args.short, "long": args.long, "pathological": args.pathological,
+                   "size": args.size, "seed": args.seed,
+                   "avg_chars": {kind: round(sum(len(r["text"]) for r in corpora[kind]) / len(corpora[kind]))
+                                 for kind in KINDS}},
+        "results": results,
+    }
+
+
+def check(report: dict, baseline: dict, tolerance: float, max_scaling: float) -> list[str]:
+    """Human-readable list of regressions (empty when the run passes)."""
+    problems = []
+    for name, row in report["results"].items():
+        if row["scaling_4x"] > max_scaling:
+            problems.append(f"{name}: superlinear, 4x input took {row['scaling_4x']}x as long")
+        base_row = baseline["results"].get(name)
+        if base_row is None:
+            continue
+        for kind in KINDS:
+            if kind not in base_row:
+                continue
+            slowdown = row[kind]["relative"] / base_row[kind]["relative"] - 1
+            if slowdown > tolerance:
+                expected = base_row[kind]["relative"] * row[kind]["ns_per_op"] / row[kind]["relative"]
+                problems.append(f"{name}[{kind}]: {row[kind]['ns_per_op']:.0f} ns/op vs {expected:.0f} expected "
+                                f"(+{slowdown:.0%}, tolerance {tolerance:.0%})")
+    return problems
+
+
+def print_report(report: dict, baseline: Optional[dict]) -> None:
+    avg = report["corpus"]["avg_chars"]
+    print(f"corpus: short {avg['short']} / long {avg['long']} / pathological {avg['pathological']} chars per text")
+    header = "".join(f"{kind + ' ns':>16}{'B':>9}" for kind in KINDS)
+    print(f"{'function':<28}{header}{'4x':>7}")
+    for name, row in report["results"].items():
+        cells = "".join(f"{row[kind]['ns_per_op']:>16,.0f}{row[kind]['alloc_bytes_per_op']:>9,}" for kind in KINDS)
+        print(f"{name:<28}{cells}{row['scaling_4x']:>7}")
+    if baseline:
+        speed = report["calibration_ns"] / baseline["calibration_ns"]
+        print(f"calibration: this machine runs the reference loop at {1 / speed:.2f}x the baseline speed")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--short", type=int, default=500, help="short records")
+    parser.add_argument("--long", type=int, default=100, help="long records")
+    parser.add_argument("--pathological", type=int, default=16, help="pathological records")
+    parser.add_argument("--size", type=int, default=8000, help="characters per pathological input")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.01, help="seconds per timing round")
+    parser.add_argument("--rounds", type=int, default=15, help="timing rounds per measurement (the best one counts)")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    parser.add_argument("--save-baseline", default=None, metavar="PATH")
+    parser.add_argument("--check", default=None, metavar="PATH", help="compare with a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown vs baseline (0.5 = 50%%)")
+    parser.add_argument("--max-scaling", type=float, default=8.0, help="allowed time ratio for 4x larger input")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    report = run_suite(args)
+    baseline = None
+    if args.check:
+        with open(args.check) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {path}")
+
+    if baseline is not None:
+        problems = check(report, baseline, args.tolerance, args.max_scaling)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main_cli()
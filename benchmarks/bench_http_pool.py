@@ -0,0 +1,119 @@
+"""
+Connection reuse on the /process-lead path: leads processed one after another
+(LLM call + insert) against HTTPS stubs of Groq and Supabase, counting TLS
+handshakes and timing each lead.
+
+Three pool settings (all through http_pool.HttpPool, so handshakes are counted
+the same way):
+- no keep-alive: every request opens a new TCP + TLS connection
+- library defaults: the SDKs' own pools (HTTP/1.1, idle connections closed after 5 s)
+- shared pool: HttpPool.from_env() settings (60 s keep-alive by default)
+
+With --gap above 5 s between leads (traffic of a few leads a minute), the library
+defaults lose every connection while idle and behave like no keep-alive:
+
+    python benchmarks/bench_http_pool.py --leads 50
+    python benchmarks/bench_http_pool.py --leads 6 --gap 6
+
+The stubs speak HTTP/1.1 only, so HTTP/2 is negotiated away here. Needs the
+openssl CLI for the stubs' self-signed certificate.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_servers import StubLLM, StubSupabase, self_signed_cert  # noqa: E402
+
+
+def pools(verify: str) -> dict:
+    from http_pool import HttpPool
+    return {
+        "no keep-alive": HttpPool(max_keepalive=0, http2=False, verify=verify),
+        # httpx defaults as the SDKs use them (Groq raises the limits to 1000 / 100)
+        "library defaults": HttpPool(max_connections=1000, max_keepalive=100, keepalive_expiry=5.0,
+                                     http2=False, verify=verify),
+        "shared pool": _from_env(verify),
+    }
+
+
+def _from_env(verify: str):
+    from http_pool import HttpPool
+    pool = HttpPool.from_env()
+    pool.verify = verify
+    return pool
+
+
+async def run_mode(pool, leads: int, gap: float) -> dict:
+    from ai_service import AIService
+    from database import DatabaseService
+    from lead_cache import LeadCache
+
+    ai, db = AIService(http_pool=pool), DatabaseService(http_pool=pool)
+    ai.cache = LeadCache(max_entries=0)
+    latencies = []
+    for i in range(leads):
+        if i and gap:
+            await asyncio.sleep(gap)
+        started = time.perf_counter()
+        lead = await ai.process_lead_text_async(f"Dzień dobry, proszę o wycenę fotowoltaiki 8 kW (nr {i}). Jan")
+        await db.insert_lead_async(lead)
+        latencies.append(time.perf_counter() - started)
+    stats = pool.stats()
+    await pool.aclose()
+    # The first lead pays the connections in every mode; the rest shows reuse
+    rest = latencies[1:] or latencies
+    return {
+        "leads": leads,
+        "requests": stats["requests"],
+        "tls_handshakes": stats["tls_handshakes"],
+        "first_lead_ms": round(latencies[0] * 1000, 2),
+        "p50_ms": round(statistics.median(rest) * 1000, 2),
+        "mean_ms": round(statistics.mean(rest) * 1000, 2),
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=50)
+    parser.add_argument("--gap", type=float, default=0.0, help="seconds between leads")
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    # SDK imports would otherwise land in the first lead of the first mode
+    for module in ("groq", "supabase"):
+        importlib.import_module(module)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        tls = self_signed_cert(directory)
+        with StubLLM(latency=args.llm_latency, tls=tls) as llm, StubSupabase(latency=args.db_latency, tls=tls) as db:
+            os.environ.update({"GROQ_API_KEY": "bench", "GROQ_BASE_URL": llm.url,
+                               "SUPABASE_URL": db.url, "SUPABASE_KEY": "bench"})
+            # One discarded lead pays the remaining one-time costs (lazy imports, SSL context)
+            asyncio.run(run_mode(pools(verify=tls[0])["no keep-alive"], 1, 0))
+            for label, pool in pools(verify=tls[0]).items():
+                results[label] = asyncio.run(run_mode(pool, args.leads, args.gap))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.leads} leads, {args.gap}s apart, 2 requests each (LLM + insert)")
+    print(f"{'mode':<18} {'handshakes':>10} {'first lead':>11} {'p50':>9} {'mean':>9}")
+    for label, row in results.items():
+        print(f"{label:<18} {row['tls_handshakes']:>10} {row['first_lead_ms']:>9.1f}ms "
+              f"{row['p50_ms']:>7.2f}ms {row['mean_ms']:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main_cli()
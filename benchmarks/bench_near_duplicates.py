@@ -0,0 +1,214 @@
+"""
+Near-duplicate detection: LLM calls saved, wrong merges, lookup latency and memory.
+
+1. Waves: generated short and long leads (benchmarks/lead_corpus.py) go through
+   AIService.process_lead_niche with NEAR_DUP_ENABLED; --dup-rate of them come back
+   1-3 times within the next ~50 leads as near-duplicates (another greeting, "Wysłane
+   z iPhone'a", a typo, changed punctuation). The fake Groq client answers with the
+   name signed under the message and a marker of the message it read. Reported: LLM
+   calls, found near-duplicates, merges of different messages (the generator repeats
+   its templates, so different people send the same text), and merges that reused
+   another person's name (must be 0).
+2. Lookup: an index of --entries messages (the default NEAR_DUP_MAX_ENTRIES), among
+   them a bucket of messages without numbers or e-mails (same key, so every lookup
+   there compares NEAR_DUP_MAX_CANDIDATES sketches). probe + find per cleaned message
+   (as AIService probes it), p50/p99/max, and the index memory per entry (tracemalloc).
+
+With --check the script exits 1 on a wrong name or a lookup p99 of 1 ms or more:
+
+    python benchmarks/bench_near_duplicates.py --check
+    python benchmarks/bench_near_duplicates.py --leads 1000 --dup-rate 0.5
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.lead_corpus import FIRST_NAMES, GREETINGS, generate  # noqa: E402
+
+_INPUT_RE = re.compile(r'INPUT TEXT:\s*"(.*)"\s*OUTPUT JSON:', re.S)
+_NUMBERS_RE = re.compile(r"\d+|\S+@\S+")
+
+
+def near_variant(text: str, rng: random.Random) -> str:
+    kind = rng.randrange(4)
+    if kind == 0:
+        greeting = next((g for g in GREETINGS if text.startswith(g)), None)
+        if greeting:
+            return rng.choice([g for g in GREETINGS if g != greeting]) + text[len(greeting):]
+    if kind == 1:
+        return text + "\n\nWysłane z iPhone'a"
+    if kind == 2:
+        words = text.split(" ")
+        i = rng.randrange(len(words))
+        if len(words[i]) > 3 and not any(ch.isdigit() for ch in words[i]):
+            words[i] = words[i][:-2] + words[i][-1] + words[i][-2]
+            return " ".join(words)
+    return text.replace(", ", " , ", 1).replace(". ", "  .  ", 1)
+
+
+def signed_name(record: dict) -> str | None:
+    """The name as the message gives it (short records sign with a first name whatever their `name` label)."""
+    if record["name"] and record["name"] in record["text"]:
+        return record["name"]
+    last_word = record["text"].split()[-1]
+    return last_word if last_word in FIRST_NAMES else None
+
+
+class FakeCompletions:
+    """Answers with the signed name and a marker of the message found in the prompt."""
+
+    def __init__(self, records: dict):
+        self.records = records
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        text = _INPUT_RE.search(kwargs["messages"][-1]["content"]).group(1)
+        record_id, name = self.records[text]
+        answer = {"name": name, "product": "Inne", "budget_est": f"rec-{record_id}",
+                  "summary": "Klient pyta o ofertę.", "score": 6}
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(answer)))],
+                               usage=None)
+
+
+def run_waves(leads: int, dup_rate: float, seed: int) -> dict:
+    from ai_service import AIService
+    from lead_cache import LeadCache
+
+    rng = random.Random(seed)
+    service = AIService()
+    service.cache = LeadCache(max_entries=0)
+    corpus = generate("short", leads // 2, seed=seed) + generate("long", leads - leads // 2, seed=seed + 1)
+
+    # (time, record id, text): near-duplicates arrive within the next ~50 leads
+    events = []
+    for record_id, record in enumerate(corpus):
+        events.append((record_id, record_id, record["text"]))
+        if rng.random() < dup_rate:
+            for _ in range(rng.randint(1, 3)):
+                events.append((record_id + rng.uniform(0.5, 50), record_id, near_variant(record["text"], rng)))
+    events.sort()
+
+    names = [signed_name(record) for record in corpus]
+    records = {}
+    for _, record_id, text in events:
+        records[service.input_cleaner.clean(text).text] = (record_id, names[record_id])
+    fake = FakeCompletions(records)
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+
+    seen, duplicates, found, other_message, wrong_name = set(), 0, 0, 0, 0
+    for _, record_id, text in events:
+        repeat = record_id in seen
+        seen.add(record_id)
+        duplicates += repeat
+        calls = fake.calls
+        lead = service.process_lead_niche(text, niche=service._detect_niche(text))
+        if fake.calls > calls:
+            continue
+        # Answered without the LLM: whose answer was reused?
+        reused_id = int(lead.budget_est.split("-")[1])
+        found += reused_id == record_id
+        if reused_id != record_id:
+            other_message += 1
+            wrong_name += names[reused_id] != names[record_id]
+    stats = service.near_duplicates.stats()
+    return {
+        "leads": len(events),
+        "near_duplicates_sent": duplicates,
+        "llm_calls": fake.calls,
+        "found": found,
+        "recall": round(found / duplicates, 3) if duplicates else None,
+        "merged_other_message": other_message,
+        "wrong_name": wrong_name,
+        "too_short": stats["too_short"],
+        "name_mismatches": stats["name_mismatches"],
+    }
+
+
+def run_lookup(entries: int, lookups: int, seed: int) -> dict:
+    from near_duplicates import NearDuplicateIndex
+    from input_cleaner import InputCleaner
+
+    rng = random.Random(seed)
+    cleaner = InputCleaner()
+    texts = [cleaner.clean(record["text"]).text for record in generate("long", 400, seed=seed)]
+    texts += [cleaner.clean(record["text"]).text for record in generate("short", 400, seed=seed + 1)]
+    answer = json.dumps({"summary": "Klient pyta o ofertę.", "score": 6}).encode()
+    index = NearDuplicateIndex(enabled=True, max_entries=entries, min_tokens=1)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for n in range(entries):
+        text = rng.choice(texts)
+        if n % 10 == 0:
+            # Without numbers and e-mails: all in one bucket
+            text = _NUMBERS_RE.sub("", text)
+        else:
+            text += f" nr {n}"
+        index.add(index.probe(text, "scope"), answer)
+    per_entry = (tracemalloc.get_traced_memory()[0] - before) / entries
+    tracemalloc.stop()
+
+    timings = []
+    for n in range(lookups):
+        text = rng.choice(texts)
+        text = _NUMBERS_RE.sub("", text) if n % 2 else text + f" nr {rng.randrange(entries)}"
+        started = time.perf_counter()
+        index.find(index.probe(text, "scope"))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "entries": len(index._entries),
+        "bytes_per_entry": round(per_entry),
+        "p50_us": round(statistics.median(timings) * 1e6, 1),
+        "p99_us": round(timings[int(len(timings) * 0.99) - 1] * 1e6, 1),
+        "max_us": round(timings[-1] * 1e6, 1),
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=600, help="distinct messages (half short, half long)")
+    parser.add_argument("--dup-rate", type=float, default=0.3, help="share of messages that come back as near-duplicates")
+    parser.add_argument("--entries", type=int, default=5000, help="index size for the lookup timing")
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--check", action="store_true", help="exit 1 on a wrong name or a lookup p99 >= 1 ms")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    os.environ.update({"NEAR_DUP_ENABLED": "true", "LLM_LIMITER_ENABLED": "false"})
+    results = {
+        "waves": run_waves(args.leads, args.dup_rate, args.seed),
+        "lookup": run_lookup(args.entries, args.lookups, args.seed),
+    }
+    failed = results["waves"]["wrong_name"] > 0 or results["lookup"]["p99_us"] >= 1000
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        waves, lookup = results["waves"], results["lookup"]
+        print(f"waves: {waves['leads']} leads, {waves['near_duplicates_sent']} near-duplicates, "
+              f"{waves['llm_calls']} LLM calls")
+        print(f"  found {waves['found']} (recall {waves['recall']:.1%}), skipped as too short {waves['too_short']}, "
+              f"turned down by name {waves['name_mismatches']}")
+        print(f"  merged with another message {waves['merged_other_message']}, with another name {waves['wrong_name']}")
+        print(f"lookup: {lookup['entries']} entries, {lookup['bytes_per_entry']} B/entry, probe + find "
+              f"p50 {lookup['p50_us']} us, p99 {lookup['p99_us']} us, max {lookup['max_us']} us")
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
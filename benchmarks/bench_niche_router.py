@@ -0,0 +1,72 @@
+"""
+Niche routing cost as the number of niches grows.
+
+Columns: the old chained any() scan (stops at the first niche with a hit, no scoring), the two
+KeywordAutomaton strategies (str.find per keyword / Aho-Corasick table) and NicheRouter.route,
+which picks the strategy by keyword count (SUBSTRING_SCAN_MAX_KEYWORDS).
+
+Synthetic niches get 10 keywords each; the real keywords from prompts.NICHE_KEYWORDS are always included.
+
+Usage:
+    python benchmarks/bench_niche_router.py --leads 300
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from niche_router import KeywordAutomaton, NicheRouter  # noqa: E402
+from prompts import NICHE_KEYWORDS, DEFAULT_NICHE  # noqa: E402
+from bench_text_rules import synthetic_corpus  # noqa: E402
+
+
+def synthetic_niches(count: int, seed: int = 3) -> dict:
+    rng = random.Random(seed)
+    niches = dict(NICHE_KEYWORDS)
+    alphabet = "abcdefghijklmnoprstuwyząęłóż"
+    while len(niches) < count:
+        niches[f"niche_{len(niches)}"] = tuple(
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(5, 9))) for _ in range(10)
+        )
+    return niches
+
+
+def chained_scan(niches: dict, text: str) -> str:
+    normalized = text.lower()
+    for niche, keywords in niches.items():
+        if any(keyword in normalized for keyword in keywords):
+            return niche
+    return DEFAULT_NICHE
+
+
+def timed(fn, corpus: list[str]) -> float:
+    started = time.perf_counter()
+    for text in corpus:
+        fn(text)
+    return (time.perf_counter() - started) / len(corpus) * 1e6
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=300)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.leads)
+    print(f"{'niches':>7} {'keywords':>9} {'chained any() µs':>18} {'str.find µs':>12} {'automaton µs':>13} {'route µs':>9}")
+    for count in (3, 12, 24, 48, 96):
+        niches = synthetic_niches(count)
+        keywords = len({word.lower() for words in niches.values() for word in words})
+        substrings = KeywordAutomaton(niches, substring_max_keywords=10 ** 9)
+        automaton = KeywordAutomaton(niches, substring_max_keywords=0)
+        router = NicheRouter(niches, DEFAULT_NICHE)
+        chained = timed(lambda text: chained_scan(niches, text), corpus)
+        by_find = timed(lambda text: list(substrings.find(text.lower())), corpus)
+        by_automaton = timed(lambda text: list(automaton.find(text.lower())), corpus)
+        routed = timed(router.route, corpus)
+        print(f"{count:>7} {keywords:>9} {chained:>18.1f} {by_find:>12.1f} {by_automaton:>13.1f} {routed:>9.1f}")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,131 @@
+"""
+Tokens and wall time per lead: one LLM call per message vs packed mode.
+
+Runs AIService.process_leads_async over short messages with the real prompts from
+prompts.py. Groq is replaced by an in-process fake whose latency follows a simple
+model of a hosted LLM: a fixed round trip, plus prompt tokens at --input-tps and
+generated tokens at --output-tps. Tokens are counted with the same 4 chars/token
+estimate as input_cleaner.py, for both the prompt and the generated JSON.
+
+Usage:
+    python benchmarks/bench_packing.py --leads 64 --pack-size 8 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GROQ_API_KEY", "bench-key")
+
+from ai_service import AIService  # noqa: E402
+from input_cleaner import estimate_tokens  # noqa: E402
+from lead_cache import LeadCache  # noqa: E402
+from lead_packer import LeadPacker  # noqa: E402
+
+SHORT_MESSAGES = [
+    "Dzień dobry, proszę o wycenę remontu łazienki 6 m2 w Poznaniu. Tel. 601 202 303",
+    "Ile kosztuje malowanie mieszkania 50 m2? Anna",
+    "Szukam ekipy do położenia paneli, ok. 40 m2, Kraków. jan.nowak@example.com",
+    "Czy robicie elewacje? Dom 120 m2 pod Wrocławiem, termin wiosna.",
+    "Proszę o kontakt w sprawie wymiany okien, 6 sztuk. 512 345 678",
+    "Remont kuchni od zera, budżet ok. 40 tys. zł. Gdańsk.",
+]
+
+LEAD = {
+    "name": "Jan Nowak", "company": None, "email": None, "phone": "601 202 303", "product": "Remont łazienki",
+    "budget_est": None, "urgency": "średnia", "city": "Poznań",
+    "summary": "Klient prosi o wycenę remontu łazienki o powierzchni 6 m2.", "score": 7,
+}
+
+
+class FakeGroq:
+    def __init__(self, base_latency: float, input_tps: float, output_tps: float):
+        self.base_latency = base_latency
+        self.input_tps = input_tps
+        self.output_tps = output_tps
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.call_seconds = 0.0
+
+    async def create(self, **kwargs):
+        prompt = "".join(message["content"] for message in kwargs["messages"])
+        ids = [int(n) for n in re.findall(r"\[id=(\d+)\]", prompt)]
+        if ids:
+            content = json.dumps({"leads": [{"id": n, **LEAD} for n in ids]}, ensure_ascii=False)
+        else:
+            content = json.dumps(LEAD, ensure_ascii=False)
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        latency = self.base_latency + prompt_tokens / self.input_tps + completion_tokens / self.output_tps
+        await asyncio.sleep(latency)
+
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.call_seconds += latency
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+def run(packed: bool, args) -> dict:
+    service = AIService()
+    service.cache = LeadCache(max_entries=0)
+    service.packer = LeadPacker(enabled=packed, max_items=args.pack_size)
+    fake = FakeGroq(args.base_latency, args.input_tps, args.output_tps)
+    service.async_client = MagicMock()
+    service.async_client.chat.completions.create = fake.create
+
+    # Distinct texts, so nothing is coalesced or cached
+    texts = [f"{SHORT_MESSAGES[i % len(SHORT_MESSAGES)]} (#{i})" for i in range(args.leads)]
+    started = time.perf_counter()
+    results = asyncio.run(service.process_leads_async(texts, max_concurrency=args.concurrency))
+    elapsed = time.perf_counter() - started
+    assert all(not isinstance(result, Exception) for result in results)
+
+    return {
+        "mode": "packed" if packed else "single",
+        "calls": fake.calls,
+        "prompt_tokens_per_lead": round(fake.prompt_tokens / args.leads, 1),
+        "completion_tokens_per_lead": round(fake.completion_tokens / args.leads, 1),
+        "total_tokens_per_lead": round((fake.prompt_tokens + fake.completion_tokens) / args.leads, 1),
+        "wall_ms_per_lead": round(elapsed / args.leads * 1000, 2),
+        "llm_seconds_per_lead": round(fake.call_seconds / args.leads, 3),
+        "batch_seconds": round(elapsed, 2),
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=64)
+    parser.add_argument("--pack-size", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-latency", type=float, default=0.15, help="fixed seconds per call")
+    parser.add_argument("--input-tps", type=float, default=20000, help="prompt tokens processed per second")
+    parser.add_argument("--output-tps", type=float, default=750, help="generated tokens per second")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    rows = [run(False, args), run(True, args)]
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{args.leads} short leads, pack size {args.pack_size}, concurrency {args.concurrency}")
+    print(f"{'mode':<8} {'calls':>6} {'prompt tok':>11} {'output tok':>11} {'total tok':>10} {'wall ms':>9} {'LLM s':>7}   (per lead)")
+    for row in rows:
+        print(f"{row['mode']:<8} {row['calls']:>6} {row['prompt_tokens_per_lead']:>11} {row['completion_tokens_per_lead']:>11} "
+              f"{row['total_tokens_per_lead']:>10} {row['wall_ms_per_lead']:>9} {row['llm_seconds_per_lead']:>7}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,216 @@
+"""
+Request latency while the prompt registry reloads, and the cost of building a prompt.
+
+1. Prompt build: the old per-call f-string (template + output rules + text) against
+   the precompiled prefix/suffix of prompt_registry.CompiledPrompt (ns per prompt).
+2. Reload under load: --threads threads process leads through AIService.process_lead_niche
+   (routing, prompt, cache key, parse and post-processing; the Groq client is an
+   in-process fake answering at once) with PROMPTS_DIR set. The run is timed twice:
+   quiet, and while another process rewrites every prompt file each --change-every
+   seconds (write + rename, as a deploy would) and a thread of the worker checks and
+   reloads them like the watcher does, every --reload-every seconds (default: 40x the
+   default PROMPTS_RELOAD_INTERVAL rate). The two phases alternate --repeat times and
+   the median p50/p99 of each are compared (p99 alone moves by ~20% between quiet runs).
+
+With --check the script exits 1 when the reloading p99 is more than --tolerance above
+the quiet p99, or when a reload failed:
+
+    python benchmarks/bench_prompt_reload.py --check
+    python benchmarks/bench_prompt_reload.py --change-every 0.01 --reload-every 0.005
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_cpu import measure  # noqa: E402
+
+ANSWER = json.dumps({"name": "Jan Kowalski", "product": "Fotowoltaika", "summary": "Klient pyta o wycenę.",
+                     "city": "Kraków", "score": 7}, ensure_ascii=False)
+TEXTS = [
+    "Dzień dobry, proszę o wycenę instalacji fotowoltaicznej 8 kW na dachu domu. Jan, 600 100 200",
+    "Interesuje mnie pompa ciepła do domu 150 m2, jaki koszt z montażem?",
+    "Remont łazienki 6 m2, glazura i biały montaż, termin wrzesień.",
+]
+
+
+class FakeCompletions:
+    def create(self, **kwargs):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=ANSWER))], usage=None)
+
+
+def legacy_build(template: str, text: str) -> str:
+    # AIService._build_prompt before the registry (the f-string is rebuilt on every call)
+    return f"""{template}
+
+        IMPORTANT OUTPUT RULES:
+        - Return ONLY a single JSON object. No markdown, no commentary, no backticks.
+        - The JSON MUST contain exactly these keys:
+          name, company, email, phone, product, budget_est, urgency, city, summary, score
+        - Use null (without quotes) for unknown/missing values.
+        - Do NOT invent email/phone. If not present, set to null.
+        - score is REQUIRED and MUST be an integer from 1 to 10.
+        - summary MUST be in Polish, 1 sentence, correct grammar and spacing; fix obvious typos (e.g. missing spaces).
+        - summary should be human-readable (not copied raw); include the requested product/service and any numbers/budget mentioned.
+        - NEVER include profanity/vulgar words in the summary (do not quote them).
+
+        INPUT TEXT:
+        "{text}"
+
+        OUTPUT JSON:
+        """
+
+
+def write_prompts(directory: str, revision: int = 0) -> None:
+    from prompts import PROMPTS, NICHE_KEYWORDS
+    for niche, template in PROMPTS.items():
+        keywords = ", ".join(NICHE_KEYWORDS.get(niche, ()))
+        header = f"keywords: {keywords}\n---\n" if keywords else ""
+        # Write-and-rename, as a deploy tool would: a reload never reads half a file
+        path = os.path.join(directory, f"{niche}.txt")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(header + template + (f"\n(rev {revision})" if revision else ""))
+        os.replace(path + ".tmp", path)
+
+
+def rewrite_loop(directory: str, interval: float, stop) -> None:
+    """Child process: what a deploy tool does to PROMPTS_DIR, over and over."""
+    revision = 0
+    while not stop.is_set():
+        revision += 1
+        write_prompts(directory, revision)
+        stop.wait(interval)
+
+
+def bench_build(rounds: int, min_time: float) -> dict:
+    from prompts import PROMPTS
+    from prompt_registry import CompiledPrompt
+    niche, template = next(iter(PROMPTS.items()))
+    compiled = CompiledPrompt(niche, template)
+    old, _ = measure(lambda text: legacy_build(template, text), TEXTS, min_time, rounds)
+    new, _ = measure(compiled.render, TEXTS, min_time, rounds)
+    return {"legacy_ns": round(old), "compiled_ns": round(new)}
+
+
+def run_phase(service, threads: int, seconds: float, reloader=None) -> dict:
+    latencies: list[float] = []
+    versions_seen: set = set()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(offset: int):
+        local = []
+        i = offset
+        while not stop.is_set():
+            text = TEXTS[i % len(TEXTS)] + f" (nr {i})"
+            started = time.perf_counter()
+            service.process_lead_niche(text, niche=service._detect_niche(text))
+            local.append(time.perf_counter() - started)
+            i += threads
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    if reloader is not None:
+        workers.append(threading.Thread(target=reloader, args=(stop, versions_seen)))
+    for thread in workers:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    latencies.sort()
+    return {
+        "leads": len(latencies),
+        "p50_us": round(statistics.median(latencies) * 1e6, 1),
+        "p99_us": round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+        "reloads": len(versions_seen),
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=1, help="request threads (more: GIL scheduling dominates p99)")
+    parser.add_argument("--seconds", type=float, default=1.5, help="per phase and round")
+    parser.add_argument("--reload-every", type=float, default=0.05, help="seconds between reload checks")
+    parser.add_argument("--change-every", type=float, default=0.2, help="seconds between prompt file rewrites")
+    parser.add_argument("--repeat", type=int, default=3, help="quiet/reloading rounds (medians are reported)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p99 increase under reload")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--check", action="store_true", help="exit 1 when reloads slow requests down")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    from ai_service import AIService
+    from lead_cache import LeadCache
+
+    results = {"prompt_build": bench_build(args.rounds, args.min_time)}
+    with tempfile.TemporaryDirectory() as directory:
+        write_prompts(directory)
+        os.environ.update({"PROMPTS_DIR": directory, "LLM_LIMITER_ENABLED": "false"})
+        service = AIService()
+        service.cache = LeadCache(max_entries=0)
+        service.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+        registry = service.prompt_registry
+
+        def watcher(stop: threading.Event, versions_seen: set) -> None:
+            # PromptRegistry._run, minus the event loop: stat, and reload what changed
+            while not stop.is_set():
+                if registry.reload_if_changed():
+                    versions_seen.add(registry.current.version)
+                stop.wait(args.reload_every)
+
+        run_phase(service, args.threads, min(0.5, args.seconds))  # warm-up
+        rounds: dict[str, list[dict]] = {"quiet": [], "reloading": []}
+        for _ in range(args.repeat):
+            rounds["quiet"].append(run_phase(service, args.threads, args.seconds))
+            stop_writer = multiprocessing.Event()
+            writer = multiprocessing.Process(target=rewrite_loop, args=(directory, args.change_every, stop_writer))
+            writer.start()
+            try:
+                rounds["reloading"].append(run_phase(service, args.threads, args.seconds, watcher))
+            finally:
+                stop_writer.set()
+                writer.join()
+        for phase, rows in rounds.items():
+            results[phase] = {
+                "leads": sum(row["leads"] for row in rows),
+                "p50_us": statistics.median(row["p50_us"] for row in rows),
+                "p99_us": statistics.median(row["p99_us"] for row in rows),
+                "reloads": sum(row["reloads"] for row in rows),
+            }
+        results["reload_errors"] = registry.reload_errors
+
+    slowdown = results["reloading"]["p99_us"] / results["quiet"]["p99_us"] - 1
+    results["p99_slowdown"] = round(slowdown, 4)
+    failed = slowdown > args.tolerance or results["reload_errors"] > 0
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        build = results["prompt_build"]
+        print(f"prompt build: f-string {build['legacy_ns']} ns -> precompiled {build['compiled_ns']} ns")
+        print(f"{args.threads} threads, {args.repeat} x {args.seconds}s per phase, files changed every "
+              f"{args.change_every}s, checked every {args.reload_every}s")
+        print(f"{'phase':<10} {'leads':>7} {'p50':>9} {'p99':>9} {'reloads':>8}")
+        for phase in ("quiet", "reloading"):
+            row = results[phase]
+            print(f"{phase:<10} {row['leads']:>7} {row['p50_us']:>7.1f}µs {row['p99_us']:>7.1f}µs {row['reloads']:>8}")
+        print(f"p99 under reload: {slowdown:+.1%} (tolerance {args.tolerance:.0%})")
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,162 @@
+"""
+Per-lead validation and serialization cost, before and after the single rendering
+path (schemas.render_json, lead_parser.validate_json, memoized e-mail validation).
+
+Stages of one lead, each timed over a corpus of model answers with distinct names
+and e-mail addresses (µs per lead, best of --rounds):
+
+- parse: model answer -> Lead
+- cache write: Lead -> cache entry
+- cache hit: cache entry -> Lead (same lead again, so its e-mail was seen before)
+- db payload: Lead -> insert body (dict, then the JSON the HTTP client sends)
+- response: Lead -> HTTP body of /process-lead
+- spool: Lead -> write-behind spool row and back
+
+"before" replays the code as it was: json.loads + Lead(**data) with plain EmailStr,
+json.dumps of model_dump(mode="json") for the cache and spool, lead.dict() for the
+database and FastAPI's response_model serialization for the response.
+
+    python benchmarks/bench_serialization.py --leads 2000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import warnings
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from pydantic import EmailStr  # noqa: E402
+
+import fast_json  # noqa: E402
+from benchmarks.bench_cpu import measure  # noqa: E402
+from benchmarks.lead_corpus import CITIES, SUMMARIES, _person  # noqa: E402
+from lead_parser import validate_json  # noqa: E402
+import schemas  # noqa: E402
+from schemas import Lead, render_json  # noqa: E402
+
+
+class PlainLead(Lead):
+    """Lead as it was: e-mail validated by email-validator on every construction."""
+    email: Optional[EmailStr] = None
+
+
+FIELDS = set(Lead.model_fields)
+
+
+def answers(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(count):
+        name, email, phone = _person(rng)
+        out.append(json.dumps({
+            "name": name, "company": None, "email": email, "phone": phone, "product": "Fotowoltaika",
+            "budget_est": f"{rng.randint(5, 90)} 000 zł", "urgency": rng.choice((None, "Wysoka", "Niska")),
+            "city": rng.choice(CITIES), "summary": rng.choice(SUMMARIES), "score": rng.randint(1, 10),
+        }, ensure_ascii=False))
+    return out
+
+
+def _run(coroutine):
+    # serialize_response never awaits for an async endpoint; run it without an event loop
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("serialize_response suspended")
+
+
+def stages(response_field) -> dict[str, dict[str, tuple]]:
+    """stage -> {"before"/"after": (input kind, callable)}."""
+    def httpx_body(payload: dict) -> bytes:
+        # What httpx does with json= (postgrest passes the insert body that way)
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+    return {
+        "parse": {
+            "before": ("raw", lambda raw: PlainLead(**{k: v for k, v in json.loads(raw).items() if k in FIELDS})),
+            # A new lead's address has not been seen before: no help from the e-mail memo
+            "after": ("raw", lambda raw: (schemas._valid_emails.clear(), validate_json(raw))[1]),
+        },
+        "cache write": {
+            "before": ("plain", lambda lead: json.dumps(lead.model_dump(mode="json"), ensure_ascii=False)),
+            "after": ("lead", lambda lead: render_json(lead).decode("utf-8")),
+        },
+        "cache hit": {
+            "before": ("entry", lambda entry: PlainLead(**json.loads(entry))),
+            "after": ("entry", lambda entry: Lead(**fast_json.loads(entry))),
+        },
+        "db payload": {
+            "before": ("plain", lambda lead: httpx_body(lead.dict())),
+            "after": ("lead", lambda lead: httpx_body(lead.model_dump())),
+        },
+        "response": {
+            "before": ("plain", lambda lead: _run(serialize_response(field=response_field, response_content=lead,
+                                                                      dump_json=True))),
+            "after": ("lead", render_json),
+        },
+        "spool": {
+            "before": ("plain", lambda lead: PlainLead(**json.loads(json.dumps(lead.model_dump(mode="json"),
+                                                                                 ensure_ascii=False)))),
+            "after": ("lead", lambda lead: Lead.model_validate_json(render_json(lead).decode("utf-8"))),
+        },
+    }
+
+
+def run(args) -> dict:
+    app = FastAPI()
+
+    @app.post("/process-lead", response_model=Lead)
+    async def process_lead():  # pragma: no cover - only its response field is used
+        pass
+
+    raw = answers(args.leads, args.seed)
+    inputs = {
+        "raw": raw,
+        "lead": [Lead.model_validate_json(r) for r in raw],
+        "plain": [PlainLead.model_validate_json(r) for r in raw],
+        "entry": [render_json(Lead.model_validate_json(r)).decode("utf-8") for r in raw],
+    }
+    results = {}
+    for stage, variants in stages(app.routes[-1].response_field).items():
+        row = {}
+        for variant, (kind, fn) in variants.items():
+            ns, _ = measure(fn, inputs[kind], args.min_time, args.rounds)
+            row[variant] = round(ns / 1000, 2)
+        results[stage] = row
+    return results
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=1000, help="distinct model answers")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per timing round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    warnings.simplefilter("ignore", DeprecationWarning)  # lead.dict() in the "before" column
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'stage':<12} {'before µs':>10} {'after µs':>10} {'speedup':>8}")
+    for stage, row in results.items():
+        print(f"{stage:<12} {row['before']:>10.2f} {row['after']:>10.2f} {row['before'] / row['after']:>7.1f}x")
+    miss = ("parse", "cache write", "db payload", "response")
+    hit = ("cache hit", "db payload", "response")
+    for label, path in (("new lead", miss), ("cache hit", hit)):
+        before = sum(results[s]["before"] for s in path)
+        after = sum(results[s]["after"] for s in path)
+        print(f"per lead, {label}: {before:.1f} µs -> {after:.1f} µs")
+
+
+if __name__ == "__main__":
+    main_cli()
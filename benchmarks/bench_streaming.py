@@ -0,0 +1,94 @@
+"""
+Blocking vs streamed completions on the /process-lead path, against the stub LLM
+generating at a fixed token rate (no Supabase: only the AI part is timed).
+
+- blocking: one request, the answer is parsed when the whole completion is there
+  (the object plus whatever the model writes after it, up to max_tokens)
+- streaming: the answer is read as it is generated; fields are reported as they
+  complete and the stream is closed at the object's closing brace
+
+For each mode: time to the first field (blocking: the whole answer) and total
+latency until the post-processed lead, p50 over --leads sequential leads.
+
+    python benchmarks/bench_streaming.py --leads 20 --tokens-per-second 500 --trailer-tokens 150
+    python benchmarks/bench_streaming.py --trailer-tokens 0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_servers import StubLLM  # noqa: E402
+
+TRAILER_WORD = "Uwaga "  # ~1.5 stub chunks per word
+
+
+async def run_mode(url: str, streaming: bool, leads: int) -> dict:
+    import groq
+    from ai_service import AIService
+    from lead_cache import LeadCache
+
+    ai = AIService()
+    ai.cache = LeadCache(max_entries=0)
+    # Created and closed in this event loop: its connections must not outlive the loop
+    ai.async_client = groq.AsyncGroq(api_key="bench", base_url=url, max_retries=0)
+    first_fields, totals = [], []
+    try:
+        for i in range(leads):
+            started = time.perf_counter()
+            first = []
+
+            def on_field(model, field, value):
+                if not first:
+                    first.append(time.perf_counter() - started)
+
+            await ai.process_lead_text_async(f"Dzień dobry, proszę o wycenę fotowoltaiki 8 kW (nr {i}).",
+                                             on_field=on_field if streaming else None)
+            total = time.perf_counter() - started
+            totals.append(total)
+            first_fields.append(first[0] if first else total)
+    finally:
+        await ai.async_client.close()
+    return {
+        "first_field_p50_ms": round(statistics.median(first_fields) * 1000, 1),
+        "total_p50_ms": round(statistics.median(totals) * 1000, 1),
+        "stream_stats": ai.stream_stats.stats() if streaming else None,
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--trailer-tokens", type=int, default=150, help="tokens the model writes after the object")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    trailer = "\n\n" + TRAILER_WORD * round(args.trailer_tokens / 1.5) if args.trailer_tokens else ""
+    results = {}
+    with StubLLM(latency=args.latency, tokens_per_second=args.tokens_per_second, trailer=trailer) as llm:
+        # One discarded lead pays the one-time costs (SDK import, connection)
+        asyncio.run(run_mode(llm.url, streaming=False, leads=1))
+        for label, streaming in (("blocking", False), ("streaming", True)):
+            results[label] = asyncio.run(run_mode(llm.url, streaming, args.leads))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.leads} leads, {args.latency * 1000:.0f} ms to first token, {args.tokens_per_second:.0f} tokens/s, "
+          f"{args.trailer_tokens} tokens after the object")
+    print(f"{'mode':<10} {'first field':>12} {'total':>10}")
+    for label, row in results.items():
+        print(f"{label:<10} {row['first_field_p50_ms']:>10.1f}ms {row['total_p50_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,164 @@
+"""
+Microbenchmark of lead post-processing: legacy per-rule regex scans vs text_rules.
+
+Builds a synthetic corpus of Polish lead messages (short, long, with contacts and
+profanity), checks both implementations produce identical leads and reports the
+time per lead.
+
+Usage:
+    python benchmarks/bench_text_rules.py --leads 2000 --repeat 3
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GROQ_API_KEY", "bench-key")
+
+from ai_service import AIService  # noqa: E402
+from schemas import Lead  # noqa: E402
+
+WORDS = (
+    "dzień dobry proszę o wycenę instalacji fotowoltaicznej na dachu domu jednorodzinnego "
+    "interesuje mnie pompa ciepła powietrze woda oraz klimatyzacja do biura budżet około "
+    "zł termin realizacji wiosna pozdrawiam serdecznie z poważaniem firma sp. z o.o. Kraków "
+    "Warszawa Gdańsk Poznań rekuperacja montaż serwis gwarancja kW m2 dach skośny"
+).split()
+PROFANITY = ("kurwa", "chuj", "jebany", "pierdolę")
+
+
+def synthetic_corpus(size: int, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        length = rng.choice((12, 40, 120, 600))
+        words = [rng.choice(WORDS) for _ in range(length)]
+        if rng.random() < 0.6:
+            words.insert(rng.randrange(len(words)), f"jan.kowalski{i}@example.com")
+        if rng.random() < 0.6:
+            words.insert(rng.randrange(len(words)), f"+48 {rng.randint(500, 899)} {rng.randint(100, 999)} {rng.randint(100, 999)}")
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), rng.choice(PROFANITY))
+        corpus.append(" ".join(words))
+    return corpus
+
+
+class LegacyPostprocessor:
+    """Post-processing as implemented before text_rules (uncompiled, one scan per rule)."""
+
+    def _profanity_patterns(self):
+        return (r"\bkurw\w*\b", r"\bchuj\w*\b", r"\bjeb\w*\b", r"\bpierdol\w*\b", r"\bskurw\w*\b", r"\bspierdol\w*\b")
+
+    def _contains_profanity(self, text):
+        normalized = (text or "").lower()
+        return any(re.search(p, normalized, re.IGNORECASE) for p in self._profanity_patterns())
+
+    def _remove_profanity_terms(self, text):
+        if not text:
+            return text
+        sanitized = text
+        for pattern in self._profanity_patterns():
+            sanitized = re.sub(pattern, "", sanitized, flags=re.IGNORECASE)
+        sanitized = re.sub(r"\s{2,}", " ", sanitized).strip()
+        return re.sub(r"\s+([,.;:!?])", r"\1", sanitized)
+
+    def _fix_common_summary_typos(self, summary):
+        if not summary:
+            return summary
+        fixed = re.sub(r"fotowoltaj", "fotowoltaic", summary, flags=re.IGNORECASE)
+        fixed = re.sub(r"fotowoltai", "fotowoltaic", fixed, flags=re.IGNORECASE).strip()
+        if fixed and fixed[0].islower():
+            fixed = fixed[0].upper() + fixed[1:]
+        if fixed and fixed[-1] not in ".!?":
+            fixed += "."
+        return fixed
+
+    def _sanitize_name(self, name):
+        if not name:
+            return None
+        s = name.strip()
+        if not s or len(s) > 60 or any(ch.isdigit() for ch in s) or "@" in s:
+            return None
+        noise = ("pokoi", "pokoj", "pokoje", "wyceny", "wycena", "grupy", "grupa", "osób", "osoby", "osoba",
+                 "tydzie", "dla", "proszę", "prosze", "rezerwac", "nocleg", "hotel", "klimatyz", "fotowolt",
+                 "pompa", "rekuper", "budżet", "budzet", "termin", "ofert")
+        if any(k in s.lower() for k in noise):
+            return None
+        name_regex = re.compile(r"^[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+( [A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż\.]+){0,2}$")
+        return s if name_regex.match(s) else None
+
+    def _postprocess_lead(self, lead, source_text):
+        if self._contains_profanity(source_text):
+            lead.summary = self._remove_profanity_terms(lead.summary)
+        lead.summary = self._fix_common_summary_typos(lead.summary)
+        if self._contains_profanity(source_text):
+            note = "Wiadomość zawiera wulgarny język."
+            if lead.summary:
+                if note.lower() not in lead.summary.lower():
+                    lead.summary = lead.summary.rstrip(" .") + ". " + note
+            else:
+                lead.summary = note
+            if lead.score > 1:
+                lead.score = max(1, lead.score - 1)
+        if lead.score <= 2:
+            neutral = "Zapytanie poza zakresem oferty."
+            if lead.summary and "wulgarny" in lead.summary.lower():
+                lead.summary = neutral + " Wiadomość zawiera wulgarny język."
+            else:
+                lead.summary = neutral
+        lead.name = self._sanitize_name(lead.name)
+        if not lead.email:
+            m = re.search(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", source_text)
+            lead.email = m.group(0) if m else None
+        if not lead.phone:
+            m = re.search(r"\+?\d[\d\s\-()]{6,}\d", source_text)
+            lead.phone = m.group(0).strip() if m else None
+        return lead
+
+
+def llm_lead(i: int) -> Lead:
+    return Lead(name="Jan Kowalski" if i % 2 else "Wycena dla firmy", product="Fotowoltaika",
+                summary="klient kurwa pyta o fotowoltaike  , budżet 40 000 zł", score=(i % 10) + 1)
+
+
+def run(processor, corpus: list[str]) -> tuple[float, list[dict]]:
+    outputs = []
+    started = time.perf_counter()
+    for i, text in enumerate(corpus):
+        outputs.append(processor._postprocess_lead(llm_lead(i), text))
+    elapsed = time.perf_counter() - started
+    return elapsed, [lead.model_dump() for lead in outputs]
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    corpus = synthetic_corpus(args.leads)
+    chars = sum(len(text) for text in corpus)
+    print(f"corpus: {len(corpus)} leads, {chars / len(corpus):.0f} chars/lead on average")
+
+    legacy, current = LegacyPostprocessor(), AIService()
+    best = {}
+    for label, processor in (("legacy", legacy), ("text_rules", current)):
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, outputs = run(processor, corpus)
+            timings.append(elapsed)
+        best[label] = (min(timings), outputs)
+        print(f"{label:<11} {min(timings) / len(corpus) * 1e6:8.1f} µs/lead")
+
+    assert best["legacy"][1] == best["text_rules"][1], "outputs differ between implementations"
+    print(f"speedup: {best['legacy'][0] / best['text_rules'][0]:.2f}x, outputs identical")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,151 @@
+"""
+Synthetic Polish lead corpora for the CPU benchmarks.
+
+Each record has the three inputs post-processing sees: the source `text`, the model's
+`summary` and the model's `name`. Three kinds:
+
+- short: one- or two-line web form messages (most of the traffic)
+- long: e-mails of a few KB with quoted replies, signatures, footers and contacts
+- pathological: inputs that stress regex engines, e.g. a base64 attachment pasted
+  into the body (a long run of e-mail local-part characters with no "@"), long runs
+  of digits, separators and whitespace, "@" without a domain, repeated profanity,
+  and names or summaries far longer than the model should ever return
+
+The corpus is deterministic for a given seed and size.
+
+    python benchmarks/lead_corpus.py --kind long --count 3   # print samples
+"""
+import argparse
+import base64
+import json
+import random
+
+GREETINGS = ("Dzień dobry,", "Witam,", "Szanowni Państwo,", "Cześć,", "Dobry wieczór,")
+REQUESTS = (
+    "proszę o wycenę instalacji fotowoltaicznej 8 kW na dachu skośnym",
+    "interesuje mnie pompa ciepła powietrze-woda do domu 150 m2",
+    "szukam ekipy do remontu łazienki 6 m2, termin najlepiej w maju",
+    "potrzebujemy klimatyzacji do biura na 12 osób",
+    "chcielibyśmy zarezerwować 4 pokoje dla grupy 8 osób na weekend",
+    "proszę o ofertę rekuperacji do domu w budowie",
+    "ile kosztuje malowanie mieszkania 50 m2 z gładziami",
+    "czy robicie elewacje? Dom 120 m2 pod Wrocławiem",
+)
+DETAILS = (
+    "Budżet około {budget} zł.", "Termin realizacji: {month}.", "Lokalizacja: {city}.",
+    "Dach kryty blachodachówką, kierunek południowy.", "Zależy nam na gwarancji i serwisie.",
+    "Proszę o kontakt telefoniczny po 16:00.", "Mamy już projekt i pozwolenie na budowę.",
+)
+CITIES = ("Kraków", "Warszawa", "Gdańsk", "Poznań", "Wrocław", "Łódź", "Szczecin", "Lublin")
+MONTHS = ("maj", "czerwiec", "wrzesień", "przełom marca i kwietnia", "jak najszybciej")
+FIRST_NAMES = ("Jan", "Anna", "Piotr", "Katarzyna", "Tomasz", "Małgorzata", "Łukasz", "Żaneta")
+LAST_NAMES = ("Kowalski", "Nowak", "Wiśniewska", "Wójcik", "Kamińska", "Lewandowski", "Zieliński")
+PROFANITY = ("kurwa", "chuj", "jebany", "pierdolę", "spierdalaj")
+SUMMARIES = (
+    "Klient pyta o fotowoltaike 8 kW, budżet około 35 000 zł",
+    "klientka prosi o wycenę pompy ciepła do domu 150 m2",
+    "Zapytanie o remont łazienki w maju",
+    "grupa 8 osób szuka noclegu na weekend",
+)
+FOOTER = (
+    "Ta wiadomość może zawierać informacje poufne. Jeżeli nie jesteś jej adresatem, "
+    "usuń ją i powiadom nadawcę. Administratorem danych osobowych jest Firma Sp. z o.o."
+)
+
+
+def _person(rng: random.Random) -> tuple[str, str, str]:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    email = f"{first.lower()}.{last.lower()}{rng.randint(1, 99)}@example.com".replace("ł", "l").replace("ż", "z")
+    phone = rng.choice((
+        f"+48 {rng.randint(500, 899)} {rng.randint(100, 999)} {rng.randint(100, 999)}",
+        f"{rng.randint(500, 899)}-{rng.randint(100, 999)}-{rng.randint(100, 999)}",
+        f"(12) {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}",
+    ))
+    return f"{first} {last}", email, phone
+
+
+def _detail(rng: random.Random) -> str:
+    return rng.choice(DETAILS).format(budget=f"{rng.randint(5, 90)} 000", month=rng.choice(MONTHS), city=rng.choice(CITIES))
+
+
+def short_record(rng: random.Random) -> dict:
+    name, email, phone = _person(rng)
+    parts = [rng.choice(GREETINGS), rng.choice(REQUESTS) + ".", _detail(rng)]
+    if rng.random() < 0.5:
+        parts.append(rng.choice((email, f"tel. {phone}")))
+    if rng.random() < 0.05:
+        parts.insert(2, rng.choice(PROFANITY))
+    parts.append(name.split()[0])
+    return {"text": " ".join(parts), "summary": rng.choice(SUMMARIES), "name": rng.choice((name, name.split()[0], None))}
+
+
+def long_record(rng: random.Random) -> dict:
+    name, email, phone = _person(rng)
+    body = [rng.choice(GREETINGS), ""]
+    for _ in range(rng.randint(3, 8)):
+        body.append(" ".join([rng.choice(REQUESTS).capitalize() + "."] + [_detail(rng) for _ in range(rng.randint(2, 5))]))
+    body += ["", "Pozdrawiam serdecznie", name, f"tel. {phone}", email, "", FOOTER]
+    # Quoted thread below the reply, a few levels deep
+    for depth in range(1, rng.randint(2, 5)):
+        quoted_name, quoted_email, _ = _person(rng)
+        body.append("")
+        body.append(f"{'>' * (depth - 1)} W dniu 12.03.2026 o 10:1{depth}, {quoted_name} <{quoted_email}> napisał(a):")
+        for _ in range(rng.randint(3, 10)):
+            body.append(f"{'>' * depth} {rng.choice(REQUESTS)}. {_detail(rng)}")
+    summary = " ".join(rng.choice(SUMMARIES) for _ in range(rng.randint(1, 3)))
+    return {"text": "\n".join(body), "summary": summary, "name": name}
+
+
+def pathological_record(rng: random.Random, size: int = 8000) -> dict:
+    """One adversarial input of roughly `size` characters (the shape is picked at random)."""
+    kind = rng.choice((
+        "base64", "local_part_run", "digit_runs", "separator_runs", "at_without_domain",
+        "profanity_run", "whitespace", "mixed",
+    ))
+    if kind == "base64":
+        blob = base64.b64encode(rng.randbytes(size * 3 // 4)).decode()
+        text = "Dzień dobry, w załączniku zdjęcia dachu.\n" + blob
+    elif kind == "local_part_run":
+        text = "Link: https://example.com/?ref=" + "".join(rng.choice("abcdef0123456789-_.%") for _ in range(size))
+    elif kind == "digit_runs":
+        text = " ".join(str(rng.randint(0, 9)) * rng.randint(1, 5) for _ in range(size // 3))
+    elif kind == "separator_runs":
+        text = "".join(rng.choice(("1", "-", " ", "(", ")", "\t", "\n")) for _ in range(size)) + "x"
+    elif kind == "at_without_domain":
+        text = " ".join(f"user{i}@host{i}" for i in range(size // 14))
+    elif kind == "profanity_run":
+        text = " ".join(rng.choice(PROFANITY + ("kurwakurwakurwa", "jeb" * 20)) for _ in range(size // 8))
+    elif kind == "whitespace":
+        text = "Tel. 6" + " " * size + "koniec"
+    else:
+        text = "".join(rng.choice(("a", "1", "@", ".", " ", "-", "ó", "\n")) for _ in range(size))
+    summary = " ".join(rng.choice(SUMMARIES + PROFANITY + ("fotowoltaj", "  ,  ")) for _ in range(size // 40))
+    name = rng.choice(("Jan " * (size // 4), "A" + "a" * (size // 2), "Ła" * 40, text[:60]))
+    return {"kind": kind, "text": text, "summary": summary, "name": name}
+
+
+def generate(kind: str, count: int, seed: int = 7, size: int = 8000) -> list[dict]:
+    """`count` records of one kind ("short", "long" or "pathological")."""
+    rng = random.Random(f"{seed}:{kind}")
+    if kind == "short":
+        return [short_record(rng) for _ in range(count)]
+    if kind == "long":
+        return [long_record(rng) for _ in range(count)]
+    if kind == "pathological":
+        return [pathological_record(rng, size) for _ in range(count)]
+    raise ValueError(f"Unknown corpus kind: {kind}")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=("short", "long", "pathological"), default="short")
+    parser.add_argument("--count", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--size", type=int, default=8000, help="characters per pathological input")
+    args = parser.parse_args()
+    for record in generate(args.kind, args.count, args.seed, args.size):
+        print(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main_cli()
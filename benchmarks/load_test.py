@@ -0,0 +1,230 @@
+"""
+End-to-end load test: real uvicorn workers running main:app against local Groq and
+Supabase stand-ins (benchmarks/stub_servers.py, started in their own process).
+
+For every worker count the app is started with `uvicorn --workers N`; for every
+concurrency level a closed-loop generator keeps that many requests in flight until
+--requests have completed. Each text is unique, so the response cache and request
+coalescing do not shortcut the LLM call. Reports req/s and p50/p95/p99 latency and
+writes all results, the configuration and the stub counters to a JSON file.
+
+Usage:
+    python benchmarks/load_test.py --workers 1,2 --concurrency 8,32,64 --requests 300 \\
+        --llm-latency lognormal:0.3:0.5 --llm-429-rate 0.02 --output results.json
+
+Extra app settings go through --env, e.g. --env LLM_CONCURRENCY_MAX=32 --env WRITE_BEHIND_ENABLED=true.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_TEXT = "Dzień dobry, proszę o wycenę remontu łazienki 8 m2 w Krakowie. Jan Kowalski, tel. 601 202 303"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def start_stubs(args) -> tuple[subprocess.Popen, dict]:
+    command = [
+        sys.executable, os.path.join(ROOT, "benchmarks", "stub_servers.py"),
+        "--llm-latency", args.llm_latency, "--llm-max-concurrency", str(args.llm_max_concurrency),
+        "--llm-rpm", str(args.llm_rpm), "--llm-429-rate", str(args.llm_429_rate),
+        "--llm-error-rate", str(args.llm_error_rate), "--llm-retry-after", str(args.llm_retry_after),
+        "--db-latency", args.db_latency, "--db-error-rate", str(args.db_error_rate),
+    ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError("Stub servers did not start")
+    return process, json.loads(line)
+
+
+def start_app(workers: int, port: int, stubs: dict, extra_env: dict, verbose: bool) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "load-test",
+        "GROQ_BASE_URL": stubs["llm_url"],
+        "SUPABASE_URL": stubs["db_url"],
+        "SUPABASE_KEY": "load-test",
+        **extra_env,
+    }
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+    ]
+    # The app logs every lead at INFO; keep that out of the report unless asked for
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=output)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode} (rerun with --verbose for its logs)")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("App did not become ready")
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, total: int, warmup: int, timeout: float) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        counter = 0
+        latencies: list[float] = []
+        statuses: dict[str, int] = {}
+
+        async def one(record: bool) -> None:
+            nonlocal counter
+            counter += 1
+            body = {"text": f"{SAMPLE_TEXT} (zapytanie {run_id}-{counter})"}
+            started = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if record:
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        async def worker(count: int, record: bool) -> None:
+            for _ in range(count):
+                await one(record)
+
+        def split(n: int) -> list[int]:
+            return [n // concurrency + (1 if i < n % concurrency else 0) for i in range(concurrency)]
+
+        await asyncio.gather(*(worker(n, False) for n in split(warmup)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n, True) for n in split(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = statuses.get("200", 0)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "errors": total - ok,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1", help="comma-separated uvicorn worker counts")
+    parser.add_argument("--concurrency", default="8,32", help="comma-separated in-flight request counts")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each level")
+    parser.add_argument("--endpoint", default="/process-lead")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--llm-latency", default="lognormal:0.3:0.4")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0)
+    parser.add_argument("--llm-rpm", type=int, default=0)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-retry-after", type=float, default=0.5)
+    parser.add_argument("--db-latency", default="lognormal:0.02:0.3")
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own logs")
+    parser.add_argument("--output", default=None, help="JSON results file (default: benchmarks/results/load-<time>.json)")
+    args = parser.parse_args()
+
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    levels = [int(n) for n in args.concurrency.split(",")]
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    started_at = datetime.now(timezone.utc)
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"load-{started_at:%Y%m%d-%H%M%S}.json")
+
+    stubs_process, stubs = start_stubs(args)
+    results = []
+    try:
+        for workers in worker_counts:
+            port = free_port()
+            app = start_app(workers, port, stubs, extra_env, args.verbose)
+            try:
+                for concurrency in levels:
+                    row = asyncio.run(run_level(f"http://127.0.0.1:{port}", args.endpoint, concurrency,
+                                                args.requests, args.warmup, args.timeout))
+                    row = {"workers": workers, **row}
+                    results.append(row)
+                    print(f"workers={workers:<2} concurrency={concurrency:<4} {row['rps']:>8.1f} req/s  "
+                          f"p50={row['p50_ms']:>7.1f}ms p95={row['p95_ms']:>7.1f}ms p99={row['p99_ms']:>7.1f}ms  "
+                          f"errors={row['errors']}", flush=True)
+            finally:
+                stop_process(app)
+        stub_stats = {
+            name: httpx.get(f"{stubs[key]}/__stats", timeout=5).json()
+            for name, key in (("llm", "llm_url"), ("db", "db_url"))
+        }
+    finally:
+        stop_process(stubs_process)
+
+    report = {
+        "started_at": started_at.isoformat(),
+        "git_commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+        "stubs": stub_stats,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
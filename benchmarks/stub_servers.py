@@ -0,0 +1,389 @@
+"""
+Local stand-ins for the external APIs, served by uvicorn on 127.0.0.1.
+
+StubLLM speaks the OpenAI/Groq chat completions route (POST /openai/v1/chat/completions)
+and can simulate a provider under pressure: a latency distribution, a cap on
+concurrent requests and on requests per minute (over a cap: 429 with Retry-After,
+like Groq does), plus randomly injected 429s and 500s.
+
+StubSupabase accepts PostgREST inserts (POST /rest/v1/<table>) and answers 201 with
+the inserted rows, after its own latency and with an optional error rate. Reads
+(GET, used by the warm-up) return no rows.
+
+    with StubLLM(max_concurrency=3, latency=0.05) as llm:
+        client = AsyncGroq(api_key="stub", base_url=llm.url, max_retries=0)
+
+Both expose their counters at GET /__stats and serve HTTPS when given a certificate
+(tls=self_signed_cert(tmpdir)), so TLS handshakes can be measured too. Used by the
+limiter tests and the benchmarks in this directory; run directly to serve both in a
+separate process:
+
+    python benchmarks/stub_servers.py --llm-latency lognormal:0.3:0.5 --llm-429-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_LEAD = {
+    "name": "Jan Kowalski", "company": None, "email": "jan@example.com", "phone": None,
+    "product": "Fotowoltaika", "budget_est": "30 000 PLN", "urgency": None, "city": "Kraków",
+    "summary": "Klient pyta o instalację fotowoltaiczną.", "score": 7,
+}
+
+LatencySpec = Union[float, str, Callable[[], float]]
+
+
+def parse_latency(spec: LatencySpec, rng: Optional[random.Random] = None) -> Callable[[], float]:
+    """
+    Seconds per request as a sampler. Accepts a number (constant) or a string:
+    "0.2", "uniform:0.1:0.5", "lognormal:<median>:<sigma>", "exp:<mean>".
+    """
+    if callable(spec):
+        return spec
+    rng = rng or random.Random()
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    kind, _, rest = str(spec).partition(":")
+    params = [float(p) for p in rest.split(":")] if rest else []
+    if not rest:
+        value = float(kind)
+        return lambda: value
+    if kind == "uniform":
+        low, high = params
+        return lambda: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = params
+        return lambda: rng.lognormvariate(math.log(median), sigma)
+    if kind == "exp":
+        (mean,) = params
+        return lambda: rng.expovariate(1 / mean)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def self_signed_cert(directory: str) -> tuple[str, str]:
+    """(certfile, keyfile) of a fresh self-signed certificate for 127.0.0.1 (needs the openssl CLI)."""
+    certfile, keyfile = os.path.join(directory, "stub-cert.pem"), os.path.join(directory, "stub-key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+
+class StubServer:
+    """
+    Runs an ASGI app under uvicorn in a background thread on a free local port.
+    tls=(certfile, keyfile) serves HTTPS (clients then need verify=certfile). Idle
+    connections are kept for 75 s (uvicorn's default is 5 s; API front ends keep
+    them for minutes), so the client side decides when they are dropped.
+    """
+
+    def __init__(self, app, port: int = 0, tls: Optional[tuple[str, str]] = None):
+        self.app = app
+        self.tls = tls
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", port))
+        self.port = self._socket.getsockname()[1]
+        certfile, keyfile = tls or (None, None)
+        config = uvicorn.Config(app, log_level="warning", lifespan="off", backlog=4096, timeout_keep_alive=75,
+                                ssl_certfile=certfile, ssl_keyfile=keyfile)
+        self._server = uvicorn.Server(config)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self.port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [self._socket]}, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Stub server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubLLM(StubServer):
+    """
+    Fake Groq chat completions endpoint.
+
+    max_concurrency / requests_per_minute: 0 = no limit; over the limit the request
+    is answered with 429 and `Retry-After: retry_after`. rate_limit_rate / error_rate
+    inject 429s / 500s at random. Every accepted request waits a latency sample and
+    returns `content` (the JSON of DEFAULT_LEAD by default).
+
+    models={"<model>": {"content": ..., "latency": ...}} answers requests for that
+    model with its own content and/or latency (a cheap and a strong model of a
+    cascade); accepted requests are counted per model in `by_model`.
+
+    Generation time: with tokens_per_second > 0 the answer takes one
+    `chunk_chars`-character chunk (about a token) per 1/tokens_per_second after the
+    latency sample. `trailer` is text the model writes after the JSON object (a
+    model that does not stop at the closing brace). Requests with "stream": true
+    get the chunks as chat.completion.chunk events as they are generated; streams
+    the client closes before the end are counted in `streams_stopped`.
+    """
+
+    def __init__(
+        self,
+        latency: LatencySpec = 0.0,
+        max_concurrency: int = 0,
+        requests_per_minute: int = 0,
+        retry_after: float = 0.05,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        content: Optional[str] = None,
+        models: Optional[dict[str, dict]] = None,
+        tokens_per_second: float = 0.0,
+        chunk_chars: int = 4,
+        trailer: str = "",
+        seed: Optional[int] = None,
+        port: int = 0,
+        tls: Optional[tuple[str, str]] = None,
+    ):
+        self._rng = random.Random(seed)
+        self.latency = parse_latency(latency, self._rng)
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.content = content if content is not None else json.dumps(DEFAULT_LEAD, ensure_ascii=False)
+        self.models = {
+            name: {"content": spec.get("content", self.content),
+                   "latency": parse_latency(spec["latency"], self._rng) if "latency" in spec else self.latency}
+            for name, spec in (models or {}).items()
+        }
+        self.by_model: dict[str, int] = {}
+        self.tokens_per_second = tokens_per_second
+        self.chunk_chars = max(1, chunk_chars)
+        self.trailer = trailer
+        self.streams = 0
+        self.streams_stopped = 0
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.accepted = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._minute_start = time.monotonic()
+        self._minute_count = 0
+
+        app = FastAPI()
+        app.post("/openai/v1/chat/completions")(self._completions)
+        app.get("/openai/v1/models")(self._models)
+        app.get("/__stats")(self.stats)
+        super().__init__(app, port, tls)
+
+    @property
+    def url(self) -> str:
+        # base_url for Groq(...) / AsyncGroq(...) and GROQ_BASE_URL
+        return self.base_url
+
+    def _over_limit(self) -> bool:
+        now = time.monotonic()
+        if now - self._minute_start >= 60:
+            self._minute_start, self._minute_count = now, 0
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return True
+        if self.requests_per_minute and self._minute_count >= self.requests_per_minute:
+            return True
+        return self._rng.random() < self.rate_limit_rate
+
+    async def _completions(self, body: dict):
+        # All handlers run on the server's single event loop, so the counters need no lock
+        if self._over_limit():
+            self.rate_limited += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": str(self.retry_after)},
+            )
+        self._minute_count += 1
+        model = body.get("model", "stub")
+        override = self.models.get(model, {})
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            latency = override.get("latency", self.latency)()
+            if latency > 0:
+                await asyncio.sleep(latency)
+        finally:
+            self.in_flight -= 1
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"message": "Internal server error", "type": "internal_error"}}, status_code=500)
+        self.accepted += 1
+        self.by_model[model] = self.by_model.get(model, 0) + 1
+        content = override.get("content", self.content) + self.trailer
+        if body.get("stream"):
+            return StreamingResponse(self._stream(model, content), media_type="text/event-stream")
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(self._chunks(content)) / self.tokens_per_second)
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        return {
+            "id": f"chatcmpl-stub-{self.accepted}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 60, "total_tokens": prompt_tokens + 60},
+        }
+
+    def _chunks(self, content: str) -> list[str]:
+        return [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+
+    async def _stream(self, model: str, content: str):
+        self.streams += 1
+        finished = False
+        created = int(time.time())
+
+        def event(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+            chunk = {"id": f"chatcmpl-stub-{self.accepted}", "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        try:
+            yield event({"role": "assistant", "content": ""})
+            for piece in self._chunks(content):
+                if self.tokens_per_second > 0:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                yield event({"content": piece})
+            yield event({}, finish_reason="stop")
+            yield b"data: [DONE]\n\n"
+            finished = True
+        finally:
+            if not finished:
+                self.streams_stopped += 1
+
+    async def _models(self):
+        # What AIService.warm_up asks for
+        return {"object": "list", "data": [{"id": "llama-3.1-8b-instant", "object": "model"}]}
+
+    async def stats(self) -> dict:
+        return {
+            "accepted": self.accepted, "rate_limited": self.rate_limited, "errors": self.errors,
+            "in_flight": self.in_flight, "peak_in_flight": self.peak_in_flight, "by_model": dict(self.by_model),
+            "streams": self.streams, "streams_stopped": self.streams_stopped,
+        }
+
+
+class StubSupabase(StubServer):
+    """Fake PostgREST insert endpoint (what supabase-py's table(...).insert(...).execute() calls)."""
+
+    def __init__(self, latency: LatencySpec = 0.0, error_rate: float = 0.0, seed: Optional[int] = None, port: int = 0,
+                 tls: Optional[tuple[str, str]] = None):
+        self._rng = random.Random(seed)
+        self.latency = parse_latency(latency, self._rng)
+        self.error_rate = error_rate
+
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+
+        app = FastAPI()
+        app.post("/rest/v1/{table}")(self._insert)
+        app.get("/rest/v1/{table}")(self._select)
+        app.get("/__stats")(self.stats)
+        super().__init__(app, port, tls)
+
+    @property
+    def url(self) -> str:
+        # SUPABASE_URL
+        return self.base_url
+
+    async def _insert(self, table: str, request: Request):
+        self.requests += 1
+        latency = self.latency()
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse({"code": "XX000", "message": "stub database error", "details": None, "hint": None},
+                                status_code=500)
+        payload = await request.json()
+        rows = payload if isinstance(payload, list) else [payload]
+        first_id = self.rows + 1
+        self.rows += len(rows)
+        return JSONResponse([{"id": first_id + i, **row} for i, row in enumerate(rows)], status_code=201)
+
+    async def _select(self, table: str):
+        # DatabaseService.warm_up reads one id; the stub keeps no rows
+        return []
+
+    async def stats(self) -> dict:
+        return {"requests": self.requests, "rows": self.rows, "errors": self.errors}
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-port", type=int, default=0)
+    parser.add_argument("--llm-latency", default="0.3", help='number or "uniform:a:b" / "lognormal:median:sigma" / "exp:mean"')
+    parser.add_argument("--llm-max-concurrency", type=int, default=0)
+    parser.add_argument("--llm-rpm", type=int, default=0)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-retry-after", type=float, default=0.5)
+    parser.add_argument("--db-port", type=int, default=0)
+    parser.add_argument("--db-latency", default="0.02")
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    llm = StubLLM(
+        latency=args.llm_latency, max_concurrency=args.llm_max_concurrency, requests_per_minute=args.llm_rpm,
+        retry_after=args.llm_retry_after, rate_limit_rate=args.llm_429_rate, error_rate=args.llm_error_rate,
+        seed=args.seed, port=args.llm_port,
+    ).start()
+    db = StubSupabase(latency=args.db_latency, error_rate=args.db_error_rate, seed=args.seed, port=args.db_port).start()
+    # First stdout line tells a parent process where the stubs listen
+    print(json.dumps({"llm_url": llm.url, "db_url": db.url}), flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    llm.stop()
+    db.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,24 +1,123 @@
 import os
+import asyncio
 import logging
-from supabase import create_client, Client
+import threading
+from typing import Optional, TYPE_CHECKING
 from schemas import Lead
+from http_pool import HttpPool
+import metrics
+
+if TYPE_CHECKING:
+    from supabase import Client, AsyncClient
 
 logger = logging.getLogger(__name__)
 
 class DatabaseService:
-    def __init__(self):
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_KEY")
-        self.supabase: Client = create_client(url, key)
+    def __init__(self, http_pool: Optional[HttpPool] = None):
+        self.url = os.getenv("SUPABASE_URL")
+        self.key = os.getenv("SUPABASE_KEY")
+        # Shared connection pool (main.Services); without it each client keeps its own
+        self.http_pool = http_pool
+        # Both clients (and the supabase SDK, ~140 ms to import) are created on first use
+        self._supabase: Optional["Client"] = None
+        self._supabase_lock = threading.Lock()
+        # Async client is created on first use (acreate_client is a coroutine)
+        self.async_supabase: Optional["AsyncClient"] = None
+        self._client_lock: Optional[asyncio.Lock] = None
+        self._client_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def supabase(self) -> "Client":
+        if self._supabase is None:
+            with self._supabase_lock:
+                if self._supabase is None:
+                    from supabase import create_client
+                    if self.http_pool is None:
+                        self._supabase = create_client(self.url, self.key)
+                    else:
+                        from supabase import ClientOptions
+                        options = ClientOptions(httpx_client=self.http_pool.client)
+                        self._supabase = create_client(self.url, self.key, options=options)
+        return self._supabase
+
+    @supabase.setter
+    def supabase(self, value: "Client") -> None:
+        self._supabase = value
 
     def insert_lead(self, lead: Lead) -> dict:
         try:
             logger.info("Inserting lead into database")
             # Assuming 'leads' table in Supabase with columns matching Lead fields
-            data = lead.dict()
-            response = self.supabase.table('leads').insert(data).execute()
+            data = lead.model_dump()
+            with metrics.stage("db_insert"):
+                response = self.supabase.table('leads').insert(data).execute()
             logger.info("Lead inserted successfully")
             return {"success": True, "data": response.data}
         except Exception as e:
             logger.error(f"Error saving to database: {str(e)}")
-            raise ValueError(f"Błąd podczas zapisywania do bazy: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Błąd podczas zapisywania do bazy: {str(e)}")
+
+    async def _get_async_client(self) -> "AsyncClient":
+        if self.async_supabase is None:
+            # Concurrent first requests must not each build their own client
+            loop = asyncio.get_running_loop()
+            if self._client_lock_loop is not loop:
+                self._client_lock_loop = loop
+                self._client_lock = asyncio.Lock()
+            async with self._client_lock:
+                if self.async_supabase is None:
+                    from supabase import acreate_client
+                    if self.http_pool is None:
+                        self.async_supabase = await acreate_client(self.url, self.key)
+                    else:
+                        from supabase import AsyncClientOptions
+                        options = AsyncClientOptions(httpx_client=self.http_pool.async_client)
+                        self.async_supabase = await acreate_client(self.url, self.key, options=options)
+        return self.async_supabase
+
+    async def warm_up(self) -> None:
+        """Create the async client and open a pooled connection (reads one id from leads)."""
+        try:
+            client = await self._get_async_client()
+            await client.table('leads').select('id').limit(1).execute()
+        except Exception as e:
+            logger.warning(f"Supabase warm-up request failed: {str(e)}")
+
+    async def insert_lead_async(self, lead: Lead) -> dict:
+        try:
+            logger.info("Inserting lead into database (async)")
+            client = await self._get_async_client()
+            data = lead.model_dump()
+            with metrics.stage("db_insert"):
+                response = await client.table('leads').insert(data).execute()
+            logger.info("Lead inserted successfully")
+            return {"success": True, "data": response.data}
+        except Exception as e:
+            logger.error(f"Error saving to database: {str(e)}")
+            raise ValueError(f"Błąd podczas zapisywania do bazy: {str(e)}")
+
+    async def insert_leads_async(self, leads: list[Lead]) -> dict:
+        """Bulk insert: one request for the whole list."""
+        try:
+            logger.info(f"Inserting {len(leads)} leads into database (async, bulk)")
+            client = await self._get_async_client()
+            data = [lead.model_dump() for lead in leads]
+            with metrics.stage("db_insert"):
+                response = await client.table('leads').insert(data).execute()
+            logger.info("Leads inserted successfully")
+            return {"success": True, "data": response.data}
+        except Exception as e:
+            logger.error(f"Error saving to database: {str(e)}")
+            raise ValueError(f"Błąd podczas zapisywania do bazy: {str(e)}")
+
+    async def insert_duplicate_links_async(self, links: list[dict]) -> dict:
+        """Near-duplicates of saved leads: one lead_duplicates row each ({"lead_id", "similarity"})."""
+        try:
+            logger.info(f"Linking {len(links)} near-duplicate leads (async)")
+            client = await self._get_async_client()
+            with metrics.stage("db_insert"):
+                response = await client.table('lead_duplicates').insert(links).execute()
+            return {"success": True, "data": response.data}
+        except Exception as e:
+            logger.error(f"Error saving to database: {str(e)}")
+            raise ValueError(f"Błąd podczas zapisywania do bazy: {str(e)}")
@@ -0,0 +1,194 @@
+"""
+One shared HTTP connection pool per worker for the Groq and Supabase clients.
+
+Both SDKs accept an httpx client; given the same one (a sync httpx.Client for the
+thread paths, an httpx.AsyncClient for the async ones), they share its pool of
+keep-alive connections instead of each opening their own with the library defaults.
+Tunable: pool size, idle keep-alive (httpx closes idle connections after 5 s by
+default, so a lead arriving after a short pause paid a new TCP + TLS handshake),
+HTTP/2 (when the h2 package is installed) and timeouts per call type.
+
+Every request carries an httpcore trace hook, which counts new TCP connections and
+TLS handshakes; stats() reports them next to the request count, so the reuse rate
+is visible in /stats.
+"""
+import os
+import logging
+import threading
+from typing import Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpPool:
+    """
+    Lazily created shared clients: `client` (httpx.Client) and `async_client`
+    (httpx.AsyncClient), each with its own pool of the same size and settings.
+
+    The clients' default timeout is db_timeout (Supabase uses the client as is);
+    Groq gets llm_timeout explicitly, see AIService. The async client belongs to the
+    event loop of the worker that first used it, like the SDK clients built on it.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+        connect_timeout: float = 5.0,
+        llm_timeout: float = 60.0,
+        db_timeout: float = 10.0,
+        verify: Union[bool, str] = True,
+    ):
+        if http2 and not _h2_available():
+            logger.warning("HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.llm_timeout = llm_timeout
+        self.db_timeout = db_timeout
+        # True, False or a CA bundle path (e.g. the self-signed stubs of the benchmarks)
+        self.verify = verify
+
+        self._client: Optional["httpx.Client"] = None
+        self._async_client: Optional["httpx.AsyncClient"] = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.connect_errors = 0
+
+    @classmethod
+    def from_env(cls) -> "HttpPool":
+        return cls(
+            max_connections=int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "60")),
+            http2=os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes"),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+            llm_timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+            db_timeout=float(os.getenv("DB_TIMEOUT", "10")),
+        )
+
+    def timeout(self, seconds: float) -> "httpx.Timeout":
+        """Timeout for one call type: `seconds` to read/write, connect_timeout to connect."""
+        import httpx
+        return httpx.Timeout(seconds, connect=self.connect_timeout)
+
+    def _limits(self) -> "httpx.Limits":
+        import httpx
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def client(self) -> "httpx.Client":
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx  # deferred like the SDKs: main must import without them
+                    self._client = httpx.Client(
+                        transport=httpx.HTTPTransport(limits=self._limits(), http2=self.http2, verify=self.verify),
+                        timeout=self.timeout(self.db_timeout),
+                        event_hooks={"request": [self._on_request]},
+                    )
+        return self._client
+
+    @property
+    def async_client(self) -> "httpx.AsyncClient":
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    import httpx
+                    self._async_client = httpx.AsyncClient(
+                        transport=httpx.AsyncHTTPTransport(limits=self._limits(), http2=self.http2, verify=self.verify),
+                        timeout=self.timeout(self.db_timeout),
+                        event_hooks={"request": [self._on_request_async]},
+                    )
+        return self._async_client
+
+    def _on_request(self, request) -> None:
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _on_request_async(self, request) -> None:
+        self._on_request(request)
+        request.extensions["trace"] = self._trace_async
+
+    def _trace(self, event: str, info: dict) -> None:
+        # httpcore reports "connection.connect_tcp.complete" etc.; everything else is ignored
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+        elif event == "connection.connect_tcp.failed":
+            with self._lock:
+                self.connect_errors += 1
+
+    async def _trace_async(self, event: str, info: dict) -> None:
+        self._trace(event, info)
+
+    @staticmethod
+    def _pool_usage(client) -> Optional[dict]:
+        # httpcore's pool is private; report nothing rather than fail if its layout changes
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        try:
+            idle = sum(1 for connection in connections if connection.is_idle())
+        except Exception:
+            return None
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests, opened, handshakes = self.requests, self.connections_opened, self.tls_handshakes
+            connect_errors = self.connect_errors
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "requests": requests,
+            "connections_opened": opened,
+            "tls_handshakes": handshakes,
+            "connect_errors": connect_errors,
+            # Share of requests sent over an already open connection
+            "reuse_rate": round(max(0.0, 1 - opened / requests), 4) if requests else None,
+            "sync": self._pool_usage(self._client) if self._client is not None else None,
+            "async": self._pool_usage(self._async_client) if self._async_client is not None else None,
+        }
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        """Close both clients (end of the app lifespan)."""
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
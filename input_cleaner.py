@@ -0,0 +1,234 @@
+"""
+Input pre-processing before prompt assembly.
+
+Real e-mails carry quoted reply chains, signatures, legal footers, HTML remnants and
+tracking URLs. None of it helps the LLM qualify the lead, but all of it is paid for
+in prompt tokens and latency. InputCleaner strips that noise, puts back the sender's
+name and contact lines (email / phone) from the signature and footer, and enforces a
+token budget.
+"""
+import os
+import re
+import html
+import math
+import logging
+import threading
+from typing import NamedTuple
+
+from text_rules import EMAIL_RE, PHONE_RE
+
+logger = logging.getLogger(__name__)
+
+
+# Rough average for Llama tokenizers on mixed Polish/English text; used for the
+# budget and the "tokens saved" counters, not for billing.
+CHARS_PER_TOKEN = 4
+
+_HTML_HINT_RE = re.compile(r"<(?:html|body|div|p|br|span|table|td|tr|a|font|style|head)\b", re.IGNORECASE)
+_HTML_DROP_RE = re.compile(r"<(style|script|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK_RE = re.compile(r"<\s*(?:br|/p|/div|/tr|/li|/h\d)\b[^>]*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_HTML_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+
+_URL_RE = re.compile(r"<?(https?://[^\s<>\"']+)>?", re.IGNORECASE)
+
+# A line that starts a quoted reply chain; everything from it to the end is dropped
+_REPLY_HEADER_RE = re.compile(
+    r"^\s*(?:"
+    r"-{2,}\s*(?:original message|wiadomość oryginalna|oryginalna wiadomość)\s*-{2,}"
+    r"|on\s.+\swrote:\s*$"
+    r"|w dniu\s.+\s(?:pisze|napisał\(a\)|napisał|napisała):\s*$"
+    r"|(?:from|od):\s.+\n\s*(?:sent|date|wysłano|data):\s"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+_QUOTED_LINE_RE = re.compile(r"^\s*>.*$\n?", re.MULTILINE)
+
+# Signature delimiter ("-- ") and mobile client taglines. Sign-offs ("Pozdrawiam")
+# are left in the body: the sender's name usually follows them.
+_SIGNATURE_RE = re.compile(
+    r"^(?:--\s*|__+\s*|(?:sent from my|wysłane z|wysłano z)\s.*)$",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Leading signature lines kept as they are (name, position, company)
+_SIGNATURE_HEAD_LINES = 3
+_FOOTER_MARKERS = (
+    "this email and any attachments", "this e-mail and any attachments", "is confidential and intended",
+    "please consider the environment", "zanim wydrukujesz", "administratorem danych osobowych",
+    "informacja zawarta w tej wiadomości", "wiadomość ta jest poufna", "niniejsza wiadomość",
+    "klauzula informacyjna", "unsubscribe", "wypisz się",
+)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n(?:\s*\n)+")
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+$", re.MULTILINE)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+class CleanedInput(NamedTuple):
+    text: str
+    tokens_before: int
+    tokens_after: int
+    truncated: bool
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _strip_html(text: str) -> str:
+    if not _HTML_HINT_RE.search(text):
+        return text
+    text = _HTML_COMMENT_RE.sub("", text)
+    text = _HTML_DROP_RE.sub("", text)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = _HTML_TAG_RE.sub(" ", text)
+    return html.unescape(text)
+
+
+def _shorten_url(match: re.Match) -> str:
+    # Query strings and fragments are almost always tracking (utm_*, fbclid, mc_eid, ...)
+    url = match.group(1).split("?", 1)[0].split("#", 1)[0]
+    return url.rstrip("/.,;")
+
+
+def _contact_lines(text: str) -> list[str]:
+    return [
+        line.strip() for line in text.splitlines()
+        if EMAIL_RE.search(line) or PHONE_RE.search(line)
+    ]
+
+
+def _signature_lines(signature: str) -> list[str]:
+    """Name/company lines from the top of the signature plus every contact line in it."""
+    lines = [line.strip() for line in signature.splitlines()[1:] if line.strip()]
+    head = [line for line in lines[:_SIGNATURE_HEAD_LINES] if len(line) <= 60 and "http" not in line]
+    return head + [line for line in _contact_lines(signature) if line not in head]
+
+
+def _split_quoted_chain(text: str) -> str:
+    match = _REPLY_HEADER_RE.search(text)
+    # Keep the chain when there is nothing above it (the lead itself was forwarded)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+    if text.lstrip().startswith(">"):
+        return text
+    return _QUOTED_LINE_RE.sub("", text)
+
+
+def _split_signature(text: str) -> tuple[str, str]:
+    match = _SIGNATURE_RE.search(text)
+    if match and text[:match.start()].strip():
+        return text[:match.start()], text[match.start():]
+    return text, ""
+
+
+def _split_footer(text: str) -> tuple[str, str]:
+    kept, removed = [], []
+    for paragraph in re.split(r"\n\s*\n", text):
+        lowered = paragraph.lower()
+        if any(marker in lowered for marker in _FOOTER_MARKERS) and not any(
+            word in lowered for word in ("wycen", "ofert", "koszt", "quote")
+        ):
+            removed.append(paragraph)
+        else:
+            kept.append(paragraph)
+    if not kept:
+        return text, ""
+    return "\n\n".join(kept), "\n\n".join(removed)
+
+
+class InputCleaner:
+    """
+    Strips e-mail noise from lead text and enforces a token budget (0 = no budget).
+
+    The top of the removed signature (name, company) and contact lines from the
+    signature/footer are appended back; quoted reply chains are dropped as a whole
+    (their contacts are usually our own).
+    """
+
+    def __init__(self, enabled: bool = True, token_budget: int = 1500):
+        self.enabled = enabled
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.truncated = 0
+
+    @classmethod
+    def from_env(cls) -> "InputCleaner":
+        return cls(
+            enabled=os.getenv("INPUT_CLEANING_ENABLED", "true").lower() in ("1", "true", "yes"),
+            token_budget=int(os.getenv("INPUT_TOKEN_BUDGET", "1500")),
+        )
+
+    def clean(self, text: str) -> CleanedInput:
+        text = text or ""
+        before = estimate_tokens(text)
+        if not self.enabled:
+            return CleanedInput(text, before, before, False)
+
+        cleaned = _strip_html(text.replace("\r\n", "\n"))
+        cleaned = "\n".join(line.strip() for line in cleaned.split("\n"))
+        cleaned = _URL_RE.sub(_shorten_url, cleaned)
+        cleaned = _split_quoted_chain(cleaned)
+        cleaned, signature = _split_signature(cleaned)
+        cleaned, footer = _split_footer(cleaned)
+
+        body = self._tidy(cleaned)
+        kept = _signature_lines(signature) + _contact_lines(footer)
+        contacts = [line for line in dict.fromkeys(kept) if line not in body]
+        cleaned, truncated = self._fit_budget(body, contacts)
+
+        # Never return something longer than the input
+        if len(cleaned) > len(text):
+            cleaned = text
+        after = estimate_tokens(cleaned)
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += before
+            self.tokens_after += after
+            self.truncated += int(truncated)
+        if after < before:
+            logger.info(f"Input cleaned: {before} -> {after} tokens ({before - after} saved)")
+        return CleanedInput(cleaned, before, after, truncated)
+
+    @staticmethod
+    def _tidy(text: str) -> str:
+        text = _TRAILING_SPACE_RE.sub("", text)
+        text = re.sub(r"[ \t]{2,}", " ", text)
+        return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+    def _fit_budget(self, body: str, contacts: list[str]) -> tuple[str, bool]:
+        tail = "\n".join(contacts)
+        full = f"{body}\n{tail}" if tail else body
+        if self.token_budget <= 0 or estimate_tokens(full) <= self.token_budget:
+            return full, False
+
+        # Contact lines (also those from the part of the body that gets cut) always stay;
+        # the body is filled in up to the budget and cut at a line or word boundary
+        contacts = list(dict.fromkeys(contacts + _contact_lines(body)))
+        tail = "\n".join(contacts)
+        room = max(0, self.token_budget * CHARS_PER_TOKEN - len(tail) - len(" [...]\n"))
+        head = body[:room]
+        cut = max(head.rfind("\n"), head.rfind(" "))
+        if cut > room // 2:
+            head = head[:cut]
+        tail = "\n".join(line for line in contacts if line not in head)
+        head = head.rstrip() + " [...]"
+        return (f"{head}\n{tail}" if tail else head), True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "token_budget": self.token_budget,
+                "requests": self.requests,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "tokens_saved": self.tokens_before - self.tokens_after,
+                "truncated": self.truncated,
+            }
@@ -0,0 +1,204 @@
+import os
+import time
+import uuid
+import asyncio
+import ipaddress
+import logging
+from typing import Awaitable, Callable, Iterable, Optional
+from urllib.parse import urlsplit
+
+from schemas import Lead, JobStatus, render_json
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue is saturated."""
+
+
+def validate_webhook_url(url: str, allowed_hosts: Iterable[str] = ()) -> None:
+    """
+    Refuse webhook targets that would let callers make the server call internal services.
+
+    localhost and private/loopback/link-local IP literals are always rejected. When
+    allowed_hosts is non-empty only those hosts (and their subdomains) are accepted,
+    which also covers DNS names that resolve to internal addresses.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower().rstrip(".")
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("Nieprawidłowy adres webhooka")
+
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError("Webhook nie może wskazywać na adres wewnętrzny")
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        ip = None
+    if ip is not None and not ip.is_global:
+        raise ValueError("Webhook nie może wskazywać na adres wewnętrzny")
+
+    allowed = [h.strip().lower() for h in allowed_hosts if h.strip()]
+    if allowed and not any(host == h or host.endswith("." + h) for h in allowed):
+        raise ValueError(f"Host webhooka '{host}' nie jest na liście dozwolonych")
+
+
+class JobManager:
+    """
+    In-process worker pool for the async job API.
+
+    Jobs wait in a bounded queue; submit() fails fast when it is full instead of
+    letting the backlog grow. Finished jobs are kept for result_ttl seconds.
+    Completion webhooks are sent from their own tasks, so a slow receiver does not
+    hold a worker.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], Awaitable[Lead]],
+        workers: int = 4,
+        max_queue: int = 100,
+        result_ttl: float = 3600,
+        webhook_timeout: float = 5.0,
+        webhook_allowed_hosts: Iterable[str] = (),
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.webhook_timeout = webhook_timeout
+        self.webhook_allowed_hosts = tuple(webhook_allowed_hosts)
+
+        self._jobs: dict[str, JobStatus] = {}
+        self._texts: dict[str, str] = {}
+        self._webhooks: dict[str, str] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._webhook_tasks: set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.webhook_failures = 0
+
+    @classmethod
+    def from_env(cls, handler: Callable[[str], Awaitable[Lead]]) -> "JobManager":
+        return cls(
+            handler,
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+            max_queue=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+            result_ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+            webhook_allowed_hosts=os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(","),
+        )
+
+    def start(self) -> None:
+        """Start (or restart on a new event loop) the worker tasks."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and all(not task.done() for task in self._tasks):
+            return
+        pending = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, text: str, webhook_url: Optional[str] = None) -> JobStatus:
+        if webhook_url:
+            validate_webhook_url(webhook_url, self.webhook_allowed_hosts)
+        self.start()
+        self._evict_expired()
+
+        job = JobStatus(job_id=uuid.uuid4().hex, status="queued", created_at=time.time())
+        try:
+            self._queue.put_nowait(job.job_id)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFullError("Kolejka zadań jest pełna, spróbuj ponownie później")
+
+        self._jobs[job.job_id] = job
+        self._texts[job.job_id] = text
+        if webhook_url:
+            self._webhooks[job.job_id] = webhook_url
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[JobStatus]:
+        return self._jobs.get(job_id)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Webhooks already on their way are bounded by webhook_timeout; let them finish
+        await asyncio.gather(*self._webhook_tasks, return_exceptions=True)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str) -> None:
+        job = self._jobs.get(job_id)
+        text = self._texts.pop(job_id, None)
+        if job is None or text is None:
+            return
+
+        job.status = "running"
+        try:
+            job.lead = await self.handler(text)
+            job.status = "done"
+            self.completed += 1
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed: {str(e)}")
+            job.error = str(e) or type(e).__name__
+            job.status = "failed"
+            self.failed += 1
+        job.finished_at = time.time()
+
+        webhook_url = self._webhooks.pop(job_id, None)
+        if webhook_url:
+            task = asyncio.get_running_loop().create_task(self._notify(webhook_url, job))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+
+    async def _notify(self, url: str, job: JobStatus) -> None:
+        import httpx  # deferred: only needed once a job has a webhook
+        try:
+            async with httpx.AsyncClient(timeout=self.webhook_timeout) as client:
+                response = await client.post(url, content=render_json(job), headers={"Content-Type": "application/json"})
+                response.raise_for_status()
+        except Exception as e:
+            self.webhook_failures += 1
+            logger.error(f"Webhook for job {job.job_id} failed: {str(e)}")
+
+    def _evict_expired(self) -> None:
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "webhook_failures": self.webhook_failures,
+            "webhooks_in_flight": len(self._webhook_tasks),
+        }
@@ -0,0 +1,202 @@
+import os
+import asyncio
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Union
+
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC + collapsed whitespace, so resubmits and forwarded copies hash the same."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def hash_prompt(prompt_template: str) -> str:
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()
+
+
+class LeadCache:
+    """
+    Content-addressed cache of parsed LLM output (lead fields before post-processing).
+
+    Memory tier: LRU with TTL. Optional SQLite tier keeps entries across restarts.
+    Keys include the prompt hash, so editing a prompt makes old entries unreachable.
+
+    The async path (aget/aset) runs the SQLite tier in a worker thread. The memory
+    lock is never held during a disk round trip; the connection has its own lock.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lead_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM lead_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "LeadCache":
+        return cls(
+            max_entries=int(os.getenv("LEAD_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("LEAD_CACHE_TTL", "3600")),
+            db_path=os.getenv("LEAD_CACHE_PATH") or None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    @staticmethod
+    def make_key(text: str, niche: str, model: str, prompt_hash: str) -> str:
+        material = "\x1f".join((normalize_text(text), niche, model, prompt_hash))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = self._get_disk(key)
+        if value is None:
+            self._record_miss()
+        return value
+
+    async def aget(self, key: str) -> Optional[dict]:
+        """Like get(), but the disk tier does not block the event loop."""
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = await asyncio.to_thread(self._get_disk, key)
+        if value is None:
+            self._record_miss()
+        return value
+
+    def set(self, key: str, value: Union[dict, bytes]) -> None:
+        """value: the lead fields, or their JSON already rendered (schemas.render_json)."""
+        if not self.enabled:
+            return
+        expires_at, serialized = self._set_memory(key, value)
+        if self._db is not None:
+            self._set_disk(key, serialized, expires_at)
+
+    async def aset(self, key: str, value: Union[dict, bytes]) -> None:
+        """Like set(), but the disk tier does not block the event loop."""
+        if not self.enabled:
+            return
+        expires_at, serialized = self._set_memory(key, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._set_disk, key, serialized, expires_at)
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fast_json.loads(value)
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+    def _get_disk(self, key: str) -> Optional[dict]:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT value, expires_at FROM lead_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] <= time.time():
+                self._db.execute("DELETE FROM lead_cache WHERE key = ?", (key,))
+                self._db.commit()
+        if row is None:
+            return None
+
+        value, expires_at = row
+        with self._lock:
+            if expires_at <= time.time():
+                self.expirations += 1
+                return None
+            self._store_in_memory(key, expires_at, value)
+            self.hits += 1
+            self.disk_hits += 1
+        return fast_json.loads(value)
+
+    def _record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def _set_memory(self, key: str, value: Union[dict, bytes]) -> tuple[float, str]:
+        expires_at = time.time() + self.ttl_seconds
+        serialized = (value if isinstance(value, bytes) else fast_json.dumps(value)).decode("utf-8")
+        with self._lock:
+            self._store_in_memory(key, expires_at, serialized)
+        return expires_at, serialized
+
+    def _set_disk(self, key: str, serialized: str, expires_at: float) -> None:
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO lead_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, serialized, expires_at),
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing lead cache to disk: {str(e)}")
+
+    def _store_in_memory(self, key: str, expires_at: float, value: str) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
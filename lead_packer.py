@@ -0,0 +1,125 @@
+"""
+Packed mode: several short messages of one niche in a single LLM call.
+
+Most of a single-lead prompt is the fixed niche template and output rules; for a
+one-line message they are paid for over and over. A packed prompt carries the
+template once, lists the messages as numbered items and asks for
+{"leads": [{"id": ..., <lead fields>}, ...]} (an object, because Groq JSON mode
+only returns objects). Items that come back missing or invalid are processed
+with a normal single call by the caller.
+"""
+import os
+import json
+import logging
+import threading
+
+from lead_parser import LeadParseError, extract_object
+
+logger = logging.getLogger(__name__)
+
+
+class LeadPacker:
+    """Which messages may be packed, how many per call, and packed-call counters."""
+
+    def __init__(self, enabled: bool = False, max_items: int = 8, max_chars: int = 600, tokens_per_item: int = 250):
+        self.enabled = enabled
+        self.max_items = max(1, max_items)
+        self.max_chars = max_chars
+        self.tokens_per_item = tokens_per_item
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.items = 0
+        self.fallbacks = 0
+        self.failed_calls = 0
+
+    @classmethod
+    def from_env(cls) -> "LeadPacker":
+        return cls(
+            enabled=os.getenv("LLM_PACKING_ENABLED", "false").lower() in ("1", "true", "yes"),
+            max_items=int(os.getenv("LLM_PACK_SIZE", "8")),
+            max_chars=int(os.getenv("LLM_PACK_MAX_CHARS", "600")),
+        )
+
+    def is_short(self, text: str) -> bool:
+        return len(text) <= self.max_chars
+
+    def chunks(self, items: list) -> list[list]:
+        return [items[i:i + self.max_items] for i in range(0, len(items), self.max_items)]
+
+    def max_tokens(self, count: int) -> int:
+        return 100 + self.tokens_per_item * count
+
+    @staticmethod
+    def build_prompt(template: str, texts: list[str]) -> str:
+        listing = "\n".join(f'[id={number}] "{text}"' for number, text in enumerate(texts, start=1))
+        return f"""{template}
+
+        IMPORTANT OUTPUT RULES:
+        - The input contains {len(texts)} separate messages, each marked [id=N]. Analyse every message on its own.
+        - Return ONLY a single JSON object of the form {{"leads": [ ... ]}} with exactly one entry per message,
+          in the same order. No markdown, no commentary, no backticks.
+        - Each entry MUST contain exactly these keys:
+          id, name, company, email, phone, product, budget_est, urgency, city, summary, score
+        - id is the N of the message the entry describes.
+        - Use null (without quotes) for unknown/missing values.
+        - Do NOT invent email/phone. If not present, set to null. Never copy data between messages.
+        - score is REQUIRED and MUST be an integer from 1 to 10.
+        - summary MUST be in Polish, 1 sentence, correct grammar and spacing; fix obvious typos (e.g. missing spaces).
+        - summary should be human-readable (not copied raw); include the requested product/service and any numbers/budget mentioned.
+        - NEVER include profanity/vulgar words in the summary (do not quote them).
+
+        INPUT MESSAGES:
+        {listing}
+
+        OUTPUT JSON:
+        """
+
+    @staticmethod
+    def parse_items(raw: str, count: int) -> dict[int, dict]:
+        """Entries of a packed answer by item number (1..count); unknown or repeated ids are dropped."""
+        text = (raw or "").strip()
+        entries = None
+        if text.startswith("["):
+            # Some models return the bare array despite the instructions
+            try:
+                entries = json.loads(text)
+            except json.JSONDecodeError:
+                entries = None
+        if entries is None:
+            data = extract_object(text)
+            entries = data.get("leads") if isinstance(data.get("leads"), list) else None
+            if entries is None:
+                raise LeadParseError("Odpowiedź modelu nie zawiera listy leadów")
+
+        items: dict[int, dict] = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                number = int(entry.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if 1 <= number <= count and number not in items:
+                items[number] = entry
+        return items
+
+    def record(self, items: int, fallbacks: int, failed: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            self.items += items
+            self.fallbacks += fallbacks
+            self.failed_calls += int(failed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_items": self.max_items,
+                "max_chars": self.max_chars,
+                "calls": self.calls,
+                "items": self.items,
+                "items_per_call": round(self.items / self.calls, 2) if self.calls else 0.0,
+                "fallbacks": self.fallbacks,
+                "failed_calls": self.failed_calls,
+            }
@@ -0,0 +1,327 @@
+"""
+Tolerant parsing of LLM output into a Lead.
+
+Every unparseable answer costs a full Groq round trip plus backoff, so before
+giving up the parser:
+- takes the first balanced {...} object (braces inside strings do not count),
+  ignoring markdown fences and text around it;
+- repairs common defects: trailing commas, // and /* */ comments, Python
+  literals (None/True/False), output truncated mid-object (closed, or cut back
+  to the last complete field);
+- validates field by field: a number where text is expected becomes text, a
+  score like "7/10" becomes 7, other invalid fields become null. Only a missing
+  or unusable score rejects the object.
+"""
+import re
+import json
+import time
+import logging
+import threading
+from typing import Any, Optional
+
+from pydantic import ValidationError
+
+from schemas import Lead
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = set(Lead.model_fields)
+_SCORE_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+_LITERALS = {"None": "null", "True": "true", "False": "false", "NaN": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class LeadParseError(ValueError):
+    """The model's answer does not contain a usable Lead object."""
+
+
+def _json_mode_error(error: BaseException) -> Optional[dict]:
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        body = body.get("error", body)
+    if isinstance(body, dict) and body.get("code") == "json_validate_failed":
+        return body
+    return None
+
+
+def is_json_mode_rejection(error: BaseException) -> bool:
+    """Groq answers 400 json_validate_failed when JSON mode output does not parse on its side."""
+    return _json_mode_error(error) is not None
+
+
+def failed_generation(error: BaseException) -> Optional[str]:
+    """Model output attached to a JSON mode rejection, if any."""
+    body = _json_mode_error(error)
+    generation = body.get("failed_generation") if body else None
+    return generation if isinstance(generation, str) else None
+
+
+def _scan_object(text: str, start: int) -> tuple[int, list[str], bool, int]:
+    """
+    Scan from the '{' at start. Returns (end, open brackets, inside string, last comma):
+    end is the index after the matching '}' or -1 when the text ends first.
+    """
+    stack: list[str] = []
+    in_string = escaped = False
+    last_comma = -1
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return i + 1, stack, False, last_comma
+        elif ch == ",":
+            last_comma = i
+    return -1, stack, in_string, last_comma
+
+
+def _repair(text: str, repairs: list[str]) -> str:
+    """Remove comments and trailing commas, map Python literals; strings are left as they are."""
+    out = []
+    i, n = 0, len(text)
+    in_string = escaped = False
+    while i < n:
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                # Raw newline inside a string is invalid JSON
+                out[-1] = "\\n"
+                repairs.append("newline_in_string")
+            i += 1
+            continue
+        if ch == '"':
+            in_string = True
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            repairs.append("comment")
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            repairs.append("comment")
+            continue
+        elif ch == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j == n or text[j] in "}]":
+                repairs.append("trailing_comma")
+                i += 1
+                continue
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+                repairs.append("literal")
+            else:
+                out.append(word)
+            i = j
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _close_truncated(text: str, stack: list[str], in_string: bool, last_comma: int, start: int) -> list[str]:
+    """Candidates for an object cut off mid-way: closed as it is, then cut back to the last comma."""
+    closers = "".join(_CLOSERS[ch] for ch in reversed(stack))
+    candidates = [text[start:] + ('"' if in_string else "") + closers]
+    if last_comma > start:
+        # Bracket depth at the comma may differ; rescan the prefix to close it properly
+        prefix = text[start:last_comma]
+        _, prefix_stack, _, _ = _scan_object(prefix, 0)
+        candidates.append(prefix + "".join(_CLOSERS[ch] for ch in reversed(prefix_stack)))
+    return candidates
+
+
+def extract_object(raw: str, repairs: Optional[list[str]] = None) -> dict:
+    """Parse the first JSON object found in raw, repairing it if needed."""
+    repairs = repairs if repairs is not None else []
+    text = (raw or "").strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict):
+                return data
+        except json.JSONDecodeError:
+            pass
+
+    start = text.find("{")
+    while start != -1:
+        end, stack, in_string, last_comma = _scan_object(text, start)
+        if end != -1:
+            candidates = [text[start:end]]
+        else:
+            repairs.append("truncated")
+            candidates = _close_truncated(text, stack, in_string, last_comma, start)
+        for candidate in candidates:
+            for attempt in (candidate, None):
+                if attempt is None:
+                    attempt = _repair(candidate, repairs)
+                try:
+                    data = json.loads(attempt)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(data, dict):
+                    if start > 0 or end not in (-1, len(text)):
+                        repairs.append("extracted")
+                    return data
+        if end == -1:
+            break
+        # Not an object we can use (e.g. an example in prose): try the next one
+        start = text.find("{", start + 1)
+    raise LeadParseError("Odpowiedź modelu nie zawiera poprawnego obiektu JSON")
+
+
+def _coerce_score(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    elif isinstance(value, str):
+        match = _SCORE_RE.search(value)
+        if not match:
+            return None
+        number = float(match.group(0).replace(",", "."))
+    else:
+        return None
+    return min(10, max(1, round(number)))
+
+
+def validate_json(raw: str) -> Optional[Lead]:
+    """Well-formed answers (the common case in JSON mode) go from the JSON text straight to a Lead."""
+    text = (raw or "").strip()
+    if not text.startswith("{"):
+        return None
+    try:
+        return Lead.model_validate_json(text)
+    except ValidationError:
+        # Invalid JSON or fields: the tolerant path below knows which ones to repair
+        return None
+
+
+def to_lead(data: dict, repairs: Optional[list[str]] = None) -> tuple[Lead, list[str]]:
+    """Validate data as a Lead, fixing or nulling invalid fields. Returns the lead and the nulled field names."""
+    repairs = repairs if repairs is not None else []
+    data = {key: value for key, value in data.items() if key in _FIELDS}
+    nulled: list[str] = []
+    # Second pass catches numbers that became text but are still invalid (e.g. as an email)
+    for _ in range(3):
+        try:
+            return Lead(**data), nulled
+        except ValidationError as e:
+            bad = {error["loc"][0] for error in e.errors() if error["loc"]}
+        for field in bad:
+            value = data.get(field)
+            if field == "score":
+                data["score"] = _coerce_score(value)
+                if data["score"] is None:
+                    raise LeadParseError(f"Nieprawidłowa ocena leada: {value!r}")
+                repairs.append("score")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                data[field] = str(value)
+                repairs.append("number_to_text")
+            else:
+                data[field] = None
+                nulled.append(field)
+    raise LeadParseError("Nie udało się dopasować odpowiedzi modelu do schematu Lead")
+
+
+class LeadParser:
+    """Parses model answers into Leads and keeps success / repair / latency counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.failed = 0
+        self.recovered_json_mode = 0
+        self.repairs: dict[str, int] = {}
+        self.fields_nulled: dict[str, int] = {}
+        self._parse_seconds = 0.0
+        self._parse_max = 0.0
+
+    def parse(self, raw: str, json_mode_rejected: bool = False) -> Lead:
+        """json_mode_rejected: raw is the failed_generation of a JSON mode rejection."""
+        started = time.perf_counter()
+        repairs: list[str] = []
+        try:
+            lead, nulled = validate_json(raw), []
+            if lead is None:
+                lead, nulled = to_lead(extract_object(raw, repairs), repairs)
+        except LeadParseError:
+            self._record(started, repairs, [], ok=False)
+            raise
+        self._record(started, repairs, nulled, ok=True)
+        if json_mode_rejected:
+            with self._lock:
+                self.recovered_json_mode += 1
+        if repairs or nulled:
+            logger.info(f"Repaired LLM output ({', '.join(sorted(set(repairs)))}; nulled: {', '.join(nulled) or '-'})")
+        return lead
+
+    def validate(self, data: dict) -> Lead:
+        """Per-field validation of an already extracted object (one item of a packed answer)."""
+        started = time.perf_counter()
+        repairs: list[str] = []
+        try:
+            lead, nulled = to_lead(data, repairs)
+        except LeadParseError:
+            self._record(started, repairs, [], ok=False)
+            raise
+        self._record(started, repairs, nulled, ok=True)
+        return lead
+
+    def _record(self, started: float, repairs: list[str], nulled: list[str], ok: bool) -> None:
+        elapsed = time.perf_counter() - started
+        metrics.STAGE_SECONDS.observe(elapsed, stage="parse")
+        with self._lock:
+            if ok:
+                self.parsed += 1
+            else:
+                self.failed += 1
+            for kind in set(repairs):
+                self.repairs[kind] = self.repairs.get(kind, 0) + 1
+            for field in nulled:
+                self.fields_nulled[field] = self.fields_nulled.get(field, 0) + 1
+            self._parse_seconds += elapsed
+            self._parse_max = max(self._parse_max, elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.parsed + self.failed
+            return {
+                "parsed": self.parsed,
+                "failed": self.failed,
+                # Share of answers that cost another Groq round trip because they did not parse
+                "failure_rate": round(self.failed / total, 4) if total else 0.0,
+                "recovered_json_mode": self.recovered_json_mode,
+                "repairs": dict(self.repairs),
+                "fields_nulled": dict(self.fields_nulled),
+                "parse_ms_avg": round(self._parse_seconds / total * 1000, 3) if total else 0.0,
+                "parse_ms_max": round(self._parse_max * 1000, 3),
+            }
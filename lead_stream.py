@@ -0,0 +1,210 @@
+"""
+Streaming completions: the model's answer is read token by token instead of
+waiting for the whole completion.
+
+Without JSON mode (Groq does not stream it) a model often keeps writing after the
+closing brace of the object: an explanation, a second example, until max_tokens.
+ObjectStream follows the first JSON object as text arrives, reports each top-level
+field once its value is complete, and says when the object is closed, so the caller
+can cancel the rest of the completion.
+
+sse_lead_events turns those fields into Server-Sent Events for /process-lead/stream:
+`field` events while the model writes, then one `lead` event with the final,
+validated and post-processed lead (or an `error` event).
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from schemas import Lead, render_json
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = set(Lead.model_fields)
+
+# on_field(model, field, value): a field of the answer, as the model wrote it
+FieldCallback = Callable[[str, str, Any], None]
+
+
+class ObjectStream:
+    """
+    Incremental scanner of the first {...} object in a stream of text chunks.
+
+    Each character is looked at once; a top-level "key": value pair is decoded when
+    the comma or brace after it arrives. Pairs that do not decode (a defect the
+    tolerant parser would repair) are skipped here and left to the final parse.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.start = -1
+        self.end = -1
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._field_start = -1
+
+    @property
+    def complete(self) -> bool:
+        return self.end != -1
+
+    @property
+    def object_text(self) -> Optional[str]:
+        return self.text[self.start:self.end] if self.complete else None
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        """Add a chunk; returns the Lead fields completed by it."""
+        self.text += chunk
+        fields: list[tuple[str, Any]] = []
+        text, i = self.text, self._pos
+        while i < len(text) and self.end == -1:
+            ch = text[i]
+            if self.start == -1:
+                # Prose or a fence before the object
+                if ch == "{":
+                    self.start, self._depth, self._field_start = i, 1, i + 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._decode(self._field_start, i, fields)
+                    self.end = i + 1
+            elif ch == "," and self._depth == 1:
+                self._decode(self._field_start, i, fields)
+                self._field_start = i + 1
+            i += 1
+        self._pos = i
+        return fields
+
+    def _decode(self, start: int, end: int, fields: list[tuple[str, Any]]) -> None:
+        pair = self.text[start:end].strip()
+        if not pair:
+            return
+        try:
+            data = json.loads("{" + pair + "}")
+        except json.JSONDecodeError:
+            return
+        fields.extend((key, value) for key, value in data.items() if key in _FIELDS)
+
+
+class CompletionReader:
+    """One streamed completion: feeds its chunks to an ObjectStream, reports fields, times them."""
+
+    def __init__(self, model: str, on_field: Optional[FieldCallback] = None):
+        self.model = model
+        self.on_field = on_field
+        self.object = ObjectStream()
+        self.started = time.perf_counter()
+        self.first_field: Optional[float] = None
+
+    def feed(self, chunk) -> bool:
+        """Read one chat.completion.chunk; True once the object is complete."""
+        choices = getattr(chunk, "choices", None)
+        content = choices[0].delta.content if choices else None
+        if content:
+            for field, value in self.object.feed(content):
+                if self.first_field is None:
+                    self.first_field = time.perf_counter() - self.started
+                if self.on_field is not None:
+                    self.on_field(self.model, field, value)
+        return self.object.complete
+
+    @property
+    def content(self) -> str:
+        # Only the object when it closed; otherwise everything, for the tolerant parser
+        return self.object.object_text or self.object.text
+
+
+class StreamStats:
+    """Streamed completions: how many stopped early, time to first field and to the whole object."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.stopped_early = 0
+        self.unfinished = 0
+        self._first_field_seconds = 0.0
+        self._first_fields = 0
+        self._seconds = 0.0
+
+    def record(self, reader: CompletionReader, stopped_early: bool) -> None:
+        elapsed = time.perf_counter() - reader.started
+        with self._lock:
+            self.streams += 1
+            self.stopped_early += int(stopped_early)
+            # The stream ended without closing the object (e.g. max_tokens)
+            self.unfinished += int(not reader.object.complete)
+            self._seconds += elapsed
+            if reader.first_field is not None:
+                self._first_field_seconds += reader.first_field
+                self._first_fields += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "streams": self.streams,
+                "stopped_early": self.stopped_early,
+                "unfinished": self.unfinished,
+                "first_field_ms_avg": round(self._first_field_seconds / self._first_fields * 1000, 1)
+                if self._first_fields else None,
+                "ms_avg": round(self._seconds / self.streams * 1000, 1) if self.streams else None,
+            }
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    """One Server-Sent Event; data is sent as compact JSON (or as is, if already bytes)."""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b"event: " + event.encode("ascii") + b"\ndata: " + data + b"\n\n"
+
+
+async def sse_lead_events(
+    process: Callable[[str, FieldCallback], Awaitable[Lead]],
+    text: str,
+) -> AsyncIterator[bytes]:
+    """
+    Run process(text, on_field) and yield its fields as `field` events while it runs,
+    then the lead as a `lead` event. When a stronger model of the cascade re-runs the
+    lead, its fields arrive again with the other model name.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def on_field(model: str, field: str, value: Any) -> None:
+        queue.put_nowait({"model": model, "field": field, "value": value})
+
+    task = asyncio.ensure_future(process(text, on_field))
+    try:
+        while not task.done():
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+            if get in done:
+                yield sse_event("field", get.result())
+            else:
+                get.cancel()
+        while not queue.empty():
+            yield sse_event("field", queue.get_nowait())
+        try:
+            lead = task.result()
+        except Exception as e:
+            logger.error(f"Streamed lead failed: {str(e)}")
+            yield sse_event("error", {"detail": str(e) or type(e).__name__})
+        else:
+            yield sse_event("lead", render_json(lead))
+    finally:
+        # Client went away: do not leave the LLM call running
+        if not task.done():
+            task.cancel()
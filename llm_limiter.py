@@ -0,0 +1,261 @@
+"""
+Client-side governor in front of Groq chat completions.
+
+Three gates, checked together under one lock:
+- an AIMD concurrency limit: +1/limit per successful call (so about +1 per round
+  trip of the whole window), x decrease_factor on a 429, a timeout or a latency
+  spike (latency > spike_factor x moving average), at most once per cooldown;
+- a token bucket on requests/min and one on tokens/min (0 = not limited); the
+  token charge is an estimate up front, corrected with the real usage afterwards;
+- optional per-niche fairness: while several niches wait, the one served least
+  recently goes first, so a burst in one niche cannot starve the others.
+
+The sync (threads) and async paths share the same state; waiting callers poll
+with a short sleep rather than sharing a condition between threads and loops.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+
+from retry_policy import classify_error, RATE_LIMIT, TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 0.01
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to `per_minute` (one minute of burst)."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.available = per_minute
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        # Requests bigger than the whole bucket are let through once it is full
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self.available -= amount
+
+
+class Permit:
+    __slots__ = ("niche", "tokens", "started", "tokens_used")
+
+    def __init__(self, niche: str, tokens: int):
+        self.niche = niche
+        self.tokens = tokens
+        self.started = time.monotonic()
+        self.tokens_used: Optional[int] = None
+
+    def record_usage(self, response) -> None:
+        """Take the real token count from a chat completion response, if it has one."""
+        usage = getattr(response, "usage", None)
+        total = getattr(usage, "total_tokens", None)
+        if isinstance(total, int):
+            self.tokens_used = total
+
+
+class LLMLimiter:
+    def __init__(
+        self,
+        enabled: bool = True,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0,
+        spike_factor: float = 3.0,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        fair_niches: bool = False,
+    ):
+        self.enabled = enabled
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.spike_factor = spike_factor
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.fair_niches = fair_niches
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting: dict[str, int] = {}
+        self._last_served: dict[str, float] = {}
+        self._last_decrease = 0.0
+        self.latency_ewma: Optional[float] = None
+
+        self.admitted = 0
+        self.waited = 0
+        self.increases = 0
+        self.decreases = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMLimiter":
+        return cls(
+            enabled=os.getenv("LLM_LIMITER_ENABLED", "true").lower() in ("1", "true", "yes"),
+            initial_limit=int(os.getenv("LLM_CONCURRENCY_INITIAL", "8")),
+            min_limit=int(os.getenv("LLM_CONCURRENCY_MIN", "1")),
+            max_limit=int(os.getenv("LLM_CONCURRENCY_MAX", "64")),
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+            fair_niches=os.getenv("LLM_FAIR_NICHES", "false").lower() in ("1", "true", "yes"),
+        )
+
+    # --- admission ---------------------------------------------------------
+
+    def _try_admit(self, niche: str, tokens: int) -> float:
+        """Admit (return 0) or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            if self._in_flight >= int(self.limit):
+                return _POLL_INTERVAL
+            if self.fair_niches and not self._has_turn(niche):
+                return _POLL_INTERVAL
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self._in_flight += 1
+            self._last_served[niche] = now
+            self.admitted += 1
+            return 0.0
+
+    def _has_turn(self, niche: str) -> bool:
+        # Among niches with waiters, the one served least recently goes first
+        waiting = [n for n, count in self._waiting.items() if count > 0]
+        if len(waiting) < 2:
+            return True
+        first = min(waiting, key=lambda n: self._last_served.get(n, 0.0))
+        return self._last_served.get(niche, 0.0) <= self._last_served.get(first, 0.0)
+
+    def _set_waiting(self, niche: str, delta: int) -> None:
+        with self._lock:
+            self._waiting[niche] = self._waiting.get(niche, 0) + delta
+            if self._waiting[niche] <= 0:
+                del self._waiting[niche]
+            if delta > 0:
+                self.waited += 1
+
+    def acquire(self, niche: str, tokens: int) -> Permit:
+        if self.enabled:
+            wait = self._try_admit(niche, tokens)
+            if wait:
+                self._set_waiting(niche, 1)
+                try:
+                    while wait:
+                        time.sleep(min(wait, 1.0))
+                        wait = self._try_admit(niche, tokens)
+                finally:
+                    self._set_waiting(niche, -1)
+        return Permit(niche, tokens)
+
+    async def acquire_async(self, niche: str, tokens: int) -> Permit:
+        if self.enabled:
+            wait = self._try_admit(niche, tokens)
+            if wait:
+                self._set_waiting(niche, 1)
+                try:
+                    while wait:
+                        await asyncio.sleep(min(wait, 1.0))
+                        wait = self._try_admit(niche, tokens)
+                finally:
+                    self._set_waiting(niche, -1)
+        return Permit(niche, tokens)
+
+    # --- feedback ----------------------------------------------------------
+
+    def release(self, permit: Permit, error: Optional[BaseException] = None) -> None:
+        if not self.enabled:
+            return
+        latency = time.monotonic() - permit.started
+        with self._lock:
+            self._in_flight -= 1
+            if permit.tokens_used is not None:
+                # Charge the difference between the estimate and the real usage
+                self.tokens.take(permit.tokens_used - permit.tokens)
+
+            if error is not None:
+                if classify_error(error) in (RATE_LIMIT, TIMEOUT):
+                    self._decrease(f"{classify_error(error)}")
+                return
+
+            spike = self.latency_ewma is not None and latency > self.spike_factor * self.latency_ewma
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            if spike:
+                self._decrease(f"latency {latency:.2f}s")
+            elif self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.increases += 1
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.decreases += 1
+        logger.warning(f"LLM concurrency limit {previous:.1f} -> {self.limit:.1f} ({reason})")
+
+    # --- call wrappers -----------------------------------------------------
+
+    @contextmanager
+    def slot(self, niche: str, tokens: int):
+        permit = self.acquire(niche, tokens)
+        try:
+            yield permit
+        except BaseException as e:
+            self.release(permit, error=e)
+            raise
+        self.release(permit)
+
+    @asynccontextmanager
+    async def slot_async(self, niche: str, tokens: int):
+        permit = await self.acquire_async(niche, tokens)
+        try:
+            yield permit
+        except BaseException as e:
+            self.release(permit, error=e)
+            raise
+        self.release(permit)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "waiting": dict(self._waiting),
+                "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+                "requests_available": round(self.requests.available, 1) if self.requests.enabled else None,
+                "tokens_available": round(self.tokens.available, 1) if self.tokens.enabled else None,
+                "admitted": self.admitted,
+                "waited": self.waited,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "fair_niches": self.fair_niches,
+            }
@@ -1,14 +1,186 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from functools import cached_property
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from schemas import LeadInput, Lead
+from schemas import LeadInput, Lead, LeadBatchItem, JobInput, JobStatus, render_json
+from typing import Annotated, List, Optional
 from ai_service import AIService
 from database import DatabaseService
+from write_behind import WriteBehindQueue, QueueFullError
+from jobs import JobManager, JobQueueFullError
+from ndjson_stream import iter_ndjson_lines, process_ndjson, NdjsonStreamingResponse
+from singleflight import SingleFlight
+from http_pool import HttpPool
+from fast_json import FastJSONResponse
+from lead_stream import FieldCallback, sse_lead_events
+from lead_cache import normalize_text
+from metrics import REGISTRY, CONTENT_TYPE, MetricsMiddleware
 import os
+import logging
+import time
 from dotenv import load_dotenv
 
-load_dotenv()  # Ładuje zmienne z .env
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Business Automator", description="System for automatic sales lead structuring")
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "false").lower() in ("1", "true", "yes")
+
+class Services:
+    """
+    Serwisy jednego workera, tworzone przy pierwszym użyciu (w aplikacji: w lifespan),
+    a nie przy imporcie. Dzięki temu `import main` nie ładuje SDK Groq i Supabase
+    i działa bez zmiennych środowiskowych; klienci powstają przy pierwszym wywołaniu
+    albo w rozgrzewce (WARMUP_ENABLED). Endpointy dostają je przez Depends(get_services).
+    """
+
+    @cached_property
+    def http_pool(self) -> HttpPool:
+        # Jedna pula połączeń (keep-alive, HTTP/2) dla klientów Groq i Supabase,
+        # żeby kolejne leady nie płaciły za nowe połączenie TCP i TLS
+        return HttpPool.from_env()
+
+    @cached_property
+    def ai(self) -> AIService:
+        return AIService(http_pool=self.http_pool)
+
+    @cached_property
+    def db(self) -> DatabaseService:
+        return DatabaseService(http_pool=self.http_pool)
+
+    @cached_property
+    def write_queue(self) -> Optional[WriteBehindQueue]:
+        # Opcjonalny zapis "write-behind": leady buforowane i zapisywane zbiorczo w tle
+        if _env_flag("WRITE_BEHIND_ENABLED"):
+            return WriteBehindQueue.from_env(self.db.insert_leads_async)
+        return None
+
+    @cached_property
+    def save_flight(self) -> SingleFlight:
+        # Identyczne teksty przetwarzane w tym samym momencie (np. podwójny webhook)
+        # dzielą jedno wywołanie AI i jeden zapis do bazy
+        return SingleFlight.from_env()
+
+    @cached_property
+    def jobs(self) -> JobManager:
+        # Zadania asynchroniczne: POST /jobs zwraca id od razu, wynik pod GET /jobs/{id}
+        return JobManager.from_env(self.process_and_save)
+
+    @cached_property
+    def batch_concurrency(self) -> int:
+        # Max. liczba równoległych wywołań AI w jednym żądaniu /process-leads
+        return int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+    @cached_property
+    def stream_window(self) -> int:
+        # Strumieniowe /process-leads/stream: max. rekordów w toku
+        return int(os.getenv("STREAM_WINDOW", "16"))
+
+    @cached_property
+    def stream_max_line_bytes(self) -> int:
+        # ... i max. rozmiar jednej linii NDJSON
+        return int(os.getenv("STREAM_MAX_LINE_BYTES", "1000000"))
+
+    async def warm_up(self) -> None:
+        # Klienci Groq i Supabase plus po jednym otwartym połączeniu, zanim worker
+        # zacznie przyjmować ruch; błędy są tylko logowane
+        started = time.perf_counter()
+        await self.ai.warm_up()
+        await self.db.warm_up()
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+    async def start(self) -> None:
+        # Flusher startuje od razu, żeby spool z poprzedniego procesu był odtworzony
+        # także wtedy, gdy nie ma nowego ruchu
+        if self.write_queue is not None:
+            self.write_queue.start()
+        self.jobs.start()
+        # Przeładowanie promptów z PROMPTS_DIR w tle (bez I/O na ścieżce żądania)
+        self.ai.prompt_registry.start()
+
+    async def stop(self) -> None:
+        await self.ai.prompt_registry.stop()
+        await self.jobs.stop()
+        # Dopisz do bazy wszystko, co zostało w buforze
+        if self.write_queue is not None:
+            await self.write_queue.stop()
+        # Pulę zamykamy na końcu: bufor write-behind zapisuje się przez nią
+        await self.http_pool.aclose()
+        # Klienci SDK zbudowani na zamkniętej puli powstaną od nowa, jeśli będą potrzebni
+        del self.ai.client, self.ai.async_client
+        self.db.supabase = self.db.async_supabase = None
+
+    async def save_leads(self, leads: List[Lead]) -> None:
+        # Bliski duplikat leada, który ma już wiersz w bazie, nie dostaje nowego wiersza,
+        # tylko powiązanie z tamtym (tabela lead_duplicates, NEAR_DUP_ENABLED)
+        near_duplicates = self.ai.near_duplicates
+        links, rows = [], []
+        for lead in leads:
+            link = near_duplicates.link_for(lead)
+            if link is not None:
+                links.append(link)
+            else:
+                rows.append(lead)
+        if links:
+            await self.db.insert_duplicate_links_async(links)
+        if not rows:
+            return
+        if self.write_queue is not None:
+            # Id wierszy nie są tu znane, więc duplikaty tych leadów zapiszą się osobno
+            await self.write_queue.enqueue_many(rows)
+            return
+        if len(rows) == 1:
+            result = await self.db.insert_lead_async(rows[0])
+        else:
+            result = await self.db.insert_leads_async(rows)
+        # Zapamiętaj id wierszy: późniejsze bliskie duplikaty powiążą się z nimi
+        near_duplicates.record_rows(rows, result.get("data") if isinstance(result, dict) else None)
+
+    def check_save_capacity(self, count: int = 1) -> None:
+        # Sprawdzane przed wywołaniem AI, żeby przy przepełnieniu nie płacić za wynik,
+        # który i tak zostałby odrzucony
+        if self.write_queue is not None:
+            self.write_queue.check_capacity(count)
+
+    async def process_and_save(self, text: str, on_field: Optional[FieldCallback] = None) -> Lead:
+        self.check_save_capacity()
+
+        lead, shared = await self.save_flight.do_async(
+            normalize_text(text), lambda: self._process_and_save(text, on_field)
+        )
+        return lead.model_copy(deep=True) if shared else lead
+
+    async def _process_and_save(self, text: str, on_field: Optional[FieldCallback] = None) -> Lead:
+        # Przetwórz tekst przez AI (on_field: pola odpowiedzi modelu na bieżąco, dla SSE)
+        lead = await self.ai.process_lead_text_async(text, on_field=on_field)
+
+        # Zapisz do bazy
+        await self.save_leads([lead])
+
+        return lead
+
+_services = Services()
+
+def get_services() -> Services:
+    return _services
+
+ServicesDep = Annotated[Services, Depends(get_services)]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # .env czytany przy starcie workera, nie jako efekt uboczny importu
+    load_dotenv()
+    services = get_services()
+    # Serwisy powstają tutaj (tanio: bez klientów i SDK), więc błąd konfiguracji, np. nisza
+    # bez promptu w NICHE_KEYWORDS, zatrzymuje start workera, a nie pierwsze żądanie
+    _ = services.ai, services.db
+    if _env_flag("WARMUP_ENABLED"):
+        await services.warm_up()
+    await services.start()
+    yield
+    await services.stop()
+
+app = FastAPI(title="AI Business Automator", description="System for automatic sales lead structuring", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -18,25 +190,124 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-ai_service = AIService()
-db_service = DatabaseService()
+# Czas całego żądania (do ostatniego bajtu odpowiedzi) dla /metrics
+app.add_middleware(MetricsMiddleware)
 
 @app.post("/process-lead", response_model=Lead)
-async def process_lead(input_data: LeadInput):
+async def process_lead(input_data: LeadInput, services: ServicesDep):
     try:
-        # Przetwórz tekst przez AI
-        lead = ai_service.process_lead_text(input_data.text)
-        
-        # Zapisz do bazy
-        db_result = db_service.insert_lead(lead)
-        
-        return lead
+        lead = await services.process_and_save(input_data.text)
+        # Lead jest już zwalidowany: jeden przebieg pydantic-core prosto do bajtów,
+        # bez ponownej walidacji przez response_model (zostaje dla dokumentacji OpenAPI)
+        return Response(render_json(lead), media_type="application/json")
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Wewnętrzny błąd serwera: {str(e)}")
 
+@app.post("/process-lead/stream")
+async def process_lead_stream(input_data: LeadInput, services: ServicesDep):
+    # Server-Sent Events: pola leada w miarę generowania (event: field), na końcu
+    # zwalidowany i zapisany lead (event: lead) albo błąd (event: error)
+    try:
+        services.check_save_capacity()
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        sse_lead_events(services.process_and_save, input_data.text),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/process-leads", response_model=List[LeadBatchItem])
+async def process_leads(items: List[LeadInput], services: ServicesDep):
+    try:
+        services.check_save_capacity(len(items))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    results = await services.ai.process_leads_async(
+        [item.text for item in items], max_concurrency=services.batch_concurrency
+    )
+
+    batch = []
+    # Powtórzony w paczce tekst dostaje wynik, ale do bazy trafia raz
+    to_save: dict[str, List[LeadBatchItem]] = {}
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            batch.append(LeadBatchItem(index=index, error=str(result) or type(result).__name__))
+        else:
+            item = LeadBatchItem(index=index, lead=result)
+            batch.append(item)
+            to_save.setdefault(normalize_text(items[index].text), []).append(item)
+
+    # Jeden zbiorczy zapis dla całej paczki; błąd zapisu nie kasuje wyników AI,
+    # tylko trafia do każdej pozycji, której dotyczy
+    if to_save:
+        try:
+            await services.save_leads([same[0].lead for same in to_save.values()])
+        except Exception as e:
+            for same in to_save.values():
+                for item in same:
+                    item.error = str(e) or type(e).__name__
+
+    return batch
+
+@app.post("/process-leads/stream")
+async def process_leads_stream(request: Request, services: ServicesDep):
+    # Body czytane kawałkami, wyniki odsyłane jako NDJSON w kolejności ukończenia
+    lines = iter_ndjson_lines(request.stream(), max_line_bytes=services.stream_max_line_bytes)
+    return NdjsonStreamingResponse(
+        process_ndjson(lines, services.process_and_save, window=services.stream_window),
+        media_type="application/x-ndjson",
+    )
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def create_job(input_data: JobInput, services: ServicesDep):
+    try:
+        webhook_url = str(input_data.webhook_url) if input_data.webhook_url else None
+        return services.jobs.submit(input_data.text, webhook_url=webhook_url)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, services: ServicesDep):
+    job = services.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Nie znaleziono zadania")
+    return job
+
+@app.get("/stats", response_class=FastJSONResponse)
+async def stats(services: ServicesDep):
+    ai_service, write_queue = services.ai, services.write_queue
+    return {
+        "cache": ai_service.cache.stats(),
+        "prompts": ai_service.prompt_registry.stats(),
+        "spam_filter": ai_service.spam_filter.stats(),
+        "input": ai_service.input_cleaner.stats(),
+        "llm_retry": ai_service.retry_policy.stats(),
+        "llm_parser": ai_service.parser.stats(),
+        "llm_circuit_breaker": ai_service.circuit_breaker.stats(),
+        "llm_cascade": ai_service.cascade.stats(),
+        "llm_streaming": ai_service.stream_stats.stats(),
+        "llm_limiter": ai_service.limiter.stats(),
+        "llm_packing": ai_service.packer.stats(),
+        "coalescing": {"llm": ai_service.singleflight.stats(), "save": services.save_flight.stats()},
+        "near_duplicates": ai_service.near_duplicates.stats(),
+        "write_behind": write_queue.stats() if write_queue is not None else None,
+        "jobs": services.jobs.stats(),
+        "http_pool": services.http_pool.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    # Format tekstowy Prometheusa: histogramy etapów, czas żądań i liczniki
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     return {"message": "AI Business Automator API is running"}
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+Minimal Prometheus metrics (text exposition format 0.0.4) without extra dependencies.
+
+Recording is a bisect plus a few additions under a per-metric lock (about a
+microsecond, see benchmarks/bench_metrics.py), so it stays on the hot path.
+Values are per worker process; with several uvicorn workers each one is scraped
+separately.
+"""
+import time
+import threading
+from bisect import bisect_left
+from typing import Iterable
+
+# Seconds; covers in-process stages (µs) up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple([labels[name] for name in self.labelnames])
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: tuple(map(str, item[0])))
+        for key, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Per label set: [non-cumulative bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple([labels[name] for name in self.labelnames])
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels: str) -> _Timer:
+        """Context manager observing the wall time of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels: str) -> int:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(
+                ((key, ([*value[0]], value[1], value[2])) for key, value in self._series.items()),
+                key=lambda item: tuple(map(str, item[0])),
+            )
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "lead_stage_seconds", "Time spent in one stage of lead processing.", labelnames=("stage",),
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request time until the last byte of the response.",
+    labelnames=("method", "route", "status"),
+))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries_total", "Groq calls retried, by error class.", labelnames=("error",),
+))
+MANUAL_VERIFICATION = REGISTRY.register(Counter(
+    "lead_manual_verification_total", "Leads returned as 'requires manual verification'.", labelnames=("reason",),
+))
+PROFANITY_HITS = REGISTRY.register(Counter(
+    "lead_profanity_hits_total", "Lead texts in which profanity was found.",
+))
+LLM_TIER_SECONDS = REGISTRY.register(Histogram(
+    "llm_tier_seconds", "Time one model of the cascade spent on a lead, retries included.", labelnames=("model",),
+))
+LLM_ESCALATIONS = REGISTRY.register(Counter(
+    "llm_escalations_total", "Leads re-run on the next model of the cascade, by reason.", labelnames=("model", "reason"),
+))
+LEADS_BY_NICHE = REGISTRY.register(Counter(
+    "leads_processed_total", "Leads sent for processing, by niche.", labelnames=("niche",),
+))
+
+
+def stage(name: str) -> _Timer:
+    """with stage("parse"): ... records the block in lead_stage_seconds{stage="parse"}."""
+    return _Timer(STAGE_SECONDS, {"stage": name})
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing each HTTP request until its response is complete
+    (for streaming responses: until the last chunk). The route template is used as
+    the label, so path parameters do not multiply series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"], route=getattr(route, "path", "unmatched"), status=status,
+            )
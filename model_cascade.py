@@ -0,0 +1,138 @@
+"""
+Model cascade: every lead goes to the first (fast, cheap) model; it is re-run on the
+next, stronger one only when the answer is uncertain:
+
+- parse_failed: the answer did not parse into a Lead (no retry on the same model);
+- borderline_score: the score falls in the band where the follow-up decision flips;
+- missing_contacts: the source text has an e-mail address or phone number, but the
+  model returned neither (it probably skimmed the message).
+
+The strongest answer wins; if a stronger tier fails outright (errors after retries),
+the last usable answer of a cheaper tier is kept instead of a manual-verification lead.
+With one model (the default) nothing is ever escalated.
+
+Per tier it counts calls, escalations by reason and time spent, so the escalation rate
+and the latency the stronger tiers add are visible in /stats.
+"""
+import os
+import threading
+from typing import Optional
+
+from schemas import Lead
+import text_rules
+import metrics
+
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+
+PARSE_FAILED = "parse_failed"
+BORDERLINE_SCORE = "borderline_score"
+MISSING_CONTACTS = "missing_contacts"
+
+
+class _Tier:
+    __slots__ = ("model", "calls", "failed", "escalated", "seconds", "max_seconds")
+
+    def __init__(self, model: str):
+        self.model = model
+        self.calls = 0
+        self.failed = 0
+        self.escalated: dict[str, int] = {}
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class ModelCascade:
+    def __init__(
+        self,
+        models: list[str],
+        borderline_min: int = 5,
+        borderline_max: int = 6,
+        escalate_on_missing_contacts: bool = True,
+    ):
+        if not models:
+            raise ValueError("Model cascade needs at least one model")
+        self.models = list(models)
+        self.borderline_min = borderline_min
+        self.borderline_max = borderline_max
+        self.escalate_on_missing_contacts = escalate_on_missing_contacts
+        self._lock = threading.Lock()
+        self._tiers = [_Tier(model) for model in self.models]
+        self.leads = 0
+        self.kept_cheaper = 0
+
+    @classmethod
+    def from_env(cls) -> "ModelCascade":
+        models = [m.strip() for m in os.getenv("LLM_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
+        return cls(
+            models=models,
+            borderline_min=int(os.getenv("LLM_ESCALATE_SCORE_MIN", "5")),
+            borderline_max=int(os.getenv("LLM_ESCALATE_SCORE_MAX", "6")),
+            escalate_on_missing_contacts=os.getenv("LLM_ESCALATE_MISSING_CONTACTS", "true").lower() in ("1", "true", "yes"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.models) > 1
+
+    @property
+    def cache_id(self) -> str:
+        """Model part of the cache key: answers of another cascade are other answers."""
+        return "+".join(self.models)
+
+    def has_next(self, tier: int) -> bool:
+        return tier + 1 < len(self.models)
+
+    def escalation_reason(self, lead: Lead, source_text: str) -> Optional[str]:
+        """Why this answer (before post-processing) should go to the next tier, or None."""
+        if isinstance(lead.score, int) and self.borderline_min <= lead.score <= self.borderline_max:
+            return BORDERLINE_SCORE
+        if self.escalate_on_missing_contacts and not lead.email and not lead.phone:
+            scan = text_rules.scan_text(source_text)
+            if scan.email or scan.phone:
+                return MISSING_CONTACTS
+        return None
+
+    def record(self, tier: int, seconds: float, escalated: Optional[str] = None, failed: bool = False) -> None:
+        """One tier's work on one lead: its wall time (retries included) and outcome."""
+        model = self.models[tier]
+        metrics.LLM_TIER_SECONDS.observe(seconds, model=model)
+        if escalated is not None:
+            metrics.LLM_ESCALATIONS.inc(model=model, reason=escalated)
+        with self._lock:
+            stats = self._tiers[tier]
+            stats.calls += 1
+            stats.failed += int(failed)
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            if escalated is not None:
+                stats.escalated[escalated] = stats.escalated.get(escalated, 0) + 1
+
+    def record_lead(self, kept_cheaper: bool = False) -> None:
+        with self._lock:
+            self.leads += 1
+            self.kept_cheaper += int(kept_cheaper)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tiers = []
+            for stats in self._tiers:
+                escalated = sum(stats.escalated.values())
+                tiers.append({
+                    "model": stats.model,
+                    "calls": stats.calls,
+                    "failed": stats.failed,
+                    "escalated": escalated,
+                    "escalation_reasons": dict(stats.escalated),
+                    # Share of this tier's leads passed on to the next one
+                    "escalation_rate": round(escalated / stats.calls, 4) if stats.calls else 0.0,
+                    # For tiers after the first: the latency they add to an escalated lead
+                    "ms_avg": round(stats.seconds / stats.calls * 1000, 1) if stats.calls else 0.0,
+                    "ms_max": round(stats.max_seconds * 1000, 1),
+                })
+            return {
+                "models": list(self.models),
+                "borderline_scores": [self.borderline_min, self.borderline_max],
+                "leads": self.leads,
+                "kept_cheaper_answer": self.kept_cheaper,
+                "tiers": tiers,
+            }
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+from schemas import Lead, LeadInput, LeadBatchItem
+
+logger = logging.getLogger(__name__)
+
+_EOF = object()
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = 1_000_000) -> AsyncIterator[Optional[bytes]]:
+    """
+    Split a byte stream into NDJSON lines without reading it all into memory.
+
+    Blank lines are skipped. A line longer than max_line_bytes is dropped and
+    yielded as None, so the caller can report it and keep going.
+    """
+    buffer = bytearray()
+    oversized = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            newline = chunk.find(b"\n", start)
+            if newline == -1:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line_bytes:
+                        buffer.clear()
+                        oversized = True
+                break
+            if oversized:
+                oversized = False
+                yield None
+            else:
+                buffer += chunk[start:newline]
+                if len(buffer) > max_line_bytes:
+                    yield None
+                elif buffer.strip():
+                    yield bytes(buffer)
+                buffer.clear()
+            start = newline + 1
+    if oversized:
+        yield None
+    elif buffer.strip():
+        yield bytes(buffer)
+
+
+def _parse_record(line: Optional[bytes]) -> LeadInput:
+    if line is None:
+        raise ValueError("Rekord przekracza maksymalny rozmiar linii")
+    try:
+        return LeadInput.model_validate_json(line)
+    except ValidationError as e:
+        raise ValueError(f"Nieprawidłowy rekord: {e.errors()[0]['msg']}")
+
+
+async def process_ndjson(
+    lines: AsyncIterator[Optional[bytes]],
+    handler: Callable[[str], Awaitable[Lead]],
+    window: int = 16,
+) -> AsyncIterator[bytes]:
+    """
+    Run handler over NDJSON records with at most `window` in flight and yield
+    one NDJSON result line per record as soon as it completes (with its input index).
+
+    Reading the next line races against the running records, so a slow upload
+    does not hold back leads that are already done.
+    """
+    in_flight: dict[asyncio.Task, int] = {}
+    line_iter = lines.__aiter__()
+    next_line: Optional[asyncio.Task] = None
+    exhausted = False
+
+    async def read_line():
+        try:
+            return await line_iter.__anext__()
+        except StopAsyncIteration:
+            return _EOF
+
+    async def run(record: LeadInput) -> Lead:
+        return await handler(record.text)
+
+    def render(index: int, lead: Optional[Lead] = None, error: Optional[str] = None) -> bytes:
+        return LeadBatchItem(index=index, lead=lead, error=error).model_dump_json().encode("utf-8") + b"\n"
+
+    def collect(task: asyncio.Task) -> bytes:
+        index = in_flight.pop(task)
+        try:
+            return render(index, lead=task.result())
+        except Exception as e:
+            logger.error(f"NDJSON record {index} failed: {str(e)}")
+            return render(index, error=str(e) or type(e).__name__)
+
+    index = 0
+    try:
+        while not exhausted or in_flight:
+            # Backpressure: stop reading the upload while the window is full
+            if not exhausted and next_line is None and len(in_flight) < window:
+                next_line = asyncio.ensure_future(read_line())
+
+            waiting = set(in_flight)
+            if next_line is not None:
+                waiting.add(next_line)
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                if task in in_flight:
+                    yield collect(task)
+
+            if next_line is not None and next_line in done:
+                line = next_line.result()
+                next_line = None
+                if line is _EOF:
+                    exhausted = True
+                    continue
+                try:
+                    record = _parse_record(line)
+                except ValueError as e:
+                    yield render(index, error=str(e))
+                else:
+                    in_flight[asyncio.ensure_future(run(record))] = index
+                index += 1
+    finally:
+        # Client went away: do not leave orphaned LLM calls running
+        for task in in_flight:
+            task.cancel()
+        if next_line is not None:
+            next_line.cancel()
+
+
+class NdjsonStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that does not listen for http.disconnect while streaming.
+
+    The body iterator reads the request body itself; on ASGI < 2.4 Starlette's
+    disconnect listener would call receive() concurrently and swallow body chunks.
+    A client that goes away still ends the stream: request.stream() raises
+    ClientDisconnect and send() fails.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
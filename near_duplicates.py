@@ -0,0 +1,273 @@
+"""
+Near-duplicate leads: messages that are almost, but not byte-for-byte, the same as one
+processed a few minutes ago (one inquiry sent to several addresses, a spam wave with
+small variations). The exact-match cache misses them; this index finds them before the
+LLM call, so the earlier answer is reused and the new row is linked to the earlier one.
+
+A message is reduced to:
+- a guard: the numbers and e-mail addresses in it. A different budget, area, phone
+  number or address is another lead, however close the wording, so the guard must be
+  equal. It is also the index key: a lookup only looks at messages with the same
+  numbers and addresses (mostly the same sender's), never at the whole window;
+- a bottom-k MinHash sketch of its set of words (the k smallest word hashes). Two
+  sketches estimate the Jaccard similarity of the word sets, which must reach
+  min_similarity. Of one bucket, at most max_candidates newest entries are compared,
+  which bounds a lookup however many messages share a guard (e.g. none at all).
+
+Messages with fewer than min_tokens distinct words are not indexed: on a 10-word
+message a changed greeting is as large a change as a different inquiry.
+
+Entries live for window_seconds and at most max_entries are kept (the oldest go
+first). Memory per entry: the sketch (k * 8 bytes), the answer JSON and a few ints.
+
+Word hashes use Python's string hash, randomized per process; the index is per
+worker and empty after a restart.
+"""
+import os
+import re
+import time
+import heapq
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional
+
+from schemas import Lead
+
+_WORD_RE = re.compile(r"\w+")
+_DIGITS_RE = re.compile(r"\d+")
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+_MASK = (1 << 64) - 1
+
+
+class Probe(NamedTuple):
+    """A message as the index sees it, computed once per lead."""
+    key: int
+    sketch: array
+
+
+class DuplicateGroup(NamedTuple):
+    """Attached to a lead: the index entry of the first lead of its group and how similar the lead is to it."""
+    entry_id: int
+    similarity: float
+
+
+class NearDuplicate(NamedTuple):
+    entry_id: int
+    similarity: float
+    age: float
+    answer: bytes
+
+    @property
+    def group(self) -> DuplicateGroup:
+        return DuplicateGroup(self.entry_id, self.similarity)
+
+
+class _Entry:
+    __slots__ = ("id", "key", "sketch", "answer", "created", "row_id")
+
+    def __init__(self, entry_id: int, probe: Probe, answer: bytes, created: float):
+        self.id = entry_id
+        self.key = probe.key
+        self.sketch = probe.sketch
+        self.answer = answer
+        self.created = created
+        self.row_id = None
+
+
+def estimate_similarity(a: array, b: array, b_set: Optional[set] = None) -> float:
+    """Jaccard similarity of two word sets from their bottom-k sketches (sorted)."""
+    if not a or not b:
+        return float(not a and not b)
+    # Below the smaller of the two largest hashes, each sketch holds every hash of its
+    # set: the Jaccard similarity of that range is the estimate
+    limit = min(a[-1], b[-1])
+    shared = len((b_set if b_set is not None else set(b)).intersection(a))
+    return shared / (bisect_right(a, limit) + bisect_right(b, limit) - shared)
+
+
+class NearDuplicateIndex:
+    def __init__(
+        self,
+        enabled: bool = False,
+        min_similarity: float = 0.8,
+        window_seconds: float = 600.0,
+        max_entries: int = 5000,
+        min_tokens: int = 12,
+        max_candidates: int = 32,
+        sketch_size: int = 64,
+    ):
+        self.enabled = enabled and max_entries > 0
+        self.min_similarity = min_similarity
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self.max_candidates = max_candidates
+        self.sketch_size = sketch_size
+        # key (scope + guard) -> entry ids, oldest first
+        self._buckets: dict[int, list[int]] = {}
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.too_short = 0
+        self.hits = 0
+        self.name_mismatches = 0
+        self.compared = 0
+        self.added = 0
+        self.expired = 0
+        self.evicted = 0
+        self.linked = 0
+        self._lookup_seconds = 0.0
+        self._max_lookup_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "NearDuplicateIndex":
+        return cls(
+            enabled=os.getenv("NEAR_DUP_ENABLED", "false").lower() in ("1", "true", "yes"),
+            min_similarity=float(os.getenv("NEAR_DUP_MIN_SIMILARITY", "0.8")),
+            window_seconds=float(os.getenv("NEAR_DUP_WINDOW", "600")),
+            max_entries=int(os.getenv("NEAR_DUP_MAX_ENTRIES", "5000")),
+            min_tokens=int(os.getenv("NEAR_DUP_MIN_TOKENS", "12")),
+            max_candidates=int(os.getenv("NEAR_DUP_MAX_CANDIDATES", "32")),
+        )
+
+    def probe(self, text: str, scope: Hashable) -> Optional[Probe]:
+        """
+        Key and sketch of a (cleaned) message, or None when the index is off or the
+        message is too short. scope: what else must match (e.g. the prompt hash).
+        """
+        if not self.enabled:
+            return None
+        lowered = text.lower()
+        words = {hash(word) & _MASK for word in _WORD_RE.findall(lowered)}
+        if len(words) < self.min_tokens:
+            with self._lock:
+                self.too_short += 1
+            return None
+        guard = (frozenset(_DIGITS_RE.findall(lowered)), frozenset(_EMAIL_RE.findall(lowered)))
+        sketch = array("Q", heapq.nsmallest(self.sketch_size, words))  # sorted
+        return Probe(hash((scope, guard)), sketch)
+
+    def find(self, probe: Probe) -> Optional[NearDuplicate]:
+        """The most similar recent entry with the same key, if it reaches min_similarity."""
+        started = time.perf_counter()
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            best, best_similarity = None, 0.0
+            bucket = self._buckets.get(probe.key, ())
+            probe_set = set(probe.sketch)
+            # Newest first: near-duplicates come in bursts
+            for entry_id in reversed(bucket[-self.max_candidates:]):
+                entry = self._entries[entry_id]
+                similarity = estimate_similarity(entry.sketch, probe.sketch, probe_set)
+                self.compared += 1
+                if similarity >= self.min_similarity and similarity > best_similarity:
+                    best, best_similarity = entry, similarity
+            self.lookups += 1
+            if best is not None:
+                self.hits += 1
+            elapsed = time.perf_counter() - started
+            self._lookup_seconds += elapsed
+            self._max_lookup_seconds = max(self._max_lookup_seconds, elapsed)
+        if best is None:
+            return None
+        return NearDuplicate(best.id, round(best_similarity, 3), now - best.created, best.answer)
+
+    def record_name_mismatch(self) -> None:
+        """The caller turned a match down (the earlier lead's name is not in the message)."""
+        with self._lock:
+            self.hits -= 1
+            self.name_mismatches += 1
+
+    def add(self, probe: Probe, answer: bytes) -> DuplicateGroup:
+        """Index a message with its answer (lead JSON before post-processing); returns its group."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries.values())))
+                self.evicted += 1
+            self._next_id += 1
+            entry = _Entry(self._next_id, probe, answer, now)
+            self._entries[entry.id] = entry
+            self._buckets.setdefault(entry.key, []).append(entry.id)
+            self.added += 1
+        return DuplicateGroup(entry.id, 1.0)
+
+    def _expire(self, now: float) -> None:
+        # Entries are in insertion order, so the expired ones are at the front
+        deadline = now - self.window_seconds
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry.created >= deadline:
+                break
+            self._remove(entry)
+            self.expired += 1
+
+    def _remove(self, entry: _Entry) -> None:
+        del self._entries[entry.id]
+        bucket = self._buckets[entry.key]
+        # The oldest entry of the index is the oldest of its bucket
+        bucket.pop(0)
+        if not bucket:
+            del self._buckets[entry.key]
+
+    # Lead <-> group: kept on the lead as a private attribute (not serialized, not saved)
+
+    @staticmethod
+    def mark(lead: Lead, group: DuplicateGroup) -> Lead:
+        lead._duplicate_group = group
+        return lead
+
+    def link_for(self, lead: Lead) -> Optional[dict]:
+        """lead_duplicates row for a lead whose group already has a leads row; None: insert the lead."""
+        group = lead._duplicate_group
+        if group is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(group.entry_id)
+            row_id = entry.row_id if entry is not None else None
+            if row_id is None:
+                return None
+            self.linked += 1
+        return {"lead_id": row_id, "similarity": group.similarity}
+
+    def record_rows(self, leads: list[Lead], rows: Optional[list]) -> None:
+        """Remember the inserted rows (insert response data, in the order of leads) as link targets."""
+        with self._lock:
+            for lead, row in zip(leads, rows or ()):
+                group = lead._duplicate_group
+                if group is None or not isinstance(row, dict) or row.get("id") is None:
+                    continue
+                entry = self._entries.get(group.entry_id)
+                # The first row of a group stays its target
+                if entry is not None and entry.row_id is None:
+                    entry.row_id = row["id"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "window_seconds": self.window_seconds,
+                "min_similarity": self.min_similarity,
+                "lookups": self.lookups,
+                "too_short": self.too_short,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "name_mismatches": self.name_mismatches,
+                # Sketch comparisons (entries with the same numbers and e-mails)
+                "compared": self.compared,
+                "added": self.added,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "linked": self.linked,
+                "lookup_us_avg": round(self._lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+                "lookup_us_max": round(self._max_lookup_seconds * 1e6, 1),
+            }
@@ -0,0 +1,151 @@
+from collections import deque
+from typing import Iterable, Iterator, Mapping, NamedTuple, Optional
+
+
+class NicheCandidate(NamedTuple):
+    niche: str
+    score: int
+    confidence: float
+
+
+# Below this many distinct keywords a C-level str.find() per keyword beats walking
+# the automaton character by character in Python (benchmarks/bench_niche_router.py:
+# ~35 µs vs ~135 µs for the real registry; the automaton wins from ~150 keywords).
+SUBSTRING_SCAN_MAX_KEYWORDS = 150
+
+
+class KeywordAutomaton:
+    """
+    Finds every occurrence of lower-case keywords, each tagged with a label.
+
+    Small keyword sets are matched with str.find() per keyword. Large ones use an
+    Aho-Corasick automaton whose failure links are folded into a full transition
+    table, so scanning is one dict lookup per character however many keywords
+    (or niches) there are. Both strategies report the same occurrences.
+    """
+
+    def __init__(self, keywords: Mapping[str, Iterable[str]], substring_max_keywords: int = SUBSTRING_SCAN_MAX_KEYWORDS):
+        # keyword -> labels, in registry order
+        words: dict[str, list[str]] = {}
+        for label, group in keywords.items():
+            for word in group:
+                word = word.lower()
+                if word and label not in words.setdefault(word, []):
+                    words[word].append(label)
+        self._words = tuple((word, tuple(labels)) for word, labels in words.items())
+
+        self.uses_automaton = len(self._words) > substring_max_keywords
+        if self.uses_automaton:
+            self._build_automaton()
+
+    def _build_automaton(self) -> None:
+        goto: list[dict[str, int]] = [{}]
+        outputs: list[tuple[tuple[str, int], ...]] = [()]
+
+        for word, labels in self._words:
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    goto.append({})
+                    outputs.append(())
+                    nxt = len(goto) - 1
+                    goto[state][ch] = nxt
+                state = nxt
+            outputs[state] += tuple((label, len(word)) for label in labels)
+
+        # BFS: failure links, inherited outputs and the full transition table
+        fail = [0] * len(goto)
+        delta: list[dict[str, int]] = [dict(goto[0])] + [{} for _ in range(len(goto) - 1)]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            outputs[state] += tuple(o for o in outputs[fail[state]] if o not in outputs[state])
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+
+        self._delta = delta
+        self._outputs = outputs
+
+    def find(self, text: str) -> Iterator[tuple[int, int, str]]:
+        """Yield (start, end, label) for every keyword occurrence (order depends on the strategy)."""
+        if self.uses_automaton:
+            return self._find_automaton(text)
+        return self._find_substrings(text)
+
+    def _find_substrings(self, text: str) -> Iterator[tuple[int, int, str]]:
+        for word, labels in self._words:
+            start = text.find(word)
+            while start != -1:
+                end = start + len(word)
+                for label in labels:
+                    yield start, end, label
+                start = text.find(word, start + 1)
+
+    def _find_automaton(self, text: str) -> Iterator[tuple[int, int, str]]:
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for label, length in outputs[state]:
+                    yield i + 1 - length, i + 1, label
+
+
+class NicheRouter:
+    """
+    Scores every niche in one pass over the keywords; overlapping keyword hits of a niche count once.
+    A keyword only counts at the start of a word.
+    """
+
+    def __init__(
+        self,
+        niche_keywords: Mapping[str, Iterable[str]],
+        default_niche: str,
+        known_niches: Optional[Iterable[str]] = None,
+    ):
+        if known_niches is not None:
+            known = set(known_niches)
+            unknown = [niche for niche in (*niche_keywords, default_niche) if niche not in known]
+            if unknown:
+                raise ValueError(f"Niche keywords refer to niches without a prompt: {', '.join(unknown)}")
+        self.niches = list(niche_keywords)
+        self.default_niche = default_niche
+        self._automaton = KeywordAutomaton(niche_keywords)
+
+    def rank(self, text: str) -> list[NicheCandidate]:
+        hits: dict[str, list[tuple[int, int]]] = {}
+        lowered = (text or "").lower()
+        for start, end, niche in self._automaton.find(lowered):
+            # Keywords are word stems: a hit inside a word ("api" in "napiszcie") does not count
+            if start and lowered[start - 1].isalnum():
+                continue
+            hits.setdefault(niche, []).append((start, end))
+
+        # Score = number of groups of overlapping [start, end) spans
+        scores: dict[str, int] = {}
+        for niche, spans in hits.items():
+            spans.sort()
+            score, reach = 0, -1
+            for start, end in spans:
+                if start >= reach:
+                    score += 1
+                reach = max(reach, end)
+            scores[niche] = score
+
+        total = sum(scores.values())
+        candidates = [
+            NicheCandidate(niche, scores[niche], round(scores[niche] / total, 4))
+            for niche in self.niches
+            if niche in scores
+        ]
+        # Stable sort: equal scores keep registry order
+        candidates.sort(key=lambda c: c.score, reverse=True)
+        return candidates
+
+    def route(self, text: str) -> str:
+        candidates = self.rank(text)
+        return candidates[0].niche if candidates else self.default_niche
@@ -0,0 +1,271 @@
+"""
+Niche prompt registry: every niche's prompt, precompiled, plus the router over the
+niches' keywords, kept in one immutable PromptSet that is replaced as a whole.
+
+Sources:
+- PROMPTS_DIR unset: prompts.py (PROMPTS, NICHE_KEYWORDS, DEFAULT_NICHE), fixed at start.
+- PROMPTS_DIR=<directory>: one `<niche>.txt` file per niche. Lines before a `---` line
+  are a header; `keywords: a, b, c` there gives the niche's routing keywords. Niches
+  are listed (and win routing ties) in file name order. PROMPTS_DEFAULT_NICHE names
+  the fallback niche (default: prompts.DEFAULT_NICHE).
+
+Compiling a niche splits its full prompt (template + output rules + input text) into
+the static prefix and suffix around the input, once. Rendering a lead's prompt is
+then two concatenations, and the prompt hash (part of the cache key, the same value
+as before the registry) and the static token count are ready.
+
+Hot reload: a background task stats the directory every PROMPTS_RELOAD_INTERVAL
+seconds in a worker thread. When a file was added, changed or removed, all files are
+read, compiled and validated there, and the new PromptSet replaces the current one in
+a single assignment. Requests never touch the files; a lead reads `current` once and
+uses that version throughout. A directory that does not load (no default niche, an
+empty prompt) keeps the previous version and is counted in reload_errors.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Iterable, Mapping, Optional
+
+from input_cleaner import estimate_tokens
+from lead_cache import hash_prompt
+from niche_router import NicheRouter
+
+logger = logging.getLogger(__name__)
+
+PROMPT_SUFFIX = ".txt"
+
+# Everything between the niche template and the input text, then after the input.
+# Whitespace included: it is part of the prompt hash, so cache entries stay valid.
+_RULES = """
+
+        IMPORTANT OUTPUT RULES:
+        - Return ONLY a single JSON object. No markdown, no commentary, no backticks.
+        - The JSON MUST contain exactly these keys:
+          name, company, email, phone, product, budget_est, urgency, city, summary, score
+        - Use null (without quotes) for unknown/missing values.
+        - Do NOT invent email/phone. If not present, set to null.
+        - score is REQUIRED and MUST be an integer from 1 to 10.
+        - summary MUST be in Polish, 1 sentence, correct grammar and spacing; fix obvious typos (e.g. missing spaces).
+        - summary should be human-readable (not copied raw); include the requested product/service and any numbers/budget mentioned.
+        - NEVER include profanity/vulgar words in the summary (do not quote them).
+
+        INPUT TEXT:
+        \""""
+_TAIL = """"
+
+        OUTPUT JSON:
+        """
+
+
+class CompiledPrompt:
+    """A niche's prompt with everything but the input text built in advance."""
+
+    __slots__ = ("niche", "template", "prefix", "suffix", "hash", "tokens")
+
+    def __init__(self, niche: str, template: str):
+        self.niche = niche
+        self.template = template
+        self.prefix = template + _RULES
+        self.suffix = _TAIL
+        # Hash of the prompt with "{text}" for the input: editing a template invalidates its cache entries
+        self.hash = hash_prompt(self.prefix + "{text}" + self.suffix)
+        # Static part of every prompt of this niche, before the input text
+        self.tokens = estimate_tokens(self.prefix + self.suffix)
+
+    def render(self, text: str) -> str:
+        return self.prefix + text + self.suffix
+
+
+class PromptSet:
+    """One version of the registry. Never mutated: a reload builds a new one."""
+
+    def __init__(
+        self,
+        templates: Mapping[str, str],
+        keywords: Mapping[str, Iterable[str]],
+        default_niche: str,
+        version: int = 1,
+        source: str = "prompts.py",
+        router: Optional[NicheRouter] = None,
+    ):
+        if default_niche not in templates:
+            raise ValueError(f"Default niche '{default_niche}' has no prompt")
+        empty = [niche for niche, template in templates.items() if not template.strip()]
+        if empty:
+            raise ValueError(f"Empty prompt for niche: {', '.join(empty)}")
+        self.templates = dict(templates)
+        self.prompts = {niche: CompiledPrompt(niche, template) for niche, template in self.templates.items()}
+        # Fails when keywords name a niche without a prompt
+        self.router = router or NicheRouter(keywords, default_niche, known_niches=self.prompts)
+        self.default_niche = default_niche
+        self.version = version
+        self.source = source
+        self.loaded_at = time.time()
+
+    def get(self, niche: str) -> CompiledPrompt:
+        """The niche's prompt; an unknown niche gets the default one."""
+        prompt = self.prompts.get(niche)
+        if prompt is None:
+            logger.warning(f"Unknown niche '{niche}', using default '{self.default_niche}'")
+            prompt = self.prompts[self.default_niche]
+        return prompt
+
+
+def _parse_prompt_file(text: str) -> tuple[str, tuple[str, ...]]:
+    """(template, keywords) of one prompt file; without a `---` line the whole file is the template."""
+    keywords: tuple[str, ...] = ()
+    lines = text.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        if line.strip() == "---":
+            for header in lines[:index]:
+                key, _, value = header.partition(":")
+                if key.strip().lower() == "keywords":
+                    keywords = tuple(word.strip().lower() for word in value.split(",") if word.strip())
+            return "".join(lines[index + 1:]), keywords
+    return text, keywords
+
+
+def load_directory(directory: str, default_niche: str, version: int = 1) -> PromptSet:
+    """Read and compile every `<niche>.txt` of a directory (file I/O: never on the request path)."""
+    templates: dict[str, str] = {}
+    keywords: dict[str, tuple[str, ...]] = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(PROMPT_SUFFIX):
+            continue
+        niche = name[:-len(PROMPT_SUFFIX)]
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            templates[niche], niche_keywords = _parse_prompt_file(f.read())
+        if niche_keywords:
+            keywords[niche] = niche_keywords
+    return PromptSet(templates, keywords, default_niche, version=version, source=directory)
+
+
+class PromptRegistry:
+    """Holds the current PromptSet and, for a prompt directory, reloads it when files change."""
+
+    def __init__(self, prompt_set: PromptSet, directory: Optional[str] = None, reload_interval: float = 2.0):
+        self.current = prompt_set
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._signature = self._scan() if directory else None
+        self._reload_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+
+    @classmethod
+    def from_module(cls) -> "PromptRegistry":
+        from prompts import PROMPTS, NICHE_KEYWORDS, DEFAULT_NICHE
+        return cls(PromptSet(PROMPTS, NICHE_KEYWORDS, DEFAULT_NICHE))
+
+    @classmethod
+    def from_env(cls) -> "PromptRegistry":
+        directory = os.getenv("PROMPTS_DIR")
+        if not directory:
+            return cls.from_module()
+        from prompts import DEFAULT_NICHE
+        default_niche = os.getenv("PROMPTS_DEFAULT_NICHE", DEFAULT_NICHE)
+        return cls(
+            load_directory(directory, default_niche),
+            directory=directory,
+            reload_interval=float(os.getenv("PROMPTS_RELOAD_INTERVAL", "2")),
+        )
+
+    def replace_templates(self, templates: Mapping[str, str]) -> None:
+        """New templates, same routing (AIService.prompts setter: tests, benchmarks)."""
+        current = self.current
+        self.current = PromptSet(templates, {}, current.default_niche, version=current.version + 1,
+                                 source="templates", router=current.router)
+
+    def _scan(self) -> tuple:
+        # (name, mtime_ns, size) of every prompt file: cheap to compare on each tick
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(PROMPT_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(entries))
+
+    def reload_if_changed(self) -> bool:
+        """Reload when a prompt file changed since the last load; True if a new version was installed."""
+        if not self.directory:
+            return False
+        with self._reload_lock:
+            try:
+                signature = self._scan()
+            except OSError as e:
+                return self._reload_failed(e)
+            if signature == self._signature:
+                return False
+            # A broken version is not retried until the files change again
+            self._signature = signature
+            try:
+                prompt_set = load_directory(self.directory, self.current.default_niche, self.current.version + 1)
+            except Exception as e:
+                return self._reload_failed(e)
+            # One assignment: requests see the old set or the new one, never a mix
+            self.current = prompt_set
+            self.reloads += 1
+            self.last_error = None
+            logger.info(f"Prompts reloaded from {self.directory}: version {prompt_set.version}, "
+                        f"{len(prompt_set.prompts)} niches")
+            return True
+
+    def _reload_failed(self, error: Exception) -> bool:
+        self.reload_errors += 1
+        self.last_error = str(error)
+        logger.error(f"Prompt reload from {self.directory} failed, keeping version {self.current.version}: {str(error)}")
+        return False
+
+    def start(self) -> None:
+        """Start (or restart on a new event loop) the watcher; no-op without a prompt directory."""
+        if not self.directory or self.reload_interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._stopping = False
+        self._task = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._task is not None and not self._task.done() and self._loop is asyncio.get_running_loop():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                # stat/read/compile in a worker thread: the event loop keeps serving requests
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception as e:
+                logger.exception(f"Prompt watcher error: {str(e)}")
+
+    def stats(self) -> dict:
+        current = self.current
+        return {
+            "version": current.version,
+            "source": current.source,
+            "loaded_at": round(current.loaded_at, 3),
+            "default_niche": current.default_niche,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "niches": {
+                niche: {"hash": prompt.hash[:12], "static_tokens": prompt.tokens}
+                for niche, prompt in current.prompts.items()
+            },
+        }
@@ -90,3 +90,19 @@ Return ONLY valid JSON (no markdown) with keys: name, company, email, phone, pro
 Use null for unknown values.
 """,
 }
+
+# Routing keywords per niche: lower-case word stems, matched at the start of a word
+# ("api" does not hit "napiszcie"). End a keyword with a space or punctuation to match
+# a whole word ("demo " does not hit "demontaż").
+# AIService compiles all of them into one keyword automaton: the niche with the most
+# keyword hits wins, ties go to the niche listed first, no hits -> DEFAULT_NICHE.
+NICHE_KEYWORDS = {
+    "ecommerce_product_inquiry": ("sku", "rozmiar", "kolor", "dostaw", "wysyłk", "zamówieni", "shipping"),
+    "saas_subscription_support": (
+        "demo ", "demo.", "demo,", "demo?", "trial", "abonament", "subskrypc", "pricing", "upgrade", "api",
+    ),
+    "home_renovation_general": ("remont", "łazienk", "kuchni", "podłog", "malowani", "glazur", "renovation"),
+    # "my_custom_niche": ("keyword", "another keyword"),
+}
+
+DEFAULT_NICHE = "home_renovation_general"
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import random
+import logging
+import sys
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from pydantic import ValidationError
+
+from lead_parser import LeadParseError, is_json_mode_rejection
+
+logger = logging.getLogger(__name__)
+
+
+# Error classes, in the order they are checked
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER = "server"          # 5xx and connection errors
+PARSE = "parse"            # the model answered, but not with a valid Lead
+CLIENT = "client"          # other 4xx: retrying will not help
+OTHER = "other"
+
+# Only these mean "the provider is unhealthy" and count towards opening the breaker
+PROVIDER_FAILURES = (TIMEOUT, SERVER)
+
+
+def sdk_errors(module: str, *names: str) -> tuple[type, ...]:
+    """
+    Exception classes of an SDK module, or () while it is not imported yet. The Groq SDK
+    (and httpx with it) is imported with the first client, so before that none of its
+    errors can have been raised; `except sdk_errors(...)` / isinstance then match nothing
+    without importing it.
+    """
+    sdk = sys.modules.get(module)
+    return tuple(getattr(sdk, name) for name in names) if sdk is not None else ()
+
+
+def classify_error(error: BaseException) -> str:
+    if isinstance(error, sdk_errors("groq", "RateLimitError")):
+        return RATE_LIMIT
+    if isinstance(error, (TimeoutError, *sdk_errors("groq", "APITimeoutError"), *sdk_errors("httpx", "TimeoutException"))):
+        return TIMEOUT
+    if isinstance(error, (json.JSONDecodeError, ValidationError, LeadParseError)) or is_json_mode_rejection(error):
+        return PARSE
+    if isinstance(error, sdk_errors("groq", "APIStatusError")):
+        if error.status_code == 429:
+            return RATE_LIMIT
+        return SERVER if error.status_code >= 500 else CLIENT
+    if isinstance(error, (*sdk_errors("groq", "APIConnectionError"), *sdk_errors("httpx", "TransportError"))):
+        return SERVER
+    return OTHER
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Retry-After of an HTTP error response (delta-seconds or HTTP date), if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Decides whether and how long to wait before the next LLM attempt.
+
+    Exponential backoff with full jitter, capped at max_delay. A Retry-After header
+    wins over the computed delay; if it asks for more than max_retry_after seconds
+    the request gives up instead of holding the caller.
+    """
+
+    RETRYABLE = (RATE_LIMIT, TIMEOUT, SERVER, PARSE, OTHER)
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, max_retry_after: float = 30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+
+        self.errors: dict[str, int] = {}
+        self.retries = 0
+        self.gave_up = 0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "8")),
+            max_retry_after=float(os.getenv("LLM_MAX_RETRY_AFTER", "30")),
+        )
+
+    def next_delay(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Seconds to wait before attempt + 1, or None to stop retrying."""
+        kind = classify_error(error)
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+        delay = None
+        if kind in self.RETRYABLE and attempt + 1 < self.max_attempts:
+            retry_after = retry_after_seconds(error)
+            if retry_after is None:
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            elif retry_after <= self.max_retry_after:
+                delay = retry_after
+
+        with self._lock:
+            if delay is None:
+                self.gave_up += 1
+            else:
+                self.retries += 1
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_attempts": self.max_attempts,
+                "base_delay": self.base_delay,
+                "max_delay": self.max_delay,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "errors": dict(self.errors),
+            }
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the LLM provider is down.
+
+    closed -> open after failure_threshold consecutive provider failures (timeouts,
+    5xx, connection errors); open -> half_open after reset_timeout seconds, when one
+    probe request is let through; a successful probe closes the breaker again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.opened = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+
+    def allow_request(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("LLM circuit breaker closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error: BaseException) -> None:
+        if classify_error(error) not in PROVIDER_FAILURES:
+            # The provider answered (429, 4xx, bad JSON): it is up; a half-open probe can go again
+            with self._lock:
+                self._probe_in_flight = False
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (
+                self.state == "closed" and self.failure_threshold > 0 and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                logger.error(f"LLM circuit breaker opened after {self.consecutive_failures} failures")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
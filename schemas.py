@@ -1,10 +1,34 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, HttpUrl, PrivateAttr, WrapValidator
+from pydantic_core import to_json
+from typing import Annotated, Optional
+
+_EMAIL_MEMO_SIZE = 4096
+_valid_emails: dict[str, str] = {}
+
+def _memoized_email(value, handler):
+    # email-validator takes ~80 us, most of the cost of building a Lead, and the same
+    # address is validated again on every cache hit and spool replay; remember valid ones
+    if type(value) is str:
+        normalized = _valid_emails.get(value)
+        if normalized is not None:
+            return normalized
+    normalized = handler(value)
+    if type(value) is str:
+        if len(_valid_emails) >= _EMAIL_MEMO_SIZE:
+            _valid_emails.clear()
+        _valid_emails[value] = normalized
+    return normalized
+
+MemoizedEmailStr = Annotated[EmailStr, WrapValidator(_memoized_email)]
+
+def render_json(model: BaseModel) -> bytes:
+    """Compact UTF-8 JSON of a model in one pydantic-core pass (no intermediate dict)."""
+    return to_json(model)
 
 class Lead(BaseModel):
     name: Optional[str] = Field(None, description="Imię i nazwisko")
     company: Optional[str] = Field(None, description="Nazwa firmy (jeśli klient biznesowy)")
-    email: Optional[EmailStr] = Field(None, description="Email")
+    email: Optional[MemoizedEmailStr] = Field(None, description="Email")
     phone: Optional[str] = Field(None, description="Telefon")
     product: Optional[str] = Field(None, description="Produkt (Fotowoltaika/Pompa/Inne)")
     budget_est: Optional[str] = Field(None, description="Budżet")
@@ -12,5 +36,24 @@ class Lead(BaseModel):
     city: Optional[str] = Field(None, description="Miasto")
     summary: Optional[str] = Field(None, description="Podsumowanie")
     score: int = Field(..., ge=1, le=10, description="Ocena 1-10")
+    # near_duplicates.DuplicateGroup of the lead, if indexed (not serialized, not saved)
+    _duplicate_group: Optional[tuple] = PrivateAttr(default=None)
 class LeadInput(BaseModel):
-    text: str = Field(..., description="Nieustrukturyzowany tekst z maila lub wiadomości")
\ No newline at end of file
+    text: str = Field(..., description="Nieustrukturyzowany tekst z maila lub wiadomości")
+
+class LeadBatchItem(BaseModel):
+    index: int = Field(..., description="Pozycja wiadomości w przesłanej liście")
+    lead: Optional[Lead] = Field(None, description="Przetworzony lead (jeśli się udało)")
+    error: Optional[str] = Field(None, description="Opis błędu dla tej pozycji (przy błędzie zapisu lead jest nadal zwracany)")
+
+class JobInput(BaseModel):
+    text: str = Field(..., description="Nieustrukturyzowany tekst z maila lub wiadomości")
+    webhook_url: Optional[HttpUrl] = Field(None, description="Adres http(s), na który zostanie wysłany wynik (POST); bez adresów wewnętrznych")
+
+class JobStatus(BaseModel):
+    job_id: str = Field(..., description="Identyfikator zadania")
+    status: str = Field(..., description="queued / running / done / failed")
+    lead: Optional[Lead] = Field(None, description="Wynik (gdy status = done)")
+    error: Optional[str] = Field(None, description="Opis błędu (gdy status = failed)")
+    created_at: float = Field(..., description="Czas utworzenia (unix)")
+    finished_at: Optional[float] = Field(None, description="Czas zakończenia (unix)")
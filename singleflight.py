@@ -0,0 +1,122 @@
+"""
+Request coalescing ("singleflight"): concurrent calls with the same key share one
+in-flight computation and all get its result (or its exception).
+
+Nothing is cached: once the computation finishes the key is free again, and the
+next call runs it anew (the LLM response cache is a separate layer).
+"""
+import os
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    do(key, fn) for threads, do_async(key, fn) for coroutines; both return
+    (result, shared), where shared=True means the result came from another caller's call.
+
+    In the async path the computation runs as its own task: a cancelled caller does
+    not cancel it while other callers still wait for it; the last one out does.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._flights: dict[str, _Flight] = {}
+
+        self.calls = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight":
+        return cls(enabled=os.getenv("COALESCING_ENABLED", "true").lower() in ("1", "true", "yes"))
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        if not self.enabled:
+            return fn(), False
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        if not self.enabled:
+            return await fn(), False
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None and flight.task.get_loop() is not loop:
+                # Started on another event loop: awaiting its task here is not possible
+                flight, shared = _Flight(loop.create_task(fn())), False
+            elif flight is None:
+                flight, shared = _Flight(loop.create_task(fn())), False
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            else:
+                shared = True
+                self.coalesced += 1
+            flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0
+            if abandoned and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._flights),
+            }
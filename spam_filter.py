@@ -0,0 +1,141 @@
+import os
+import logging
+import re
+import threading
+from typing import NamedTuple, Optional
+
+from niche_router import KeywordAutomaton
+
+logger = logging.getLogger(__name__)
+
+
+# (weight, phrases) per signal. Phrases are lower-case substrings, like NICHE_KEYWORDS.
+SPAM_SIGNALS = {
+    "job_application": (0.6, (
+        "curriculum vitae", "list motywacyjny", "w załączeniu cv", "w załączniku cv", "przesyłam cv",
+        "moje cv", "aplikuję na stanowisko", "aplikuje na stanowisko", "ogłoszenie o pracę",
+        "oferta pracy", "ofertę pracy", "szukam pracy", "poszukuję pracy", "proces rekrutacji",
+        "rekrutacj", "praktyki studenckie", "staż", "zatrudnieni",
+    )),
+    "advertising": (0.6, (
+        "pozycjonowanie", "seo", "backlink", "kampanie google ads", "reklama w", "reklamy w",
+        "newsletter", "unsubscribe", "wypisz się", "wypisać się", "kliknij tutaj", "kliknij w link",
+        "oferujemy współpracę", "współpracy partnerskiej", "tanie kredyty", "pożyczk", "kasyno",
+        "bitcoin", "kryptowalut", "leady b2b", "bazę mailingową", "baza mailingowa",
+    )),
+}
+
+# Phrases typical for a real inquiry; each one halves the spam confidence
+LEAD_INTENT = (
+    "wycen", "ile kosztuje", "koszt", "proszę o kontakt", "prosze o kontakt", "proszę o ofertę",
+    "interesuje mnie", "jestem zainteresowan", "budżet", "termin realizacji",
+)
+
+_URL_RE = re.compile(r"https?://|www\.", re.IGNORECASE)
+_WORD_RE = re.compile(r"\w{2,}")
+
+
+class SpamVerdict(NamedTuple):
+    is_spam: bool
+    confidence: float
+    reasons: tuple[str, ...]
+
+
+class SpamFilter:
+    """
+    Cheap local pre-classifier for job applications, ads and empty pings.
+
+    Modes: "off" (not consulted), "shadow" (classify, still call the LLM and record
+    agreement), "on" (skip the LLM when confidence >= threshold).
+    """
+
+    MODES = ("off", "shadow", "on")
+
+    def __init__(self, mode: str = "off", threshold: float = 0.9):
+        if mode not in self.MODES:
+            logger.warning(f"Unknown spam filter mode '{mode}', using 'off'")
+            mode = "off"
+        self.mode = mode
+        self.threshold = threshold
+        self._automaton = KeywordAutomaton({
+            **{label: phrases for label, (_, phrases) in SPAM_SIGNALS.items()},
+            "lead_intent": LEAD_INTENT,
+        })
+        self._lock = threading.Lock()
+
+        self.short_circuited = 0
+        # Shadow mode confusion matrix: filter verdict vs LLM score == 1
+        self.agree_spam = 0
+        self.agree_lead = 0
+        self.filter_only = 0
+        self.llm_only = 0
+
+    @classmethod
+    def from_env(cls) -> "SpamFilter":
+        return cls(
+            mode=os.getenv("SPAM_FILTER_MODE", "off").strip().lower(),
+            threshold=float(os.getenv("SPAM_FILTER_THRESHOLD", "0.9")),
+        )
+
+    def classify(self, text: Optional[str]) -> SpamVerdict:
+        normalized = (text or "").lower()
+        # Only truly empty / punctuation-only messages; one-word inquiries ("Klimatyzacja",
+        # "Wycena?") go through the keyword rules like everything else
+        if not _WORD_RE.search(normalized):
+            return SpamVerdict(True, 0.99, ("empty",))
+
+        hits: dict[str, set[str]] = {}
+        for start, end, label in self._automaton.find(normalized):
+            hits.setdefault(label, set()).add(normalized[start:end])
+
+        not_spam = 1.0
+        reasons = []
+        for label, (weight, _) in SPAM_SIGNALS.items():
+            if label in hits:
+                not_spam *= (1 - weight) ** len(hits[label])
+                reasons.append(label)
+        if len(_URL_RE.findall(normalized)) >= 3:
+            not_spam *= 0.5
+            reasons.append("many_links")
+
+        confidence = (1 - not_spam) * 0.5 ** len(hits.get("lead_intent", ()))
+        confidence = round(confidence, 4)
+        return SpamVerdict(confidence >= self.threshold, confidence, tuple(reasons))
+
+    def record_short_circuit(self) -> None:
+        with self._lock:
+            self.short_circuited += 1
+
+    def record_shadow(self, verdict: SpamVerdict, llm_score: int) -> None:
+        llm_spam = llm_score <= 1
+        with self._lock:
+            if verdict.is_spam and llm_spam:
+                self.agree_spam += 1
+            elif not verdict.is_spam and not llm_spam:
+                self.agree_lead += 1
+            elif verdict.is_spam:
+                self.filter_only += 1
+            else:
+                self.llm_only += 1
+        if verdict.is_spam != llm_spam:
+            logger.info(
+                f"Spam filter disagreement: filter={verdict.is_spam} ({verdict.confidence}, "
+                f"{','.join(verdict.reasons) or '-'}), llm_score={llm_score}"
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            compared = self.agree_spam + self.agree_lead + self.filter_only + self.llm_only
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                "short_circuited": self.short_circuited,
+                "shadow": {
+                    "compared": compared,
+                    "agree_spam": self.agree_spam,
+                    "agree_lead": self.agree_lead,
+                    "filter_only": self.filter_only,
+                    "llm_only": self.llm_only,
+                    "agreement": round((self.agree_spam + self.agree_lead) / compared, 4) if compared else None,
+                },
+            }
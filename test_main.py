@@ -1,18 +1,27 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import os
+import json
+import time
+import asyncio
+import subprocess
+import sys
 
 # Set dummy environment variables for tests
 os.environ.setdefault("GROQ_API_KEY", "test-key-12345")
 os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
 os.environ.setdefault("SUPABASE_KEY", "test-key-67890")
 
-from main import app, ai_service, db_service
+from main import app, get_services, Services
 from schemas import Lead
 
 client = TestClient(app)
 
+services = get_services()
+ai_service, db_service, job_manager, save_flight = services.ai, services.db, services.jobs, services.save_flight
+process_and_save = services.process_and_save
+
 
 class TestRootEndpoint:
     """Test root endpoint"""
@@ -24,11 +33,117 @@ class TestRootEndpoint:
         assert response.json() == {"message": "AI Business Automator API is running"}
 
 
+class TestLazyStartup:
+    """Test services are built lazily and managed by the lifespan hook"""
+
+    def test_import_needs_no_env_and_no_sdks(self):
+        """Test importing main works without env vars and does not import the Groq/Supabase SDKs"""
+        env = {k: v for k, v in os.environ.items() if k not in ("GROQ_API_KEY", "SUPABASE_URL", "SUPABASE_KEY")}
+        code = "import sys, main; print(sorted({'groq', 'supabase', 'httpx'} & set(sys.modules)))"
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=env, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == "[]"
+
+    def test_warm_up_runs_before_ready_when_enabled(self):
+        """Test WARMUP_ENABLED pre-opens the Groq and Supabase connections in the lifespan hook"""
+        with patch.object(ai_service, 'warm_up', new_callable=AsyncMock) as ai_warm_up, \
+                patch.object(db_service, 'warm_up', new_callable=AsyncMock) as db_warm_up:
+            with patch.dict(os.environ, {"WARMUP_ENABLED": "false"}), TestClient(app):
+                ai_warm_up.assert_not_awaited()
+            with patch.dict(os.environ, {"WARMUP_ENABLED": "true"}), TestClient(app):
+                ai_warm_up.assert_awaited_once()
+                db_warm_up.assert_awaited_once()
+
+    def test_stop_closes_the_http_pool(self):
+        """Test the lifespan closes the shared pool and drops the SDK clients built on it"""
+        container = Services()
+        container.ai.async_client = Mock()
+        container.http_pool.async_client  # opened
+        asyncio.run(container.stop())
+
+        assert container.http_pool.stats()["async"] is None
+        assert container.ai._async_client is None
+        assert container.db.async_supabase is None
+
+    def test_services_are_injected(self):
+        """Test endpoints take their services from the get_services dependency"""
+        other = Services()
+        other.process_and_save = AsyncMock(return_value=Lead(name="Anna", summary="Z innego kontenera.", score=4))
+        app.dependency_overrides[get_services] = lambda: other
+        try:
+            response = client.post("/process-lead", json={"text": "Test"})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.json()["name"] == "Anna"
+        other.process_and_save.assert_awaited_once_with("Test")
+
+
+class TestLeadResponse:
+    """Test /process-lead answers with the lead rendered once, as response_model would"""
+
+    def test_response_body_matches_response_model(self):
+        """Test body bytes and content type equal FastAPI's response_model serialization"""
+        lead = Lead(name="Łukasz", email="lukasz@example.com", city="Gdańsk", summary="Rekuperacja.", score=8)
+        with patch.object(services, 'process_and_save', new_callable=AsyncMock, return_value=lead):
+            response = client.post("/process-lead", json={"text": "Test"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.content == lead.model_dump_json().encode("utf-8")
+        assert "Lead" in json.dumps(app.openapi()["paths"]["/process-lead"]["post"]["responses"]["200"])
+
+
+class TestStatsEndpoint:
+    """Test /stats endpoint"""
+
+    def test_stats_exposes_cache_counters(self):
+        """Test that cache hit/miss/eviction counters are exposed"""
+        response = client.get("/stats")
+        assert response.status_code == 200
+        cache_stats = response.json()["cache"]
+        for key in ("hits", "misses", "evictions", "entries"):
+            assert key in cache_stats
+
+    def test_stats_exposes_http_pool(self):
+        """Test that the shared connection pool reports its usage"""
+        pool_stats = client.get("/stats").json()["http_pool"]
+        for key in ("requests", "connections_opened", "tls_handshakes", "reuse_rate"):
+            assert key in pool_stats
+
+    def test_stats_exposes_prompt_registry(self):
+        """Test that the prompt registry reports its version and per-niche hash and token count"""
+        prompt_stats = client.get("/stats").json()["prompts"]
+        assert prompt_stats["version"] >= 1
+        assert set(prompt_stats["niches"]) == set(ai_service.prompts)
+        assert all(niche["static_tokens"] > 0 for niche in prompt_stats["niches"].values())
+
+    def test_stats_exposes_llm_streaming(self):
+        """Test that streamed completions report early stops and time to first field"""
+        streaming_stats = client.get("/stats").json()["llm_streaming"]
+        for key in ("streams", "stopped_early", "first_field_ms_avg"):
+            assert key in streaming_stats
+
+    def test_stats_exposes_near_duplicates(self):
+        """Test that the near-duplicate index reports its lookups, hits and links"""
+        near_dup_stats = client.get("/stats").json()["near_duplicates"]
+        for key in ("enabled", "entries", "lookups", "hits", "name_mismatches", "linked"):
+            assert key in near_dup_stats
+
+    def test_stats_exposes_llm_cascade(self):
+        """Test that the model cascade reports its models and per-tier escalations"""
+        cascade_stats = client.get("/stats").json()["llm_cascade"]
+        assert cascade_stats["models"] == ai_service.cascade.models
+        assert len(cascade_stats["tiers"]) == len(cascade_stats["models"])
+
+
 class TestProcessLeadEndpoint:
     """Test /process-lead endpoint"""
     
-    @patch.object(db_service, 'insert_lead')
-    @patch.object(ai_service, 'process_lead_text')
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
     def test_process_lead_success(self, mock_ai_process, mock_db_insert):
         """Test successful lead processing"""
         # Mock responses
@@ -59,7 +174,7 @@ class TestProcessLeadEndpoint:
         assert data["city"] == "Warsaw"
         assert data["score"] == 9
     
-    @patch.object(ai_service, 'process_lead_text')
+    @patch.object(ai_service, 'process_lead_text_async')
     def test_process_lead_invalid_input(self, mock_ai_process):
         """Test with invalid input (empty text)"""
         mock_ai_process.side_effect = ValueError("Text cannot be empty")
@@ -71,8 +186,8 @@ class TestProcessLeadEndpoint:
         assert response.status_code == 400
         assert "detail" in response.json()
     
-    @patch.object(db_service, 'insert_lead')
-    @patch.object(ai_service, 'process_lead_text')
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
     def test_process_lead_database_error(self, mock_ai_process, mock_db_insert):
         """Test when database error occurs"""
         mock_lead = Lead(
@@ -89,8 +204,8 @@ class TestProcessLeadEndpoint:
         
         assert response.status_code == 500
     
-    @patch.object(db_service, 'insert_lead')
-    @patch.object(ai_service, 'process_lead_text')
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
     def test_process_lead_with_different_score(self, mock_ai_process, mock_db_insert):
         """Test lead with different score values"""
         for score in [1, 5, 10]:
@@ -108,6 +223,352 @@ class TestProcessLeadEndpoint:
             assert response.json()["score"] == score
 
 
+class TestProcessLeadsEndpoint:
+    """Test /process-leads batch endpoint"""
+
+    @patch.object(db_service, 'insert_leads_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_process_leads_keeps_order_and_isolates_errors(self, mock_ai_process, mock_db_bulk_insert):
+        """Test that one failing item does not fail the batch and results keep input order"""
+        async def fake_process(text):
+            if text == "bad":
+                raise RuntimeError("LLM exploded")
+            return Lead(name="Test", summary=text, score=5)
+
+        mock_ai_process.side_effect = fake_process
+        mock_db_bulk_insert.return_value = {"success": True}
+
+        response = client.post("/process-leads", json=[{"text": "first"}, {"text": "bad"}, {"text": "third"}])
+
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["index"] for item in data] == [0, 1, 2]
+        assert data[0]["lead"]["summary"] == "first"
+        assert data[1]["lead"] is None
+        assert "LLM exploded" in data[1]["error"]
+        assert data[2]["lead"]["summary"] == "third"
+
+        # One bulk insert with only the successful leads
+        mock_db_bulk_insert.assert_awaited_once()
+        inserted = mock_db_bulk_insert.await_args.args[0]
+        assert [lead.summary for lead in inserted] == ["first", "third"]
+
+    @patch.object(db_service, 'insert_leads_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_process_leads_database_error(self, mock_ai_process, mock_db_bulk_insert):
+        """Test that a failed bulk insert keeps the AI results and marks each saved item"""
+        mock_ai_process.return_value = Lead(name="Test", summary="test", score=5)
+        mock_db_bulk_insert.side_effect = ValueError("Błąd podczas zapisywania do bazy: Database connection failed")
+
+        response = client.post("/process-leads", json=[{"text": "a"}, {"text": "b"}])
+
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["lead"]["summary"] for item in data] == ["test", "test"]
+        assert all("Database connection failed" in item["error"] for item in data)
+
+    @patch.object(db_service, 'insert_leads_async')
+    def test_process_leads_empty_batch(self, mock_db_bulk_insert):
+        """Test that an empty batch returns no results and skips the database"""
+        response = client.post("/process-leads", json=[])
+
+        assert response.status_code == 200
+        assert response.json() == []
+        mock_db_bulk_insert.assert_not_called()
+
+
+class TestProcessLeadsStreamEndpoint:
+    """Test /process-leads/stream NDJSON endpoint"""
+
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_stream_returns_one_result_per_record(self, mock_ai_process, mock_db_insert):
+        """Test each NDJSON record yields one NDJSON result and bad records do not stop the stream"""
+        async def fake_process(text, on_field=None):
+            if text == "bad":
+                raise RuntimeError("LLM exploded")
+            return Lead(name="Test", summary=text, score=5)
+
+        mock_ai_process.side_effect = fake_process
+        mock_db_insert.return_value = {"success": True}
+        body = '{"text": "first"}\n\nnot json\n{"text": "bad"}\n{"text": "last"}'
+
+        response = client.post("/process-leads/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        results = {item["index"]: item for item in map(json.loads, response.text.splitlines())}
+        assert sorted(results) == [0, 1, 2, 3]
+        assert results[0]["lead"]["summary"] == "first"
+        assert "Nieprawidłowy rekord" in results[1]["error"]
+        assert "LLM exploded" in results[2]["error"]
+        assert results[3]["lead"]["summary"] == "last"
+        assert mock_db_insert.await_count == 2
+
+
+class TestProcessLeadStreamEvents:
+    """Test /process-lead/stream SSE endpoint"""
+
+    @staticmethod
+    def _events(body: str) -> list[tuple[str, dict]]:
+        events = []
+        for block in body.strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_stream_pushes_fields_then_lead(self, mock_ai_process, mock_db_insert):
+        """Test fields arrive as `field` events before the saved lead"""
+        async def fake_process(text, on_field=None):
+            on_field("llama-3.1-8b-instant", "product", "Fotowoltaika")
+            await asyncio.sleep(0.01)
+            on_field("llama-3.1-8b-instant", "score", 8)
+            return Lead(name="Jan", product="Fotowoltaika", summary="Wycena.", score=8)
+
+        mock_ai_process.side_effect = fake_process
+        mock_db_insert.return_value = {"success": True}
+
+        response = client.post("/process-lead/stream", json={"text": "Wycena fotowoltaiki (SSE)"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self._events(response.text)
+        assert events[:2] == [
+            ("field", {"model": "llama-3.1-8b-instant", "field": "product", "value": "Fotowoltaika"}),
+            ("field", {"model": "llama-3.1-8b-instant", "field": "score", "value": 8}),
+        ]
+        assert events[2][0] == "lead" and events[2][1]["score"] == 8
+        mock_db_insert.assert_awaited_once()
+
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_stream_reports_errors_as_event(self, mock_ai_process):
+        """Test a failure after the stream started ends it with an `error` event"""
+        mock_ai_process.side_effect = RuntimeError("LLM exploded")
+
+        response = client.post("/process-lead/stream", json={"text": "Wycena (SSE error)"})
+
+        assert response.status_code == 200
+        assert self._events(response.text) == [("error", {"detail": "LLM exploded"})]
+
+
+class TestCoalescing:
+    """Test identical concurrent texts share one AI call and one insert"""
+
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_concurrent_duplicates_are_saved_once(self, mock_ai_process, mock_db_insert):
+        """Test a webhook fired twice (plus a whitespace variant) makes one AI call and one insert"""
+        async def slow_process(text, on_field=None):
+            await asyncio.sleep(0.05)
+            return Lead(name="Test", summary="test", score=5)
+
+        mock_ai_process.side_effect = slow_process
+        mock_db_insert.return_value = {"success": True}
+        coalesced_before = save_flight.stats()["coalesced"]
+
+        async def fire():
+            return await asyncio.gather(
+                process_and_save("Proszę o wycenę"),
+                process_and_save("Proszę o wycenę"),
+                process_and_save("  Proszę   o wycenę\n"),
+            )
+
+        leads = asyncio.run(fire())
+
+        assert [lead.summary for lead in leads] == ["test"] * 3
+        assert len({id(lead) for lead in leads}) == 3
+        assert mock_ai_process.await_count == 1
+        assert mock_db_insert.await_count == 1
+        assert save_flight.stats()["coalesced"] - coalesced_before == 2
+
+    @patch.object(db_service, 'insert_leads_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_batch_saves_repeated_text_once(self, mock_ai_process, mock_db_bulk_insert):
+        """Test a text repeated in one batch gets a result per item but is inserted once"""
+        async def fake_process(text):
+            return Lead(name="Test", summary=text.strip(), score=5)
+
+        mock_ai_process.side_effect = fake_process
+        mock_db_bulk_insert.return_value = {"success": True}
+
+        response = client.post("/process-leads", json=[{"text": "a"}, {"text": "b"}, {"text": " a "}])
+
+        assert response.status_code == 200
+        assert [item["lead"]["summary"] for item in response.json()] == ["a", "b", "a"]
+        inserted = mock_db_bulk_insert.await_args.args[0]
+        assert [lead.summary for lead in inserted] == ["a", "b"]
+
+
+class TestWriteBehind:
+    """Test endpoints with the write-behind queue enabled"""
+
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_process_lead_enqueues_instead_of_inserting(self, mock_ai_process):
+        """Test lead goes to the write-behind queue"""
+        mock_ai_process.return_value = Lead(name="Test", summary="test", score=5)
+        queue = MagicMock()
+        queue.enqueue_many = AsyncMock()
+
+        with patch.object(services, 'write_queue', queue), patch.object(db_service, 'insert_lead_async') as mock_insert:
+            response = client.post("/process-lead", json={"text": "Test lead"})
+
+        assert response.status_code == 200
+        queue.enqueue_many.assert_awaited_once()
+        mock_insert.assert_not_called()
+
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_process_lead_queue_full_returns_503(self, mock_ai_process):
+        """Test backpressure is reported as 503 before the LLM is called"""
+        from write_behind import QueueFullError
+        queue = MagicMock()
+        queue.check_capacity.side_effect = QueueFullError("full")
+        queue.enqueue_many = AsyncMock()
+
+        with patch.object(services, 'write_queue', queue):
+            response = client.post("/process-lead", json={"text": "Test lead"})
+
+        assert response.status_code == 503
+        mock_ai_process.assert_not_called()
+        queue.enqueue_many.assert_not_called()
+
+    def test_queue_starts_with_the_app(self):
+        """Test the flusher (and spool replay) starts at startup, not on the first enqueue"""
+        queue = MagicMock()
+        queue.stop = AsyncMock()
+
+        with patch.object(services, 'write_queue', queue):
+            with TestClient(app):
+                queue.start.assert_called_once()
+            queue.stop.assert_awaited_once()
+
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_queue_survives_two_lifespans(self, mock_ai_process, tmp_path):
+        """Test the queue (and its spool) works again after a shutdown, in the next lifespan"""
+        from write_behind import WriteBehindQueue
+        mock_ai_process.return_value = Lead(name="Test", summary="test", score=5)
+        insert_many = AsyncMock(return_value={"success": True})
+        queue = WriteBehindQueue(insert_many, flush_interval=60, spool_path=str(tmp_path / "spool.sqlite"))
+
+        with patch.object(services, 'write_queue', queue):
+            for _ in range(2):
+                with TestClient(app) as lifespan_client:
+                    assert lifespan_client.post("/process-lead", json={"text": "Test lead"}).status_code == 200
+                    assert lifespan_client.get("/stats").json()["write_behind"]["spooled_now"] == 0
+
+        assert insert_many.await_count == 2
+        assert queue.written == 2
+
+    @patch.object(ai_service, 'process_leads_async')
+    def test_process_leads_queue_full_returns_503(self, mock_ai_batch):
+        """Test the batch endpoint checks capacity for the whole batch up front"""
+        from write_behind import QueueFullError
+        queue = MagicMock()
+        queue.check_capacity.side_effect = QueueFullError("full")
+
+        with patch.object(services, 'write_queue', queue):
+            response = client.post("/process-leads", json=[{"text": "a"}, {"text": "b"}])
+
+        assert response.status_code == 503
+        queue.check_capacity.assert_called_once_with(2)
+        mock_ai_batch.assert_not_called()
+
+
+class TestNearDuplicateLinks:
+    """Test near-duplicates of a saved lead are linked to its row instead of inserted"""
+
+    def test_duplicate_is_linked_to_first_row(self):
+        """Test the first lead of a group is inserted and a later near-duplicate only linked"""
+        from near_duplicates import NearDuplicateIndex
+        index = NearDuplicateIndex(enabled=True, min_tokens=3)
+        group = index.add(index.probe("zapytanie o wycenę pompy ciepła", "scope"), b"{}")
+        first = index.mark(Lead(name="Jan", summary="pompa", score=6), group)
+        duplicate = index.mark(Lead(name="Jan", summary="pompa", score=6), group._replace(similarity=0.9))
+
+        with patch.object(ai_service, 'near_duplicates', index), \
+                patch.object(db_service, 'insert_lead_async', AsyncMock(return_value={"data": [{"id": 7}]})) as mock_insert, \
+                patch.object(db_service, 'insert_duplicate_links_async', AsyncMock()) as mock_link:
+            asyncio.run(services.save_leads([first]))
+            asyncio.run(services.save_leads([duplicate]))
+
+        mock_insert.assert_awaited_once_with(first)
+        mock_link.assert_awaited_once_with([{"lead_id": 7, "similarity": 0.9}])
+        assert index.stats()["linked"] == 1
+
+
+class TestJobsEndpoint:
+    """Test async job API"""
+
+    @patch.object(db_service, 'insert_lead_async')
+    @patch.object(ai_service, 'process_lead_text_async')
+    def test_job_lifecycle(self, mock_ai_process, mock_db_insert):
+        """Test POST /jobs returns an id right away and GET /jobs/{id} returns the lead"""
+        mock_ai_process.return_value = Lead(name="Jan Kowalski", summary="test", score=8)
+        mock_db_insert.return_value = {"success": True}
+
+        with TestClient(app) as lifespan_client:
+            response = lifespan_client.post("/jobs", json={"text": "Test lead"})
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+
+            for _ in range(50):
+                status = lifespan_client.get(f"/jobs/{job_id}").json()
+                if status["status"] == "done":
+                    break
+                time.sleep(0.01)
+
+        assert status["status"] == "done"
+        assert status["lead"]["score"] == 8
+        mock_db_insert.assert_awaited_once()
+
+    def test_job_queue_full_returns_429(self):
+        """Test saturated queue is rejected with 429"""
+        from jobs import JobQueueFullError
+        with patch.object(job_manager, 'submit', side_effect=JobQueueFullError("full")):
+            response = client.post("/jobs", json={"text": "Test lead"})
+
+        assert response.status_code == 429
+
+    def test_internal_webhook_is_rejected(self):
+        """Test webhook URLs are validated (format 422, internal target 400)"""
+        assert client.post("/jobs", json={"text": "t", "webhook_url": "not a url"}).status_code == 422
+        response = client.post("/jobs", json={"text": "t", "webhook_url": "http://127.0.0.1:8000/admin"})
+        assert response.status_code == 400
+
+    def test_unknown_job_returns_404(self):
+        """Test polling an unknown id"""
+        response = client.get("/jobs/does-not-exist")
+        assert response.status_code == 404
+
+
+class TestMetricsEndpoint:
+    """Test /metrics Prometheus endpoint"""
+
+    @patch.object(db_service, '_get_async_client')
+    @patch.object(ai_service, 'async_client')
+    def test_process_lead_records_every_stage(self, mock_async_client, mock_db_client):
+        """Test one /process-lead fills the stage histograms, the request histogram and the niche counter"""
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"name": "Jan Kowalski", "summary": "Wycena", "score": 6})
+        mock_async_client.chat.completions.create = AsyncMock(return_value=response)
+        supabase = MagicMock()
+        supabase.table.return_value.insert.return_value.execute = AsyncMock(return_value=MagicMock(data=[{"id": 1}]))
+        mock_db_client.return_value = supabase
+
+        result = client.post("/process-lead", json={"text": f"Prośba o wycenę remontu nr {time.time()}"})
+        assert result.status_code == 200
+
+        metrics_response = client.get("/metrics")
+        assert metrics_response.status_code == 200
+        assert metrics_response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = metrics_response.text
+        for stage in ("niche_detection", "prompt_build", "llm_call", "parse", "postprocess", "db_insert"):
+            assert f'lead_stage_seconds_count{{stage="{stage}"}}' in text
+        assert 'http_request_duration_seconds_count{method="POST",route="/process-lead",status="200"}' in text
+        assert 'leads_processed_total{niche=' in text
+
+
 class TestLeadSchema:
     """Test Lead data schema"""
     
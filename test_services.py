@@ -1,5 +1,7 @@
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+import asyncio
+import json
 import os
 
 # Set dummy environment variables for tests
@@ -9,26 +11,1735 @@ os.environ.setdefault("SUPABASE_KEY", "test-key-67890")
 
 from ai_service import AIService
 from database import DatabaseService
-from schemas import Lead
+from lead_cache import LeadCache
+from schemas import Lead, render_json
+import schemas
+from prompts import PROMPTS, NICHE_KEYWORDS, DEFAULT_NICHE
+import random
+import re
+import text_rules
+from niche_router import KeywordAutomaton, NicheRouter
+from spam_filter import SpamFilter
+from write_behind import WriteBehindQueue, QueueFullError
+from jobs import JobManager, JobQueueFullError, validate_webhook_url
+from ndjson_stream import iter_ndjson_lines, process_ndjson
+from input_cleaner import InputCleaner
+from retry_policy import RetryPolicy, CircuitBreaker, classify_error
+from llm_limiter import LLMLimiter
+from singleflight import SingleFlight
+from lead_parser import LeadParser, LeadParseError, validate_json, extract_object, to_lead
+from lead_packer import LeadPacker
+from metrics import Histogram, Counter, Registry
+import threading
+import time
+from benchmarks.stub_servers import StubLLM, StubSupabase, parse_latency, self_signed_cert
+from http_pool import HttpPool
+from model_cascade import ModelCascade
+from lead_stream import ObjectStream
+from prompt_registry import PromptRegistry, PromptSet, load_directory
+from lead_cache import hash_prompt
+from near_duplicates import NearDuplicateIndex
+import shutil
+import tempfile
+import groq
+import httpx
 
 
 class TestAIService:
     """Test AI Service functionality"""
     
-    @patch('ai_service.Groq')  # Mock Groq client class
+    @patch('groq.Groq')  # Mock Groq client class
     def test_ai_service_initialization(self, mock_groq_class):
         """Test AIService initializes correctly"""
         with patch.dict('os.environ', {'GROQ_API_KEY': 'test-key'}):
             service = AIService()
             assert service is not None
-            # Verify Groq was called with the API key
-            mock_groq_class.assert_called_once_with(api_key='test-key')
+            # The client (and the groq SDK) is created on first use, with the API key
+            mock_groq_class.assert_not_called()
+            assert service.client is mock_groq_class.return_value
+            mock_groq_class.assert_called_once_with(api_key='test-key', max_retries=0)
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_process_lead_niche_async_uses_async_client(self, mock_groq_class, mock_async_groq_class):
+        """Test async path awaits the async Groq client and post-processes the lead"""
+        service = AIService()
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        payload = {"name": "Jan Kowalski", "email": None, "phone": None, "product": "Fotowoltaika",
+                   "budget_est": None, "urgency": None, "city": None, "summary": "klient pyta o fotowoltaikę",
+                   "score": 7}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps(payload)
+        service.async_client.chat.completions.create = AsyncMock(return_value=response)
+
+        lead = asyncio.run(service.process_lead_niche_async("Jan Kowalski, jan@example.com"))
+
+        assert lead.score == 7
+        assert lead.email == "jan@example.com"
+        service.client.chat.completions.create.assert_not_called()
+
+    @patch('ai_service.asyncio.sleep', new_callable=AsyncMock)
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_process_lead_niche_async_retries_without_blocking(self, mock_groq_class, mock_async_groq_class, mock_sleep):
+        """Test async retries back off with asyncio.sleep and fall back to manual verification"""
+        service = AIService()
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        service.async_client.chat.completions.create = AsyncMock(side_effect=Exception("Groq down"))
+
+        with patch('ai_service.time.sleep') as mock_time_sleep:
+            lead = asyncio.run(service.process_lead_niche_async("Test"))
+
+        assert lead.score == 1
+        assert lead.summary.startswith("Requires manual verification")
+        assert mock_sleep.await_count == 2
+        mock_time_sleep.assert_not_called()
+
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_process_leads_async_respects_concurrency_cap(self, mock_groq_class, mock_async_groq_class):
+        """Test batch processing never runs more than max_concurrency items at once"""
+        service = AIService()
+        in_flight = 0
+        peak = 0
+
+        async def fake_process(text):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return Lead(summary=text, score=3)
+
+        with patch.object(service, 'process_lead_text_async', side_effect=fake_process):
+            results = asyncio.run(service.process_leads_async([str(i) for i in range(10)], max_concurrency=3))
+
+        assert peak == 3
+        assert [lead.summary for lead in results] == [str(i) for i in range(10)]
+
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_repeated_text_is_served_from_cache(self, mock_groq_class, mock_async_groq_class):
+        """Test identical (whitespace-normalized) text reuses the cached LLM output"""
+        service = AIService()
+        service.cache = LeadCache(max_entries=10, ttl_seconds=60)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"summary": "klient pyta o pompę ciepła", "score": 6})
+        service.client.chat.completions.create.return_value = response
+
+        first = service.process_lead_niche("Pompa ciepła, tel. 600 100 200")
+        second = service.process_lead_niche("  Pompa ciepła,\n tel. 600 100 200 ")
+
+        assert service.client.chat.completions.create.call_count == 1
+        assert second.model_dump() == first.model_dump()
+        assert service.cache.stats()["hits"] == 1
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_prompt_edit_invalidates_cache(self, mock_groq_class, mock_async_groq_class):
+        """Test that changing the niche prompt produces a different cache key"""
+        service = AIService()
+        service.prompts = {DEFAULT_NICHE: "PROMPT v1"}
+        key_v1 = service._cache_key("tekst", DEFAULT_NICHE)
+        service.prompts = {DEFAULT_NICHE: "PROMPT v2"}
+        key_v2 = service._cache_key("tekst", DEFAULT_NICHE)
+
+        assert key_v1 != key_v2
+
+
+def _legacy_scan(text):
+    """Reference implementation of the pre-rule-engine behavior"""
+    patterns = (r"\bkurw\w*\b", r"\bchuj\w*\b", r"\bjeb\w*\b", r"\bpierdol\w*\b", r"\bskurw\w*\b", r"\bspierdol\w*\b")
+    profane = any(re.search(p, (text or "").lower(), re.IGNORECASE) for p in patterns)
+    email = re.search(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", text) if text else None
+    phone = re.search(r"\+?\d[\d\s\-()]{6,}\d", text) if text else None
+    return profane, email.group(0) if email else None, phone.group(0).strip() if phone else None
+
+
+class TestTextRules:
+    """Test precompiled single-pass rule engine matches the legacy rules"""
+
+    TRICKY_TEXTS = [
+        "",
+        "Jan Kowalski, jan@example.com, tel. +48 600 100 200",
+        "kurwa@example.com napisał",
+        "123456789@example.com i telefon 500 600 700",
+        "tel 123 456 789jan@x.pl",
+        "KURWA, chcę fotowoltaikę",
+        "skurwiel i spierdalaj",
+        "İkurwa test",
+        "xkurwa nie jest wulgaryzmem, ale Kurwa jest",
+        "(12) 345-67-89 oraz 98765432",
+        "pompa ciepła 10kW, budżet 40 000 zł",
+    ]
+
+    def test_scan_matches_legacy_rules(self):
+        """Test scan_text agrees with separate profanity/email/phone rules"""
+        rng = random.Random(1234)
+        tokens = ["kurwa", "Jeb", "jan.kowalski@firma.pl", "12", "345", "+48", "-", "(", ")", " ", "@", "x",
+                  "ą", "İ", "pl", ".", "600 700 800", "a1", "CHUJ", "_"]
+        fuzz = ["".join(rng.choice(tokens) for _ in range(rng.randint(1, 25))) for _ in range(500)]
+
+        for text in self.TRICKY_TEXTS + fuzz:
+            assert tuple(text_rules.scan_text(text)) == _legacy_scan(text), text
+
+    def test_email_search_is_linear_on_long_tokens(self):
+        """Test a long run of local-part characters without '@' (e.g. base64) is scanned once, not per position"""
+        blob = "QUJD" * 25_000
+        started = time.perf_counter()
+        assert text_rules.extract_email(blob) is None
+        assert text_rules.extract_email(blob + "@x") is None
+        assert text_rules.extract_email(blob + " jan@example.com") == "jan@example.com"
+        # The unanchored pattern needed minutes for this
+        assert time.perf_counter() - started < 1.0
+        for text in ("x.jan@example.com", "a-b.c@d.pl, e@f.com", "@@jan@example.com", "ą.jan@ex.pl"):
+            assert text_rules.extract_email(text) == _legacy_scan(text)[1], text
+
+    def test_remove_profanity_terms_matches_sequential_patterns(self):
+        """Test combined profanity removal equals applying each pattern in turn"""
+        summary = "Klient kurwa pyta o  chuj pompę , skurwiel jebany."
+        expected = summary
+        for pattern in text_rules.PROFANITY_PATTERNS:
+            expected = re.sub(pattern, "", expected, flags=re.IGNORECASE)
+        expected = re.sub(r"\s+([,.;:!?])", r"\1", re.sub(r"\s{2,}", " ", expected).strip())
+
+        assert text_rules.remove_profanity_terms(summary) == expected
+
+    def test_sanitize_name(self):
+        """Test name heuristic keeps personal names and drops noise"""
+        assert text_rules.sanitize_name(" Jan Kowalski ") == "Jan Kowalski"
+        assert text_rules.sanitize_name("Wycena dla hotelu") is None
+        assert text_rules.sanitize_name("jan123") is None
+
+
+class TestNicheRouter:
+    """Test keyword automaton and scored niche routing"""
+
+    @pytest.mark.parametrize("substring_max_keywords", [0, 1000])
+    def test_automaton_finds_all_overlapping_occurrences(self, substring_max_keywords):
+        """Test both matching strategies report the same occurrences as a brute-force substring search"""
+        keywords = {"a": ("he", "she", "hers"), "b": ("his", "e", "klima", "klimatyzator", "he")}
+        automaton = KeywordAutomaton(keywords, substring_max_keywords=substring_max_keywords)
+        assert automaton.uses_automaton == (substring_max_keywords == 0)
+        rng = random.Random(42)
+        for _ in range(200):
+            text = "".join(rng.choice("hersiklmatyzo ") for _ in range(rng.randint(0, 40)))
+            expected = sorted(
+                (i, i + len(word), label)
+                for label, words in keywords.items() for word in set(words)
+                for i in range(len(text)) if text.startswith(word, i)
+            )
+            assert sorted(automaton.find(text)) == expected, text
+
+    def test_rank_scores_niches_and_counts_overlaps_once(self):
+        """Test candidates are scored by keyword hits with confidence"""
+        router = NicheRouter({
+            "hotelarstwo": ("hotel", "pokoje", "pokoj"),
+            "klimatyzacja_rekuperacja": ("klima", "klimatyz", "klimatyzator"),
+        }, default_niche="fotowoltaika_pompy_ciepla")
+
+        candidates = router.rank("Klimatyzator do hotelu, 3 pokoje")
+
+        assert [c.niche for c in candidates] == ["hotelarstwo", "klimatyzacja_rekuperacja"]
+        assert candidates[0].score == 2
+        assert candidates[1].score == 1
+        assert candidates[0].confidence == pytest.approx(2 / 3, abs=1e-3)
+
+    def test_route_ties_follow_registry_order_and_default(self):
+        """Test ties keep registry order and no hits fall back to default niche"""
+        router = NicheRouter({"first": ("abc",), "second": ("xyz",)}, default_niche="fallback")
+
+        assert router.route("xyz abc") == "first"
+        assert router.route("nothing here") == "fallback"
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_detect_niche_uses_prompt_registry_keywords(self, mock_groq_class, mock_async_groq_class):
+        """Test AIService routes with keywords from prompts.NICHE_KEYWORDS to niches that have a prompt"""
+        service = AIService()
+
+        assert set(NICHE_KEYWORDS) <= set(PROMPTS) and DEFAULT_NICHE in PROMPTS
+        assert service._detect_niche("Proszę o demo i cennik abonamentu") == "saas_subscription_support"
+        assert service._detect_niche("Zamówienie SKU 123, rozmiar M, kiedy wysyłka?") == "ecommerce_product_inquiry"
+        assert service._detect_niche("Dzień dobry") == DEFAULT_NICHE
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_keywords_do_not_match_inside_words(self, mock_groq_class, mock_async_groq_class):
+        """Test "api" in "napiszcie" and "demo" in "demontaż" do not route renovation inquiries to SaaS"""
+        service = AIService()
+
+        assert service._detect_niche("Dzień dobry, napiszcie proszę ile kosztuje malowanie mieszkania.") == "home_renovation_general"
+        assert service._detect_niche("Zlecę demontaż starej glazury") == "home_renovation_general"
+        assert service._detect_niche("Kapitalny pomysł, zapisanie się na remont") == "home_renovation_general"
+        assert service._detect_niche("Poproszę o demo. Potrzebujemy dostępu do API") == "saas_subscription_support"
+
+    def test_router_rejects_keywords_for_unknown_niches(self):
+        """Test a keyword niche or default without a prompt is reported at startup"""
+        with pytest.raises(ValueError, match="hotelarstwo"):
+            NicheRouter({"hotelarstwo": ("hotel",)}, default_niche="a", known_niches={"a"})
+        with pytest.raises(ValueError, match="missing"):
+            NicheRouter({"a": ("x",)}, default_niche="missing", known_niches={"a"})
+
+
+class TestSpamFilter:
+    """Test local spam/off-topic pre-classifier"""
+
+    JOB_APPLICATION = ("Dzień dobry, w odpowiedzi na ogłoszenie o pracę przesyłam CV oraz list motywacyjny. "
+                       "Aplikuję na stanowisko montażysty. Anna Nowak, anna.nowak@example.com, 600 700 800")
+
+    def test_classifies_job_application_and_empty_ping(self):
+        """Test obvious off-topic messages get high confidence"""
+        spam_filter = SpamFilter(mode="on", threshold=0.9)
+
+        assert spam_filter.classify(self.JOB_APPLICATION).is_spam is True
+        assert spam_filter.classify("  ?? ").reasons == ("empty",)
+
+    def test_short_inquiry_is_not_empty(self):
+        """Test one-word inquiries are not treated as empty pings"""
+        spam_filter = SpamFilter(mode="on", threshold=0.9)
+
+        for text in ("Klimatyzacja", "Wycena?", "ok"):
+            assert spam_filter.classify(text).is_spam is False, text
+
+    def test_real_inquiry_is_not_spam(self):
+        """Test inquiry phrases keep real leads below the threshold"""
+        spam_filter = SpamFilter(mode="on", threshold=0.9)
+        verdict = spam_filter.classify("Proszę o wycenę pompy ciepła do domu 150 m2, budżet 40 tys. zł")
+
+        assert verdict.is_spam is False
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_on_mode_skips_llm_and_keeps_contacts(self, mock_groq_class, mock_async_groq_class):
+        """Test 'on' mode returns neutral score-1 lead without calling Groq"""
+        service = AIService()
+        service.spam_filter = SpamFilter(mode="on", threshold=0.9)
+
+        lead = asyncio.run(service.process_lead_text_async(self.JOB_APPLICATION))
+
+        assert lead.score == 1
+        assert lead.summary == "Zapytanie poza zakresem oferty."
+        assert lead.email == "anna.nowak@example.com"
+        assert lead.phone == "600 700 800"
+        service.async_client.chat.completions.create.assert_not_called()
+        assert service.spam_filter.stats()["short_circuited"] == 1
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_shadow_mode_calls_llm_and_records_agreement(self, mock_groq_class, mock_async_groq_class):
+        """Test 'shadow' mode still uses the LLM and reports agreement"""
+        service = AIService()
+        service.spam_filter = SpamFilter(mode="shadow", threshold=0.9)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"summary": "oferta pracy", "score": 1})
+        service.client.chat.completions.create.return_value = response
+
+        lead = service.process_lead_text(self.JOB_APPLICATION)
+
+        assert lead.score == 1
+        service.client.chat.completions.create.assert_called_once()
+        shadow = service.spam_filter.stats()["shadow"]
+        assert shadow["agree_spam"] == 1
+        assert shadow["agreement"] == 1.0
+
+
+# (raw e-mail, expected email, expected phone, phrases that must survive cleaning)
+CLEANER_CORPUS = [
+    (
+        "<html><head><style>p{color:red}</style></head><body><p>Dzień dobry,</p>"
+        "<p>proszę o wycenę pompy ciepła do domu 150 m2, budżet ok. 40 tys. zł. "
+        "<a href=\"https://example.com/oferta?utm_source=newsletter&amp;fbclid=123\">link</a></p>"
+        "<p>Pozdrawiam<br>Jan Kowalski</p><p>-- </p><p>Jan Kowalski<br>Kowalski Sp. z o.o.<br>"
+        "tel. +48 600 100 200<br>jan.kowalski@firma.pl</p><p>Informacja zawarta w tej wiadomości jest "
+        "poufna. Administratorem danych osobowych jest Kowalski Sp. z o.o.</p></body></html>",
+        "jan.kowalski@firma.pl", "+48 600 100 200", ("wycenę pompy ciepła", "40 tys. zł", "Jan Kowalski"),
+    ),
+    (
+        "Dzień dobry, chciałbym zamówić montaż klimatyzacji w biurze 40m2.\nTel 601 202 303\n"
+        "Wysłane z iPhone'a\n\nW dniu 12.03.2026 o 10:00 Biuro <biuro@naszafirma.pl> napisał:\n"
+        "> Dziękujemy za kontakt, prosimy o szczegóły.\n> Biuro, tel. 22 100 20 30\n",
+        None, "601 202 303", ("montaż klimatyzacji", "40m2"),
+    ),
+    (
+        "Hi, we need 200 units of SKU 4411 in size M shipped to Berlin by May.\n"
+        "Details: https://shop.example.com/p/4411?utm_campaign=spring&gclid=abc\n\n"
+        "Best,\nAnna Schmidt\n--\nAnna Schmidt | Procurement\nanna.schmidt@retail.example.de\n"
+        "+49 30 1234 5678\n\nThis email and any attachments are confidential and intended solely "
+        "for the addressee. Please consider the environment before printing this email.\n\n"
+        "-----Original Message-----\nFrom: Sales <sales@ourshop.example.com>\nSent: Monday\n"
+        "Thanks for your interest, our price list is attached. Call 800 900 100.",
+        "anna.schmidt@retail.example.de", "+49 30 1234 5678",
+        ("200 units of SKU 4411", "https://shop.example.com/p/4411", "Anna Schmidt"),
+    ),
+    (
+        "---------- Forwarded message ---------\nOd: Piotr Nowak <piotr.nowak@example.com>\n"
+        "Temat: remont łazienki\n\nProszę o ofertę na remont łazienki 6 m2. Tel. 502 303 404",
+        "piotr.nowak@example.com", "502 303 404", ("remont łazienki 6 m2", "Piotr Nowak"),
+    ),
+    (
+        "Interesuje mnie demo platformy dla 30 użytkowników. Ewa, ewa@startup.io",
+        "ewa@startup.io", None, ("demo platformy dla 30 użytkowników",),
+    ),
+]
+
+
+class TestInputCleaner:
+    """Test e-mail noise stripping and the prompt token budget"""
+
+    @pytest.mark.parametrize("raw, email, phone, phrases", CLEANER_CORPUS)
+    def test_corpus_keeps_what_extraction_needs(self, raw, email, phone, phrases):
+        """Test cleaned text keeps the sender's contacts and the inquiry, and never grows"""
+        cleaned = InputCleaner(token_budget=1500).clean(raw)
+
+        assert text_rules.extract_email(cleaned.text) == email
+        assert text_rules.extract_phone(cleaned.text) == phone
+        for phrase in phrases:
+            assert phrase in cleaned.text
+        assert cleaned.tokens_after <= cleaned.tokens_before
+
+    def test_corpus_drops_noise_and_saves_tokens(self):
+        """Test replies, footers, HTML and tracking parameters are gone and tokens are saved overall"""
+        cleaner = InputCleaner(token_budget=1500)
+        cleaned = [cleaner.clean(raw).text for raw, *_ in CLEANER_CORPUS]
+
+        noise = ("utm_", "fbclid", "gclid", "<p>", "Administratorem", "confidential", "Dziękujemy za kontakt",
+                 "price list", "iPhone")
+        for text in cleaned:
+            for fragment in noise:
+                assert fragment not in text
+        stats = cleaner.stats()
+        assert stats["requests"] == len(CLEANER_CORPUS)
+        assert stats["tokens_saved"] > stats["tokens_before"] * 0.3
+
+    def test_budget_truncates_body_but_keeps_contacts(self):
+        """Test an oversized message is cut to the budget and its contact lines survive"""
+        body = "Szczegóły zapytania. " * 200 + "\nTelefon: 600 700 800"
+        cleaned = InputCleaner(token_budget=50).clean(body)
+
+        assert cleaned.truncated is True
+        assert cleaned.tokens_after <= 50
+        assert "600 700 800" in cleaned.text
+
+    def test_disabled_cleaner_passes_text_through(self):
+        """Test INPUT_CLEANING_ENABLED=false leaves the text untouched"""
+        raw = CLEANER_CORPUS[0][0]
+        assert InputCleaner(enabled=False).clean(raw).text == raw
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_prompt_is_built_from_cleaned_text(self, mock_groq_class, mock_async_groq_class):
+        """Test the prompt sent to Groq no longer contains the quoted chain"""
+        service = AIService()
+        service.cache = LeadCache(max_entries=0)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"summary": "klient pyta o klimatyzację", "score": 6})
+        service.client.chat.completions.create.return_value = response
+
+        lead = service.process_lead_niche(CLEANER_CORPUS[1][0])
+
+        prompt = service.client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        assert "Dziękujemy za kontakt" not in prompt
+        assert lead.phone == "601 202 303"
+
+
+def _groq_status_error(error_class, status, headers=None):
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return error_class("error", response=response, body=None)
+
+
+class TestRetryPolicy:
+    """Test error classification, backoff and the circuit breaker around Groq"""
+
+    def test_classifies_error_kinds(self):
+        """Test rate limits, timeouts, 5xx, parse and client errors are told apart"""
+        request = httpx.Request("POST", "https://api.groq.com")
+        assert classify_error(_groq_status_error(groq.RateLimitError, 429)) == "rate_limit"
+        assert classify_error(groq.APITimeoutError(request=request)) == "timeout"
+        assert classify_error(_groq_status_error(groq.InternalServerError, 503)) == "server"
+        assert classify_error(groq.APIConnectionError(request=request)) == "server"
+        assert classify_error(json.JSONDecodeError("x", "", 0)) == "parse"
+        assert classify_error(_groq_status_error(groq.BadRequestError, 400)) == "client"
+
+    def test_retry_after_is_honored_or_gives_up(self):
+        """Test Retry-After sets the delay and a too long one stops retrying"""
+        policy = RetryPolicy(max_attempts=3, max_retry_after=30)
+
+        assert policy.next_delay(0, _groq_status_error(groq.RateLimitError, 429, {"retry-after": "2"})) == 2.0
+        assert policy.next_delay(0, _groq_status_error(groq.RateLimitError, 429, {"retry-after": "120"})) is None
+        assert policy.stats()["errors"] == {"rate_limit": 2}
+
+    def test_backoff_is_capped_jittered_and_skips_client_errors(self):
+        """Test exponential backoff with full jitter, no retry on 4xx and none after the last attempt"""
+        policy = RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=2.0)
+        timeout = groq.APITimeoutError(request=httpx.Request("POST", "https://api.groq.com"))
+
+        for attempt in range(4):
+            delay = policy.next_delay(attempt, timeout)
+            assert 0 <= delay <= min(2.0, 0.5 * 2 ** attempt)
+        assert policy.next_delay(4, timeout) is None
+        assert policy.next_delay(0, _groq_status_error(groq.AuthenticationError, 401)) is None
+
+    def test_breaker_opens_probes_and_closes(self):
+        """Test closed -> open after provider failures, half-open probe after the timeout, closed on success"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        outage = _groq_status_error(groq.InternalServerError, 500)
+
+        with patch('retry_policy.time.monotonic', return_value=100.0):
+            breaker.record_failure(_groq_status_error(groq.RateLimitError, 429))  # provider is up
+            breaker.record_failure(outage)
+            assert breaker.allow_request() is True
+            breaker.record_failure(outage)
+            assert breaker.state == "open"
+            assert breaker.allow_request() is False
+
+        with patch('retry_policy.time.monotonic', return_value=131.0):
+            assert breaker.allow_request() is True   # the probe
+            assert breaker.allow_request() is False  # only one probe at a time
+            breaker.record_success()
+
+        assert breaker.state == "closed"
+        assert breaker.stats()["rejected"] == 2
+
+    @patch('ai_service.time.sleep')
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_open_breaker_fails_fast_without_calling_groq(self, mock_groq_class, mock_async_groq_class, mock_sleep):
+        """Test an outage opens the breaker and later requests skip Groq"""
+        service = AIService()
+        service.cache = LeadCache(max_entries=0)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        service.retry_policy = RetryPolicy(max_attempts=3)
+        service.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        service.client.chat.completions.create.side_effect = _groq_status_error(groq.InternalServerError, 503)
+
+        first = service.process_lead_niche("Zapytanie o fotowoltaikę")
+        second = service.process_lead_niche("Inne zapytanie o pompę ciepła")
+
+        assert first.summary.startswith("Requires manual verification")
+        assert second.summary.startswith("Requires manual verification")
+        assert service.client.chat.completions.create.call_count == 2
+        assert service.circuit_breaker.stats()["state"] == "open"
+
+
+class TestLLMLimiter:
+    """Test the AIMD concurrency limiter and rate buckets in front of Groq"""
+
+    def test_limit_climbs_on_success_and_halves_on_rate_limit(self):
+        """Test additive increase per success and multiplicative decrease on 429"""
+        limiter = LLMLimiter(initial_limit=4, max_limit=8, cooldown=0)
+
+        for _ in range(4):
+            with limiter.slot("a", 100):
+                pass
+        assert 4.9 < limiter.limit < 5.0
+
+        with pytest.raises(groq.RateLimitError):
+            with limiter.slot("a", 100):
+                raise _groq_status_error(groq.RateLimitError, 429)
+        assert limiter.limit == pytest.approx(limiter.stats()["limit"], abs=0.01)
+        assert 2.4 < limiter.limit < 2.5
+        assert limiter.stats()["in_flight"] == 0
+
+    def test_latency_spike_decreases_and_cooldown_limits_it(self):
+        """Test a call much slower than the moving average cuts the limit once per cooldown"""
+        limiter = LLMLimiter(initial_limit=8, cooldown=60, spike_factor=3)
+        limiter.latency_ewma = 0.01
+
+        for _ in range(2):
+            permit = limiter.acquire("a", 10)
+            permit.started -= 1.0
+            limiter.release(permit)
+
+        assert limiter.limit == 4
+        assert limiter.decreases == 1
+
+    def test_buckets_delay_requests_and_tokens(self):
+        """Test requests/min and tokens/min buckets hold back calls and usage corrects the estimate"""
+        limiter = LLMLimiter(requests_per_minute=60, tokens_per_minute=600)
+
+        permit = limiter.acquire("a", 500)
+        permit.record_usage(MagicMock(usage=MagicMock(total_tokens=200)))
+        limiter.release(permit)
+
+        assert limiter.stats()["tokens_available"] == pytest.approx(400, abs=1)
+        limiter.requests.available = 0
+        assert 0.9 < limiter._try_admit("a", 10) <= 1.0  # requests: 1 per second
+        limiter.requests.available = 60
+        assert limiter._try_admit("a", 500) > 5  # tokens: 100 missing at 10/s
+
+    def test_fair_niches_let_a_quiet_niche_through_a_burst(self):
+        """Test a waiting niche that was not served recently goes before a busy one"""
+        limiter = LLMLimiter(initial_limit=1, max_limit=1, fair_niches=True)
+        admitted = []
+
+        async def call(niche):
+            async with limiter.slot_async(niche, 10):
+                admitted.append(niche)
+                await asyncio.sleep(0.02)
+
+        async def burst():
+            first = asyncio.ensure_future(call("a"))
+            await asyncio.sleep(0)
+            others = [asyncio.ensure_future(call("a")) for _ in range(5)]
+            await asyncio.sleep(0.005)
+            others.append(asyncio.ensure_future(call("b")))
+            await asyncio.gather(first, *others)
+
+        asyncio.run(burst())
+
+        assert admitted[:2] == ["a", "b"]
+        assert len(admitted) == 7
+
+    @patch('groq.Groq')
+    def test_rate_limited_stub_server_backs_off_and_completes(self, mock_groq_class):
+        """Test 30 concurrent leads against a stub LLM that allows 3 at a time: the limiter shrinks and all succeed"""
+        with StubLLM(latency=0.05, max_concurrency=3, retry_after=0.02) as llm:
+            service = AIService()
+            service.async_client = groq.AsyncGroq(api_key="stub", base_url=llm.url, max_retries=0)
+            service.cache = LeadCache(max_entries=0)
+            service.retry_policy = RetryPolicy(max_attempts=20, base_delay=0.01, max_delay=0.05)
+            service.circuit_breaker = CircuitBreaker(failure_threshold=0)
+            service.limiter = LLMLimiter(initial_limit=16, max_limit=16, cooldown=0.05)
+
+            texts = [f"Dzień dobry, proszę o wycenę fotowoltaiki nr {i}. jan@example.com" for i in range(30)]
+            results = asyncio.run(service.process_leads_async(texts, max_concurrency=30))
+
+        assert all(isinstance(lead, Lead) and lead.score == 7 for lead in results)
+        assert llm.accepted == 30
+        assert llm.rate_limited > 0
+        assert service.limiter.decreases >= 1
+        assert service.limiter.stats()["limit"] < 16
+        assert service.limiter.stats()["in_flight"] == 0
+
+
+class TestSingleFlight:
+    """Test coalescing of identical in-flight LLM calls"""
+
+    def test_threads_share_one_call(self):
+        """Test concurrent sync callers with one key run the function once"""
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "lead"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", compute))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while flight.stats()["coalesced"] < 3:
+            time.sleep(0.005)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert sorted(shared for _, shared in results) == [False, True, True, True]
+        assert flight.stats() == {"enabled": True, "calls": 4, "coalesced": 3, "in_flight": 0}
+
+    def test_async_error_is_shared_and_key_is_freed(self):
+        """Test all waiters get the exception and the next call runs again"""
+        flight = SingleFlight()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        async def run():
+            results = await asyncio.gather(*(flight.do_async("k", failing) for _ in range(3)), return_exceptions=True)
+            assert all(isinstance(r, RuntimeError) for r in results)
+            with pytest.raises(RuntimeError):
+                await flight.do_async("k", failing)
+
+        asyncio.run(run())
+        assert len(calls) == 2
+
+    def test_cancelled_caller_does_not_cancel_the_others(self):
+        """Test the shared computation survives one caller's cancellation but not the last one's"""
+        flight = SingleFlight()
+        finished = []
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+            return "lead"
+
+        async def run():
+            first = asyncio.ensure_future(flight.do_async("k", compute))
+            second = asyncio.ensure_future(flight.do_async("k", compute))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            assert await second == ("lead", True)
+
+            lone = asyncio.ensure_future(flight.do_async("k2", compute))
+            await asyncio.sleep(0.01)
+            lone.cancel()
+            await asyncio.sleep(0.06)
+
+        asyncio.run(run())
+        assert len(finished) == 1
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_identical_texts_make_one_groq_call(self, mock_groq_class, mock_async_groq_class):
+        """Test concurrent identical (after whitespace normalization) texts share one completion"""
+        service = AIService()
+        service.cache = LeadCache(max_entries=0)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"name": "Jan Kowalski", "summary": "Wycena", "score": 6})
+
+        async def slow_create(**kwargs):
+            await asyncio.sleep(0.05)
+            return response
+
+        service.async_client.chat.completions.create = AsyncMock(side_effect=slow_create)
+
+        async def run():
+            return await asyncio.gather(*(
+                service.process_lead_niche_async(text)
+                for text in ("Proszę o wycenę, Jan", "Proszę o wycenę, Jan", "Proszę  o wycenę,\nJan")
+            ))
+
+        leads = asyncio.run(run())
+
+        assert service.async_client.chat.completions.create.await_count == 1
+        assert [lead.score for lead in leads] == [6, 6, 6]
+        assert len({id(lead) for lead in leads}) == 3
+        assert service.singleflight.stats()["coalesced"] == 2
+
+
+# (model output, expected fields) for answers the old fence-strip + greedy regex + json.loads rejected
+MALFORMED_OUTPUTS = [
+    ('```json\n{"name": "Jan", "score": 7,}\n```', {"name": "Jan", "score": 7}),
+    ('Oto wynik: {"summary": "Klient {pilny}", "score": 8} Daj znać {jeśli coś}', {"summary": "Klient {pilny}", "score": 8}),
+    ('{"score": 6, // pewna ocena\n "city": None, "urgency": True}', {"score": 6, "city": None}),
+    ('{"score": 5, "name": "Jan", "summary": "Klient pyta o fotowolt', {"name": "Jan", "summary": "Klient pyta o fotowolt"}),
+    ('{"score": 5, "name": "Jan", "city": ', {"name": "Jan", "score": 5}),
+    ('{"score": "8/10", "email": "brak", "budget_est": 30000}', {"score": 8, "email": None, "budget_est": "30000"}),
+    ('{"summary": "linia 1\nlinia 2", "score": 4}', {"summary": "linia 1\nlinia 2", "score": 4}),
+]
+
+
+class TestLeadSerialization:
+    """Test the single JSON rendering of a Lead and the memoized e-mail validation"""
+
+    def test_render_json_matches_pydantic(self):
+        """Test render_json gives the same compact UTF-8 JSON as model_dump_json"""
+        lead = Lead(name="Małgorzata Wiśniewska", email="m.w@example.com", city="Łódź", score=9)
+        assert render_json(lead) == lead.model_dump_json().encode("utf-8")
+        assert Lead.model_validate_json(render_json(lead)) == lead
+
+    def test_fast_json_falls_back_to_stdlib(self):
+        """Test dict payloads encode the same with and without orjson"""
+        import fast_json
+        payload = {"niche": "fotowoltaika", "miasto": "Łódź", "count": 3, "rate": 0.25, "items": [None, True]}
+        with_orjson = fast_json.dumps(payload)
+        with patch('fast_json.orjson', None):
+            assert fast_json.dumps(payload) == with_orjson
+            assert fast_json.loads(with_orjson) == payload
+
+    def test_email_validation_is_memoized(self):
+        """Test a valid address is checked by email-validator once; invalid ones are never remembered"""
+        schemas._valid_emails.clear()
+        with patch('pydantic.networks.validate_email', wraps=__import__('pydantic').networks.validate_email) as check:
+            for _ in range(3):
+                assert Lead(email="Anna.Nowak@Example.COM", score=5).email == "Anna.Nowak@example.com"
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    Lead(email="brak", score=5)
+        assert check.call_count == 1 + 2
+
+    def test_email_memo_is_bounded(self):
+        """Test the memo is cleared when full instead of growing with every address"""
+        schemas._valid_emails.clear()
+        with patch('schemas._EMAIL_MEMO_SIZE', 3):
+            for i in range(7):
+                Lead(email=f"user{i}@example.com", score=5)
+            assert len(schemas._valid_emails) <= 3
+
+
+class TestLeadParser:
+    """Test tolerant extraction and repair of model output"""
+
+    @pytest.mark.parametrize("raw,expected", MALFORMED_OUTPUTS)
+    def test_repairs_malformed_output(self, raw, expected):
+        """Test fences, prose, comments, literals, truncation and invalid fields are handled"""
+        lead = LeadParser().parse(raw)
+        for field, value in expected.items():
+            assert getattr(lead, field) == value
+
+    def test_well_formed_output_takes_the_direct_path(self):
+        """Test valid JSON goes straight to a Lead, equal to what the tolerant path builds"""
+        raw = json.dumps({"name": "Jan Kowalski", "email": "Jan@Example.COM", "city": "Kraków",
+                          "score": 7, "extra": "ignored"}, ensure_ascii=False)
+        direct = validate_json(raw)
+        assert direct == to_lead(extract_object(raw))[0]
+        assert direct.email == "Jan@example.com"
+        # Anything the tolerant path has to repair is left to it
+        for bad, _ in MALFORMED_OUTPUTS:
+            if validate_json(bad) is not None:
+                assert validate_json(bad) == LeadParser().parse(bad)
+        assert validate_json('{"score": "8/10"}') is None
+        assert validate_json("Oto wynik: {}") is None
+
+    def test_rejects_output_without_usable_score(self):
+        """Test only a missing or unusable score rejects the object, and it counts as a parse error"""
+        parser = LeadParser()
+        with pytest.raises(LeadParseError):
+            parser.parse("Nie potrafię ocenić tego leada.")
+        with pytest.raises(LeadParseError):
+            parser.parse('{"name": "Jan", "score": "wysoka"}')
+
+        stats = parser.stats()
+        assert stats["failed"] == 2 and stats["failure_rate"] == 1.0
+        assert classify_error(LeadParseError("x")) == "parse"
+
+    @patch('groq.Groq')
+    def test_repaired_output_needs_no_retry(self, mock_groq_class):
+        """Test a trailing comma no longer costs another Groq round trip"""
+        service = AIService()
+        service.cache = LeadCache(max_entries=0)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        response = MagicMock()
+        response.choices[0].message.content = '{"name": "Jan Kowalski", "score": 7,}'
+        service.client.chat.completions.create.return_value = response
+
+        lead = service.process_lead_niche("Jan Kowalski prosi o wycenę")
+
+        assert lead.score == 7
+        assert service.client.chat.completions.create.call_count == 1
+        assert service.client.chat.completions.create.call_args.kwargs["response_format"] == {"type": "json_object"}
+        assert service.parser.stats()["repairs"] == {"trailing_comma": 1}
+
+    @patch('groq.Groq')
+    def test_json_mode_rejection_is_parsed_locally(self, mock_groq_class):
+        """Test a JSON mode 400 with failed_generation is repaired instead of retried"""
+        service = AIService()
+        service.cache = LeadCache(max_entries=0)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+        body = {"error": {"message": "Failed to generate JSON", "type": "invalid_request_error",
+                          "code": "json_validate_failed", "failed_generation": '{"score": 6, "city": "Gdańsk",'}}
+        rejection = groq.BadRequestError("error", response=httpx.Response(400, request=request), body=body)
+        service.client.chat.completions.create.side_effect = rejection
+
+        lead = service.process_lead_niche("Zapytanie z Gdańska")
+
+        assert (lead.score, lead.city) == (6, "Gdańsk")
+        assert service.client.chat.completions.create.call_count == 1
+        assert service.parser.stats()["recovered_json_mode"] == 1
+        assert classify_error(rejection) == "parse"
+
+
+def _packing_service(packed_answer):
+    """AIService whose fake Groq answers packed prompts with packed_answer(ids) and single prompts with one lead."""
+    service = AIService()
+    service.cache = LeadCache(max_entries=0)
+    service.prompts = {DEFAULT_NICHE: "PROMPT"}
+    service.packer = LeadPacker(enabled=True, max_items=4, max_chars=200)
+
+    async def create(**kwargs):
+        prompt = kwargs["messages"][1]["content"]
+        response = MagicMock()
+        if "INPUT MESSAGES" in prompt:
+            ids = [int(n) for n in re.findall(r"\[id=(\d+)\]", prompt)]
+            response.choices[0].message.content = packed_answer(ids)
+        else:
+            response.choices[0].message.content = json.dumps({"summary": "pojedynczo", "score": 5})
+        return response
+
+    service.async_client.chat.completions.create = AsyncMock(side_effect=create)
+    return service
+
+
+class TestLeadPacker:
+    """Test packed mode: several short messages per LLM call"""
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_short_messages_share_calls_and_are_postprocessed_one_by_one(self, mock_groq_class, mock_async_groq_class):
+        """Test 6 short messages take 2 packed calls, a long one its own call, results keep order"""
+        service = _packing_service(lambda ids: json.dumps({"leads": [
+            {"id": n, "summary": f"lead {n}", "score": 7} for n in reversed(ids)
+        ]}))
+        texts = [f"Wycena pompy ciepła, tel. 600 100 10{i}" for i in range(6)] + ["Długi opis inwestycji. " * 20]
+
+        results = asyncio.run(service.process_leads_async(texts))
+
+        calls = service.async_client.chat.completions.create.await_args_list
+        assert sum("INPUT MESSAGES" in c.kwargs["messages"][1]["content"] for c in calls) == 2
+        assert len(calls) == 3
+        assert [lead.phone for lead in results[:6]] == [f"600 100 10{i}" for i in range(6)]
+        assert [lead.summary for lead in results[:6]] == ["Lead 1.", "Lead 2.", "Lead 3.", "Lead 4.", "Lead 1.", "Lead 2."]
+        assert results[6].summary == "Pojedynczo."
+        assert service.packer.stats()["items"] == 6
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_missing_or_invalid_items_fall_back_to_single_calls(self, mock_groq_class, mock_async_groq_class):
+        """Test an item left out of the answer or without a score is redone with a single call"""
+        service = _packing_service(lambda ids: json.dumps({"leads": [
+            {"id": 1, "summary": "spakowany", "score": 6},
+            {"id": 3, "summary": "bez oceny", "score": None},
+        ]}))
+
+        results = asyncio.run(service.process_leads_async(["Zapytanie A", "Zapytanie B", "Zapytanie C"]))
+
+        assert [lead.summary for lead in results] == ["Spakowany.", "Pojedynczo.", "Pojedynczo."]
+        assert service.async_client.chat.completions.create.await_count == 3
+        assert service.packer.stats()["fallbacks"] == 2
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_unusable_packed_answer_falls_back_for_every_item(self, mock_groq_class, mock_async_groq_class):
+        """Test a packed answer without a lead list sends every item to a single call"""
+        service = _packing_service(lambda ids: "Przepraszam, nie mogę pomóc.")
+
+        results = asyncio.run(service.process_leads_async(["Zapytanie A", "Zapytanie B"]))
+
+        assert [lead.summary for lead in results] == ["Pojedynczo.", "Pojedynczo."]
+        assert service.packer.stats()["failed_calls"] == 1
+
+    @patch('groq.AsyncGroq')
+    @patch('groq.Groq')
+    def test_answers_to_escalate_are_not_cached(self, mock_groq_class, mock_async_groq_class):
+        """Test a borderline packed answer of the cheap model is redone through the cascade, not cached"""
+        service = _packing_service(lambda ids: json.dumps({"leads": [
+            {"id": 1, "summary": "pewny", "score": 9},
+            {"id": 2, "summary": "graniczny", "score": 5},
+        ]}))
+        service.cascade = ModelCascade(["cheap", "strong"])
+        service.model = "cheap"
+        service.cache = LeadCache(max_entries=10, ttl_seconds=60)
+
+        results = asyncio.run(service.process_leads_async(["Zapytanie A", "Zapytanie B"]))
+        again = asyncio.run(service.process_lead_niche_async("Zapytanie B"))
+
+        calls = service.async_client.chat.completions.create.await_args_list
+        assert [c.kwargs["model"] for c in calls] == ["cheap", "cheap", "strong"]
+        assert [lead.summary for lead in results] == ["Pewny.", "Pojedynczo."]
+        assert again.summary == "Pojedynczo."
+        assert service.cascade.stats()["tiers"][0]["escalated"] == 1
+
+
+class TestMetrics:
+    """Test the Prometheus text rendering of histograms and counters"""
+
+    def test_histogram_and_counter_render(self):
+        """Test cumulative buckets, sum/count per label set, and label escaping"""
+        registry = Registry()
+        histogram = registry.register(Histogram("stage_seconds", "Stage time.", labelnames=("stage",), buckets=(0.1, 1.0)))
+        counter = registry.register(Counter("retries_total", "Retries.", labelnames=("error",)))
+
+        histogram.observe(0.05, stage="parse")
+        histogram.observe(0.5, stage="parse")
+        histogram.observe(5, stage="parse")
+        with histogram.time(stage="llm"):
+            pass
+        counter.inc(error='rate "limit"')
+        counter.inc(2, error='rate "limit"')
+
+        lines = registry.render().splitlines()
+        assert "# TYPE stage_seconds histogram" in lines
+        assert 'stage_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+        assert 'stage_seconds_bucket{stage="parse",le="1"} 2' in lines
+        assert 'stage_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+        assert 'stage_seconds_sum{stage="parse"} 5.55' in lines
+        assert 'stage_seconds_count{stage="llm"} 1' in lines
+        assert 'retries_total{error="rate \\"limit\\""} 3' in lines
+
+
+class TestLeadCache:
+    """Test LLM response cache"""
+
+    def test_lru_eviction(self):
+        """Test least recently used entry is evicted first"""
+        cache = LeadCache(max_entries=2, ttl_seconds=60)
+        cache.set("a", {"score": 1})
+        cache.set("b", {"score": 2})
+        cache.get("a")
+        cache.set("c", {"score": 3})
+
+        assert cache.get("b") is None
+        assert cache.get("a") == {"score": 1}
+        assert cache.stats()["evictions"] == 1
+
+    def test_stores_rendered_lead(self, tmp_path):
+        """Test a lead rendered once with render_json is stored as is and read back as its fields"""
+        lead = Lead(name="Łukasz Żak", email="lukasz@example.com", summary="Pompa ciepła", score=6)
+        cache = LeadCache(max_entries=10, ttl_seconds=60, db_path=str(tmp_path / "cache.sqlite"))
+        cache.set("a", render_json(lead))
+
+        assert Lead(**cache.get("a")) == lead
+        reopened = LeadCache(max_entries=10, ttl_seconds=60, db_path=str(tmp_path / "cache.sqlite"))
+        assert reopened.get("a") == lead.model_dump(mode="json")
+
+    def test_ttl_expiry(self):
+        """Test expired entries are treated as misses"""
+        cache = LeadCache(max_entries=10, ttl_seconds=60)
+        with patch('lead_cache.time.time', return_value=1000.0):
+            cache.set("a", {"score": 1})
+        with patch('lead_cache.time.time', return_value=1061.0):
+            assert cache.get("a") is None
+
+        stats = cache.stats()
+        assert stats["expirations"] == 1
+        assert stats["misses"] == 1
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        """Test SQLite tier warms a fresh cache instance"""
+        db_path = str(tmp_path / "cache.sqlite")
+        cache = LeadCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+        cache.set("a", {"score": 4})
+        cache.close()
+
+        restarted = LeadCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+
+        assert restarted.get("a") == {"score": 4}
+        assert restarted.stats()["disk_hits"] == 1
+
+    def test_async_disk_tier_runs_off_the_event_loop(self, tmp_path):
+        """Test aget/aset hit SQLite through a worker thread and still warm the memory tier"""
+        db_path = str(tmp_path / "cache.sqlite")
+        cache = LeadCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+        asyncio.run(cache.aset("a", {"score": 4}))
+        cache.close()
+
+        restarted = LeadCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+        with patch('lead_cache.asyncio.to_thread', wraps=asyncio.to_thread) as mock_to_thread:
+            assert asyncio.run(restarted.aget("a")) == {"score": 4}
+            assert asyncio.run(restarted.aget("a")) == {"score": 4}
+            assert asyncio.run(restarted.aget("missing")) is None
+
+        # Second lookup of "a" is served from memory without a thread hop
+        assert mock_to_thread.call_count == 2
+        stats = restarted.stats()
+        assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (2, 1, 1)
+
+
+class TestWriteBehindQueue:
+    """Test write-behind bulk insert queue"""
+
+    def _queue(self, tmp_path, insert_many, **kwargs):
+        options = dict(max_batch=3, flush_interval=60, max_pending=10, max_retries=2,
+                       retry_base_delay=0, spool_path=str(tmp_path / "spool.sqlite"), replay_interval=3600)
+        options.update(kwargs)
+        return WriteBehindQueue(insert_many, **options)
+
+    def test_flushes_when_batch_size_reached(self, tmp_path):
+        """Test a full batch is written with one bulk insert"""
+        insert_many = AsyncMock(return_value={"success": True})
+        queue = self._queue(tmp_path, insert_many)
+
+        async def scenario():
+            await queue.enqueue_many([Lead(summary=str(i), score=3) for i in range(3)])
+            await asyncio.sleep(0.05)
+            await queue.stop()
+
+        asyncio.run(scenario())
+
+        insert_many.assert_awaited_once()
+        assert len(insert_many.await_args.args[0]) == 3
+
+    def test_flushes_on_interval(self, tmp_path):
+        """Test a partial batch is written once the flush interval passes"""
+        insert_many = AsyncMock(return_value={"success": True})
+        queue = self._queue(tmp_path, insert_many, flush_interval=0.02)
+
+        async def scenario():
+            await queue.enqueue(Lead(summary="a", score=3))
+            await asyncio.sleep(0.1)
+            written = queue.written
+            await queue.stop()
+            return written
+
+        assert asyncio.run(scenario()) == 1
+
+    def test_rejects_when_full(self, tmp_path):
+        """Test backpressure limit is reported by check_capacity before any work is done"""
+        queue = self._queue(tmp_path, AsyncMock(), max_pending=2, max_batch=100)
+
+        async def scenario():
+            queue.check_capacity(2)
+            await queue.enqueue_many([Lead(score=3), Lead(score=3)])
+            with pytest.raises(QueueFullError):
+                queue.check_capacity()
+            queue._pending.clear()
+            await queue.stop()
+
+        asyncio.run(scenario())
+        assert queue.rejected == 1
+
+    def test_overflow_is_spooled_not_dropped(self, tmp_path):
+        """Test leads that no longer fit in the buffer go to the durable spool"""
+        queue = self._queue(tmp_path, AsyncMock(), max_pending=2, max_batch=100)
+
+        async def scenario():
+            await queue.enqueue_many([Lead(summary=str(i), score=3) for i in range(3)])
+            pending = [lead.summary for lead in queue._pending]
+            spooled = [lead.summary for _, lead in queue.spool.peek(10)]
+            queue._pending.clear()
+            await queue.stop()
+            return pending, spooled
+
+        pending, spooled = asyncio.run(scenario())
+        assert pending == ["0", "1"]
+        assert spooled == ["2"]
+        assert queue.spooled == 1
+
+    def test_failed_flush_is_spooled_and_replayed(self, tmp_path):
+        """Test leads survive a DB outage in the spool and are replayed later"""
+        insert_many = AsyncMock(side_effect=Exception("Supabase down"))
+        queue = self._queue(tmp_path, insert_many)
+
+        async def scenario():
+            await queue.enqueue(Lead(summary="keep me", score=5))
+            await queue.flush()
+            assert queue.spool.count() == 1
+            assert insert_many.await_count == 3  # first try + 2 retries
+
+            insert_many.side_effect = None
+            insert_many.return_value = {"success": True}
+            await queue.replay_spool()
+            assert queue.spool.count() == 0
+            await queue.stop()
+
+        asyncio.run(scenario())
+        assert insert_many.await_args.args[0][0].summary == "keep me"
+        assert queue.replayed == 1
+
+
+class TestJobManager:
+    """Test in-process job worker pool"""
+
+    def test_job_runs_and_result_is_stored(self):
+        """Test a submitted job is processed by a worker and its lead stored"""
+        handler = AsyncMock(return_value=Lead(summary="ok", score=6))
+        manager = JobManager(handler, workers=2, max_queue=5)
+
+        async def scenario():
+            job = manager.submit("tekst")
+            assert job.status == "queued"
+            await manager._queue.join()
+            await manager.stop()
+            return manager.get(job.job_id)
+
+        job = asyncio.run(scenario())
+
+        assert job.status == "done"
+        assert job.lead.summary == "ok"
+        assert job.finished_at is not None
+        handler.assert_awaited_once_with("tekst")
+
+    def test_failed_job_records_error(self):
+        """Test a handler exception marks the job as failed"""
+        manager = JobManager(AsyncMock(side_effect=RuntimeError("boom")), workers=1, max_queue=5)
+
+        async def scenario():
+            job = manager.submit("tekst")
+            await manager._queue.join()
+            await manager.stop()
+            return manager.get(job.job_id)
+
+        job = asyncio.run(scenario())
+
+        assert job.status == "failed"
+        assert job.error == "boom"
+
+    def test_rejects_when_queue_saturated(self):
+        """Test submit fails fast instead of growing the queue"""
+        manager = JobManager(AsyncMock(), workers=1, max_queue=2)
+
+        async def scenario():
+            manager.submit("a")
+            manager.submit("b")
+            with pytest.raises(JobQueueFullError):
+                manager.submit("c")
+            await manager.stop()
+
+        asyncio.run(scenario())
+        assert manager.rejected == 1
+
+    def test_webhook_receives_finished_job(self):
+        """Test completion webhook gets the job status payload"""
+        manager = JobManager(AsyncMock(return_value=Lead(summary="ok", score=6)), workers=1, max_queue=5)
+
+        async def scenario():
+            with patch('httpx.AsyncClient.post', new_callable=AsyncMock, return_value=MagicMock()) as mock_post:
+                manager.submit("tekst", webhook_url="http://crm.local/hook")
+                await manager._queue.join()
+                await manager.stop()
+                return mock_post
+
+        mock_post = asyncio.run(scenario())
+
+        mock_post.assert_awaited_once()
+        assert mock_post.await_args.args[0] == "http://crm.local/hook"
+        assert json.loads(mock_post.await_args.kwargs["content"])["status"] == "done"
+        assert mock_post.await_args.kwargs["headers"]["Content-Type"] == "application/json"
+
+
+    def test_slow_webhook_does_not_hold_a_worker(self):
+        """Test the next job runs while the previous job's webhook is still being sent"""
+        release = None
+        manager = JobManager(AsyncMock(return_value=Lead(summary="ok", score=6)), workers=1, max_queue=5)
+
+        async def slow_post(*args, **kwargs):
+            await release.wait()
+            return MagicMock()
+
+        async def scenario():
+            nonlocal release
+            release = asyncio.Event()
+            with patch('httpx.AsyncClient.post', side_effect=slow_post):
+                first = manager.submit("a", webhook_url="https://crm.example.com/hook")
+                second = manager.submit("b")
+                await asyncio.wait_for(manager._queue.join(), timeout=1)
+                statuses = (manager.get(first.job_id).status, manager.get(second.job_id).status)
+                in_flight = manager.stats()["webhooks_in_flight"]
+                release.set()
+                await manager.stop()
+            return statuses, in_flight
+
+        statuses, in_flight = asyncio.run(scenario())
+        assert statuses == ("done", "done")
+        assert in_flight == 1
+
+    def test_webhook_url_rejects_internal_targets(self):
+        """Test webhooks cannot point at localhost, private addresses or hosts outside the allow-list"""
+        for url in ("http://localhost:8000/x", "http://127.0.0.1/x", "http://10.0.0.5/x",
+                    "http://169.254.169.254/latest/meta-data", "http://[::1]/x", "ftp://crm.example.com/x"):
+            with pytest.raises(ValueError):
+                validate_webhook_url(url)
+
+        validate_webhook_url("https://crm.example.com/hook")
+        validate_webhook_url("https://hooks.crm.example.com/x", allowed_hosts=["crm.example.com"])
+        with pytest.raises(ValueError, match="dozwolonych"):
+            validate_webhook_url("https://evil.example.org/x", allowed_hosts=["crm.example.com"])
+
+
+class TestNdjsonStream:
+    """Test NDJSON line splitting and the bounded in-flight window"""
+
+    @staticmethod
+    async def _chunks(*chunks):
+        for chunk in chunks:
+            yield chunk
+
+    @staticmethod
+    async def _collect(iterator):
+        return [item async for item in iterator]
+
+    def test_lines_split_across_chunks(self):
+        """Test records split over chunk boundaries are reassembled and blank lines skipped"""
+        lines = asyncio.run(self._collect(iter_ndjson_lines(self._chunks(b'{"text": "a', b'b"}\n\n{"te', b'xt": "c"}'))))
+        assert lines == [b'{"text": "ab"}', b'{"text": "c"}']
+
+    def test_oversized_line_is_reported_and_skipped(self):
+        """Test a line above the limit becomes None and the next line still parses"""
+        chunks = self._chunks(b"x" * 30, b"x" * 30, b'\n{"text": "ok"}\n')
+        lines = asyncio.run(self._collect(iter_ndjson_lines(chunks, max_line_bytes=40)))
+        assert lines == [None, b'{"text": "ok"}']
+
+    def test_in_flight_never_exceeds_window(self):
+        """Test at most `window` handler calls run at once"""
+        active = 0
+        peak = 0
+
+        async def handler(text):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.001)
+            active -= 1
+            return Lead(summary=text, score=5)
+
+        async def lines():
+            for i in range(50):
+                yield json.dumps({"text": f"lead {i}"}).encode()
+
+        results = asyncio.run(self._collect(process_ndjson(lines(), handler, window=4)))
+
+        assert peak == 4
+        assert sorted(json.loads(line)["index"] for line in results) == list(range(50))
+
+    def test_result_streams_before_upload_ends(self):
+        """Test a finished record is emitted while the next line is still being uploaded"""
+        first_sent = None
+
+        async def lines():
+            yield b'{"text": "first"}'
+            await first_sent.wait()  # the upload stalls until the first result goes out
+            yield b'{"text": "second"}'
+
+        async def scenario():
+            nonlocal first_sent
+            first_sent = asyncio.Event()
+            handler = AsyncMock(side_effect=lambda text: Lead(summary=text, score=5))
+            results = []
+            async for line in process_ndjson(lines(), handler, window=4):
+                results.append(json.loads(line))
+                first_sent.set()
+            return results
+
+        results = asyncio.run(asyncio.wait_for(scenario(), timeout=2))
+        assert [item["lead"]["summary"] for item in results] == ["first", "second"]
+
+
+class TestHttpPool:
+    """Test the shared HTTP connection pool of the Groq and Supabase clients"""
+
+    def test_from_env(self):
+        """Test pool size, keep-alive and per-call-type timeouts come from the environment"""
+        with patch.dict('os.environ', {
+            'HTTP_POOL_MAX_CONNECTIONS': '10', 'HTTP_POOL_MAX_KEEPALIVE': '4', 'HTTP_POOL_KEEPALIVE_EXPIRY': '30',
+            'HTTP2_ENABLED': 'false', 'HTTP_CONNECT_TIMEOUT': '2', 'LLM_TIMEOUT': '45', 'DB_TIMEOUT': '8',
+        }):
+            pool = HttpPool.from_env()
+        assert (pool.max_connections, pool.max_keepalive, pool.keepalive_expiry) == (10, 4, 30.0)
+        assert pool.http2 is False
+        assert pool.client.timeout == httpx.Timeout(8, connect=2)
+        assert pool.timeout(pool.llm_timeout) == httpx.Timeout(45, connect=2)
+        pool.close()
+
+    def test_http2_falls_back_without_h2(self):
+        """Test HTTP/2 is turned off with a warning when the h2 package is missing"""
+        with patch('http_pool._h2_available', return_value=False):
+            assert HttpPool(http2=True).http2 is False
+
+    def test_clients_share_the_pool(self):
+        """Test both SDK clients are built on the pool's httpx clients, Groq with the LLM timeout"""
+        pool = HttpPool(llm_timeout=30, connect_timeout=3)
+        ai = AIService(http_pool=pool)
+        with patch.dict('os.environ', {'SUPABASE_URL': 'https://test.supabase.co', 'SUPABASE_KEY': 'test-key'}):
+            db = DatabaseService(http_pool=pool)
+
+        assert ai.async_client._client is pool.async_client
+        assert ai.client._client is pool.client
+        assert ai.async_client.timeout == httpx.Timeout(30, connect=3)
+        assert db.supabase.postgrest.session is pool.client
+        pool.close()
+
+    @pytest.mark.skipif(shutil.which("openssl") is None, reason="needs the openssl CLI")
+    def test_connections_are_reused_across_leads(self):
+        """Test consecutive leads against HTTPS stubs pay one TLS handshake per host, not per request"""
+        with tempfile.TemporaryDirectory() as directory:
+            tls = self_signed_cert(directory)
+            with StubLLM(tls=tls) as llm, StubSupabase(tls=tls) as stub_db:
+                pool = HttpPool(verify=tls[0])
+                with patch.dict('os.environ', {'GROQ_BASE_URL': llm.url, 'SUPABASE_URL': stub_db.url,
+                                               'SUPABASE_KEY': 'stub-key'}):
+                    ai, db = AIService(http_pool=pool), DatabaseService(http_pool=pool)
+                    ai.cache = LeadCache(max_entries=0)
+
+                    async def leads():
+                        for i in range(4):
+                            await db.insert_lead_async(await ai.process_lead_text_async(f"Wycena fotowoltaiki {i}"))
+                        stats = pool.stats()
+                        await pool.aclose()
+                        return stats
+
+                    stats = asyncio.run(leads())
+
+        assert (stats["requests"], stats["connections_opened"], stats["tls_handshakes"]) == (8, 2, 2)
+        assert stats["reuse_rate"] == 0.75
+        assert stats["async"] == {"open": 2, "idle": 2, "active": 0}
+        assert pool.stats()["async"] is None
+
+
+class TestModelCascade:
+    """Test the cheap-first model cascade"""
+
+    CHEAP, STRONG = "llama-3.1-8b-instant", "llama-3.3-70b-versatile"
+
+    def _service(self, answers: dict) -> AIService:
+        """AIService with a two-model cascade; answers: model -> content (or Exception)"""
+        service = AIService()
+        service.cascade = ModelCascade([self.CHEAP, self.STRONG])
+        service.model = self.CHEAP
+        service.cache = LeadCache(max_entries=0)
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        service.retry_policy = RetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+
+        def create(**kwargs):
+            answer = answers[kwargs["model"]]
+            if isinstance(answer, Exception):
+                raise answer
+            response = MagicMock()
+            response.choices[0].message.content = answer
+            return response
+
+        service._client = MagicMock()
+        service._client.chat.completions.create.side_effect = create
+        return service
+
+    def _models_called(self, service: AIService) -> list[str]:
+        return [call.kwargs["model"] for call in service.client.chat.completions.create.call_args_list]
+
+    def test_confident_answer_stays_on_cheap_model(self):
+        """Test a clear score with the contacts found never reaches the strong model"""
+        service = self._service({self.CHEAP: json.dumps({"summary": "Wycena.", "score": 8, "phone": "600100200"})})
+        lead = service.process_lead_niche("Proszę o wycenę, tel. 600 100 200")
+
+        assert lead.score == 8
+        assert self._models_called(service) == [self.CHEAP]
+        assert service.cascade.stats()["tiers"][0]["escalated"] == 0
+
+    def test_borderline_score_escalates(self):
+        """Test a score in the borderline band is re-scored by the strong model"""
+        service = self._service({
+            self.CHEAP: json.dumps({"summary": "Może.", "score": 5}),
+            self.STRONG: json.dumps({"summary": "Konkretne zapytanie.", "score": 8}),
+        })
+        lead = service.process_lead_niche("Zastanawiam się nad pompą ciepła")
+
+        assert lead.score == 8
+        assert self._models_called(service) == [self.CHEAP, self.STRONG]
+        tiers = service.cascade.stats()["tiers"]
+        assert tiers[0]["escalation_reasons"] == {"borderline_score": 1}
+        assert (tiers[0]["escalation_rate"], tiers[1]["calls"]) == (1.0, 1)
+
+    def test_missed_contacts_escalate(self):
+        """Test an answer without contacts escalates when the text has an e-mail address"""
+        service = self._service({
+            self.CHEAP: json.dumps({"summary": "Wycena.", "score": 8}),
+            self.STRONG: json.dumps({"summary": "Wycena.", "score": 8, "email": "jan@example.com"}),
+        })
+        lead = service.process_lead_niche("Proszę o wycenę, jan@example.com")
+
+        assert lead.email == "jan@example.com"
+        assert service.cascade.stats()["tiers"][0]["escalation_reasons"] == {"missing_contacts": 1}
+
+    def test_parse_failure_escalates_without_retry(self):
+        """Test an unparseable cheap answer goes straight to the strong model"""
+        service = self._service({self.CHEAP: "nie wiem", self.STRONG: json.dumps({"summary": "Wycena.", "score": 3})})
+        lead = service.process_lead_niche("Proszę o wycenę")
+
+        assert lead.score == 3
+        assert self._models_called(service) == [self.CHEAP, self.STRONG]
+        assert service.cascade.stats()["tiers"][0]["failed"] == 1
+
+    def test_strong_model_failure_keeps_cheaper_answer(self):
+        """Test the cheap answer is kept when the strong model errors out, instead of manual verification"""
+        service = self._service({self.CHEAP: json.dumps({"summary": "Może.", "score": 6}),
+                                 self.STRONG: Exception("Groq down")})
+        lead = service.process_lead_niche("Zastanawiam się nad pompą ciepła")
+
+        assert lead.score == 6
+        assert not lead.summary.startswith("Requires manual verification")
+        assert service.cascade.stats()["kept_cheaper_answer"] == 1
+
+    def test_single_model_never_escalates(self):
+        """Test the default one-model cascade keeps a borderline answer and the old cache key"""
+        with patch.dict('os.environ'):
+            os.environ.pop("LLM_MODELS", None)
+            service = AIService()
+        assert service.cascade.models == [self.CHEAP] and not service.cascade.enabled
+        assert service.cascade.cache_id == service.model == self.CHEAP
+        assert service.cascade.escalation_reason(Lead(summary="x", score=5), "x") == "borderline_score"
+        assert service.cascade.has_next(0) is False
+        with patch.dict('os.environ', {'LLM_MODELS': f"{self.CHEAP}, {self.STRONG}"}):
+            assert ModelCascade.from_env().models == [self.CHEAP, self.STRONG]
+
+    def test_cascade_against_stub_llm(self):
+        """Test the async path against a stub LLM answering per model, with its latency in the tier stats"""
+        cheap = json.dumps({"summary": "Może.", "score": 5})
+        strong = json.dumps({"summary": "Konkretne zapytanie.", "score": 9})
+        with StubLLM(content=cheap, models={self.STRONG: {"content": strong, "latency": 0.02}}) as llm:
+            service = self._service({})
+            service.async_client = groq.AsyncGroq(api_key="stub", base_url=llm.url, max_retries=0)
+            lead = asyncio.run(service.process_lead_niche_async("Zastanawiam się nad fotowoltaiką"))
+            by_model = dict(llm.by_model)
+
+        assert lead.score == 9
+        assert by_model == {self.CHEAP: 1, self.STRONG: 1}
+        tiers = service.cascade.stats()["tiers"]
+        assert tiers[1]["ms_avg"] >= 20
+
+
+class TestLeadStreaming:
+    """Test streamed completions with early termination"""
+
+    ANSWER = json.dumps({"name": "Jan Kowalski", "product": "Pompa {ciepła}", "score": 8, "city": "Kraków"},
+                        ensure_ascii=False)
+
+    def test_object_stream_reports_fields_as_they_complete(self):
+        """Test fields are reported once their value is closed, braces in strings and prose are ignored"""
+        stream = ObjectStream()
+        text = 'Oto JSON: ' + self.ANSWER + ' Mam nadzieję, że pomogłem {"score": 1}'
+        fields = []
+        for ch in text:
+            fields.extend(stream.feed(ch))
+            if stream.complete:
+                break
+
+        assert fields == [("name", "Jan Kowalski"), ("product", "Pompa {ciepła}"), ("score", 8), ("city", "Kraków")]
+        assert stream.object_text == self.ANSWER
+
+    def test_object_stream_skips_undecodable_fields(self):
+        """Test a broken pair and unknown keys are not reported but do not stop the object"""
+        stream = ObjectStream()
+        fields = stream.feed('{"name": None, "extra": 1, "nested": {"a": [1, 2]}, "score": 7}')
+
+        assert fields == [("score", 7)]
+        assert stream.complete
+
+    def test_stream_stops_after_object(self):
+        """Test the async path closes a stub stream at the closing brace and reports fields on the way"""
+        trailer = "\n\nWyjaśnienie: " + "model pisze dalej " * 12
+        with StubLLM(content=self.ANSWER, tokens_per_second=200, trailer=trailer) as llm:
+            service = AIService()
+            service.async_client = groq.AsyncGroq(api_key="stub", base_url=llm.url, max_retries=0)
+            service.cache = LeadCache(max_entries=0)
+            fields = []
+
+            lead = asyncio.run(service.process_lead_niche_async(
+                "Pompa ciepła", on_field=lambda model, field, value: fields.append((model, field))
+            ))
+            deadline = time.monotonic() + 2
+            while llm.streams_stopped == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        assert lead.score == 8 and lead.city == "Kraków"
+        assert fields[0] == (service.model, "name")
+        assert (llm.streams, llm.streams_stopped) == (1, 1)
+        stats = service.stream_stats.stats()
+        assert (stats["streams"], stats["stopped_early"], stats["unfinished"]) == (1, 1, 0)
+        assert stats["first_field_ms_avg"] <= stats["ms_avg"]
+
+    def test_streaming_flag_streams_sync_path(self):
+        """Test LLM_STREAMING_ENABLED streams the sync path and drops JSON mode for the streamed request"""
+        with StubLLM(content=self.ANSWER, trailer=" i coś jeszcze") as llm:
+            with patch.dict('os.environ', {'LLM_STREAMING_ENABLED': 'true'}):
+                service = AIService()
+            service.client = groq.Groq(api_key="stub", base_url=llm.url, max_retries=0)
+            service.cache = LeadCache(max_entries=0)
+
+            lead = service.process_lead_niche("Pompa ciepła")
+
+        assert lead.score == 8
+        assert llm.streams == 1
+        assert "response_format" not in service._completion_kwargs("x", stream=True)
+
+    def test_unfinished_stream_goes_to_tolerant_parser(self):
+        """Test an answer cut off before the closing brace is still parsed from the whole text"""
+        with StubLLM(content='{"summary": "Wycena.", "score": 6, "city": "Gda') as llm:
+            service = AIService()
+            service.async_client = groq.AsyncGroq(api_key="stub", base_url=llm.url, max_retries=0)
+            service.cache = LeadCache(max_entries=0)
+
+            lead = asyncio.run(service.process_lead_niche_async("Wycena", on_field=lambda *args: None))
+
+        assert lead.score == 6
+        assert service.stream_stats.stats()["unfinished"] == 1
+
+
+class TestPromptRegistry:
+    """Test the precompiled, hot-reloaded niche prompt registry"""
+
+    @staticmethod
+    def _write(directory: str, niche: str, template: str, keywords: str = "") -> None:
+        header = f"keywords: {keywords}\n---\n" if keywords else ""
+        path = os.path.join(directory, f"{niche}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(header + template)
+        # Distinct mtime even on coarse-grained file systems
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def _directory_registry(self, directory: str) -> PromptRegistry:
+        self._write(directory, "fotowoltaika", "ROLE: PV qualifier.", "fotowolt, panele")
+        self._write(directory, "pompy_ciepla", "ROLE: Heat pump qualifier.", "pomp, ciepła")
+        return PromptRegistry(load_directory(directory, "fotowoltaika"), directory=directory)
+
+    def test_compiled_prompt_keeps_prompt_and_hash(self):
+        """Test the precompiled prefix/suffix render the full prompt and hash it with {text} for the input"""
+        prompt = PromptSet({"a": "ROLE: A."}, {}, "a").get("a")
+
+        rendered = prompt.render("Dzień dobry")
+        assert rendered.startswith("ROLE: A.") and '"Dzień dobry"' in rendered
+        assert rendered.rstrip().endswith("OUTPUT JSON:")
+        assert prompt.hash == hash_prompt(prompt.render("{text}"))
+        assert prompt.tokens > 0
+
+    def test_directory_with_keywords_routes(self):
+        """Test prompt files with a keywords header load as niches with routing"""
+        with tempfile.TemporaryDirectory() as directory:
+            registry = self._directory_registry(directory)
+
+        current = registry.current
+        assert list(current.prompts) == ["fotowoltaika", "pompy_ciepla"]
+        assert current.prompts["pompy_ciepla"].template == "ROLE: Heat pump qualifier."
+        assert current.router.route("Interesuje mnie pompa ciepła") == "pompy_ciepla"
+        assert current.get("nieznana").niche == "fotowoltaika"
+
+    def test_reload_swaps_version_and_keeps_it_on_errors(self):
+        """Test a changed file installs a new version, a broken directory keeps the old one"""
+        with tempfile.TemporaryDirectory() as directory:
+            registry = self._directory_registry(directory)
+            old = registry.current
+            assert registry.reload_if_changed() is False
+
+            self._write(directory, "pompy_ciepla", "ROLE: Heat pump qualifier v2.", "pomp")
+            assert registry.reload_if_changed() is True
+            assert registry.current.version == 2
+            assert registry.current.prompts["pompy_ciepla"].hash != old.prompts["pompy_ciepla"].hash
+            # The old version is untouched: a lead that started with it keeps using it
+            assert old.prompts["pompy_ciepla"].template == "ROLE: Heat pump qualifier."
+
+            os.remove(os.path.join(directory, "fotowoltaika.txt"))
+            assert registry.reload_if_changed() is False
+            assert registry.current.version == 2
+            assert (registry.reload_errors, "fotowoltaika" in registry.last_error) == (1, True)
+
+            self._write(directory, "fotowoltaika", "ROLE: PV qualifier.")
+            assert registry.reload_if_changed() is True
+            assert registry.stats()["version"] == 3
+
+    def test_request_path_does_no_file_io(self):
+        """Test leads of a directory registry are processed with file access blocked"""
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.dict('os.environ', {'PROMPTS_DIR': directory, 'PROMPTS_DEFAULT_NICHE': 'fotowoltaika'}):
+                self._directory_registry(directory)
+                service = AIService()
+            service.cache = LeadCache(max_entries=0)
+            response = MagicMock()
+            response.choices[0].message.content = json.dumps({"summary": "Wycena.", "score": 7})
+            service._client = MagicMock()
+            service.client.chat.completions.create.return_value = response
+
+            with patch('builtins.open', side_effect=AssertionError("file I/O")), \
+                 patch('os.scandir', side_effect=AssertionError("file I/O")):
+                lead = service.process_lead_text("Proszę o wycenę, panele fotowoltaiczne")
+
+        assert lead.score == 7
+        prompt = service.client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        assert prompt.startswith("ROLE: PV qualifier.")
+
+    def test_watcher_reloads_in_background(self):
+        """Test the watcher task picks up an edited file without a restart"""
+        with tempfile.TemporaryDirectory() as directory:
+            registry = self._directory_registry(directory)
+            registry.reload_interval = 0.01
+
+            async def scenario():
+                registry.start()
+                self._write(directory, "fotowoltaika", "ROLE: PV qualifier v2.", "fotowolt")
+                deadline = time.monotonic() + 2
+                while registry.current.version == 1 and time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+                await registry.stop()
+
+            asyncio.run(scenario())
+
+        assert registry.current.prompts["fotowoltaika"].template == "ROLE: PV qualifier v2."
+        assert registry.reloads == 1
+
+
+class TestNearDuplicates:
+    """Test near-duplicate leads reuse a recent answer instead of calling the LLM"""
+
+    INQUIRY = ("Dzień dobry, proszę o wycenę instalacji fotowoltaicznej 8 kW na dachu skośnym. "
+               "Dach kryty blachodachówką, kierunek południowy. Pozdrawiam, Jan Kowalski")
+
+    @staticmethod
+    def _service(**index_options) -> AIService:
+        service = AIService()
+        service.prompts = {DEFAULT_NICHE: "PROMPT"}
+        service.cache = LeadCache(max_entries=0)
+        service.near_duplicates = NearDuplicateIndex(enabled=True, **index_options)
+        service.client = MagicMock()
+        payload = {"name": "Jan Kowalski", "product": "Fotowoltaika", "summary": "Wycena PV 8 kW", "score": 7}
+        service.client.chat.completions.create.return_value.choices[0].message.content = json.dumps(payload)
+        return service
+
+    def test_near_duplicate_reuses_answer(self):
+        """Test a changed greeting and a mobile footer are answered from the index, marked with the group"""
+        service = self._service()
+        first = service.process_lead_niche(self.INQUIRY)
+        variant = self.INQUIRY.replace("Dzień dobry", "Witam") + "\n\nWysłane z iPhone'a"
+        second = service.process_lead_niche(variant)
+
+        assert service.client.chat.completions.create.call_count == 1
+        assert second.name == "Jan Kowalski" and second.score == 7
+        assert second._duplicate_group.entry_id == first._duplicate_group.entry_id
+        assert 0.8 <= second._duplicate_group.similarity < 1.0
+        assert service.near_duplicates.stats()["hits"] == 1
+
+    def test_different_numbers_call_the_llm(self):
+        """Test the same wording with another power is another lead"""
+        service = self._service()
+        service.process_lead_niche(self.INQUIRY)
+        service.process_lead_niche(self.INQUIRY.replace("8 kW", "10 kW"))
+
+        assert service.client.chat.completions.create.call_count == 2
+        assert service.near_duplicates.stats()["hits"] == 0
+
+    def test_short_message_is_not_indexed(self):
+        """Test messages below min_tokens distinct words skip the index"""
+        service = self._service()
+        service.process_lead_niche("Ile kosztuje pompa ciepła? Jan")
+        service.process_lead_niche("Witam, ile kosztuje pompa ciepła? Jan")
+
+        assert service.client.chat.completions.create.call_count == 2
+        stats = service.near_duplicates.stats()
+        assert (stats["too_short"], stats["entries"]) == (2, 0)
+
+    def test_other_name_is_turned_down(self):
+        """Test an answer whose name is not in the new message is not reused"""
+        service = self._service()
+        service.process_lead_niche(self.INQUIRY)
+        service.process_lead_niche(self.INQUIRY.replace("Jan Kowalski", "Anna Nowak"))
+
+        assert service.client.chat.completions.create.call_count == 2
+        stats = service.near_duplicates.stats()
+        assert (stats["hits"], stats["name_mismatches"]) == (0, 1)
+
+    def test_window_and_capacity(self):
+        """Test entries expire after the window and the oldest go first at max_entries"""
+        index = NearDuplicateIndex(enabled=True, window_seconds=60, max_entries=2, min_tokens=3)
+        texts = [f"zapytanie o ofertę numer {n}" for n in range(3)]
+        with patch('near_duplicates.time.monotonic', return_value=1000.0):
+            for text in texts:
+                index.add(index.probe(text, "scope"), b"{}")
+            assert index.find(index.probe(texts[0], "scope")) is None
+            assert index.find(index.probe(texts[2], "scope")).similarity == 1.0
+        with patch('near_duplicates.time.monotonic', return_value=1061.0):
+            assert index.find(index.probe(texts[2], "scope")) is None
+
+        stats = index.stats()
+        assert (stats["evicted"], stats["expired"], stats["entries"]) == (1, 2, 0)
+
+    def test_rows_become_link_targets(self):
+        """Test a duplicate links to the first row of its group once that row is known"""
+        index = NearDuplicateIndex(enabled=True, min_tokens=3)
+        group = index.add(index.probe("zapytanie o ofertę pompy", "scope"), b"{}")
+        first = index.mark(Lead(summary="a", score=5), group)
+        duplicate = index.mark(Lead(summary="a", score=5), group._replace(similarity=0.9))
+
+        assert index.link_for(duplicate) is None
+        index.record_rows([first], [{"id": 42}])
+        assert index.link_for(duplicate) == {"lead_id": 42, "similarity": 0.9}
+        assert index.link_for(Lead(summary="b", score=5)) is None
 
 
 class TestDatabaseService:
     """Test Database Service functionality"""
     
-    @patch('database.create_client')
+    @patch('supabase.create_client')
     def test_database_service_initialization(self, mock_create_client):
         """Test DatabaseService initializes correctly"""
         with patch.dict('os.environ', {
@@ -37,9 +1748,12 @@ class TestDatabaseService:
         }):
             service = DatabaseService()
             assert service is not None
-            mock_create_client.assert_called_once()
+            # The client (and the supabase SDK) is created on first use
+            mock_create_client.assert_not_called()
+            assert service.supabase is mock_create_client.return_value
+            mock_create_client.assert_called_once_with('https://test.supabase.co', 'test-key')
     
-    @patch('database.create_client')
+    @patch('supabase.create_client')
     def test_insert_lead_success(self, mock_create_client):
         """Test successful lead insertion"""
         mock_supabase = MagicMock()
@@ -73,7 +1787,7 @@ class TestDatabaseService:
             assert result["success"] is True
             assert len(result["data"]) > 0
     
-    @patch('database.create_client')
+    @patch('supabase.create_client')
     def test_insert_lead_database_error(self, mock_create_client):
         """Test database error handling"""
         mock_supabase = MagicMock()
@@ -102,3 +1816,126 @@ class TestDatabaseService:
             
             with pytest.raises(ValueError, match="Błąd podczas zapisywania do bazy"):
                 service.insert_lead(lead)
+
+    @patch('supabase.acreate_client', new_callable=AsyncMock)
+    @patch('supabase.create_client')
+    def test_insert_lead_async_success(self, mock_create_client, mock_acreate_client):
+        """Test async lead insertion awaits the async Supabase client"""
+        async_supabase = MagicMock()
+        async_supabase.table.return_value.insert.return_value.execute = AsyncMock(
+            return_value=MagicMock(data=[{"id": 1}])
+        )
+        mock_acreate_client.return_value = async_supabase
+
+        service = DatabaseService()
+        lead = Lead(name="John Doe", email="john@example.com", summary="Good lead", score=8)
+
+        result = asyncio.run(service.insert_lead_async(lead))
+
+        assert result["success"] is True
+        assert result["data"] == [{"id": 1}]
+        async_supabase.table.assert_called_once_with('leads')
+        service.supabase.table.assert_not_called()
+
+    @patch('supabase.acreate_client', new_callable=AsyncMock)
+    @patch('supabase.create_client')
+    def test_insert_lead_async_database_error(self, mock_create_client, mock_acreate_client):
+        """Test async insertion wraps errors the same way as the sync path"""
+        async_supabase = MagicMock()
+        async_supabase.table.return_value.insert.return_value.execute = AsyncMock(
+            side_effect=Exception("Connection failed")
+        )
+        mock_acreate_client.return_value = async_supabase
+
+        service = DatabaseService()
+        lead = Lead(name="John Doe", summary="Good lead", score=8)
+
+        with pytest.raises(ValueError, match="Błąd podczas zapisywania do bazy"):
+            asyncio.run(service.insert_lead_async(lead))
+
+    @patch('supabase.acreate_client', new_callable=AsyncMock)
+    @patch('supabase.create_client')
+    def test_insert_leads_async_sends_one_bulk_request(self, mock_create_client, mock_acreate_client):
+        """Test bulk insertion sends all leads in a single insert call"""
+        async_supabase = MagicMock()
+        async_supabase.table.return_value.insert.return_value.execute = AsyncMock(
+            return_value=MagicMock(data=[{"id": 1}, {"id": 2}])
+        )
+        mock_acreate_client.return_value = async_supabase
+
+        service = DatabaseService()
+        leads = [Lead(summary="a", score=3), Lead(summary="b", score=4)]
+
+        result = asyncio.run(service.insert_leads_async(leads))
+
+        assert result["success"] is True
+        async_supabase.table.return_value.insert.assert_called_once()
+        payload = async_supabase.table.return_value.insert.call_args.args[0]
+        assert [row["summary"] for row in payload] == ["a", "b"]
+
+    @patch('supabase.acreate_client', new_callable=AsyncMock)
+    @patch('supabase.create_client')
+    def test_async_client_created_once_under_concurrency(self, mock_create_client, mock_acreate_client):
+        """Test concurrent first inserts share one lazily created async client"""
+        async_supabase = MagicMock()
+        async_supabase.table.return_value.insert.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+
+        async def slow_create(url, key):
+            await asyncio.sleep(0.01)
+            return async_supabase
+
+        mock_acreate_client.side_effect = slow_create
+        service = DatabaseService()
+
+        async def scenario():
+            await asyncio.gather(*(service.insert_lead_async(Lead(summary="x", score=3)) for _ in range(5)))
+
+        asyncio.run(scenario())
+
+        mock_acreate_client.assert_awaited_once()
+        assert async_supabase.table.return_value.insert.call_count == 5
+
+    def test_insert_against_stub_supabase(self):
+        """Inserts go through the real supabase client to the local PostgREST stub, including injected errors"""
+        lead = Lead(name="Jan", summary="Remont.", score=7)
+        with StubSupabase(latency=0.001) as db:
+            with patch.dict('os.environ', {'SUPABASE_URL': db.url, 'SUPABASE_KEY': 'stub-key'}):
+                service = DatabaseService()
+            assert service.insert_lead(lead)["data"][0]["id"] == 1
+            result = asyncio.run(service.insert_leads_async([lead, lead]))
+            assert [row["id"] for row in result["data"]] == [2, 3]
+            db.error_rate = 1.0
+            with pytest.raises(ValueError, match="Błąd podczas zapisywania do bazy"):
+                service.insert_lead(lead)
+            assert (db.requests, db.rows, db.errors) == (3, 3, 1)
+
+    def test_warm_up_opens_clients(self):
+        """Warm-up creates the clients against the stubs and only logs when a service is unreachable"""
+        with StubLLM() as llm, StubSupabase() as db:
+            with patch.dict('os.environ', {'SUPABASE_URL': db.url, 'SUPABASE_KEY': 'stub-key'}):
+                database = DatabaseService()
+            ai = AIService()
+
+            async def warm_up():
+                ai.async_client = groq.AsyncGroq(api_key="stub", base_url=llm.url, max_retries=0)
+                await ai.warm_up()
+                await database.warm_up()
+
+            asyncio.run(warm_up())
+            assert database.async_supabase is not None
+
+        with patch.dict('os.environ', {'SUPABASE_URL': 'http://127.0.0.1:9', 'SUPABASE_KEY': 'stub-key'}):
+            unreachable = DatabaseService()
+        asyncio.run(unreachable.warm_up())
+
+    def test_stub_latency_specs(self):
+        """Stub latency accepts constants and seeded distributions"""
+        assert parse_latency(0.2)() == 0.2
+        assert parse_latency("0.3")() == 0.3
+        rng = random.Random(1)
+        samples = [parse_latency("uniform:0.1:0.2", rng)() for _ in range(100)]
+        assert all(0.1 <= sample <= 0.2 for sample in samples)
+        assert parse_latency("lognormal:0.3:0.5", rng)() > 0
+        assert parse_latency("exp:0.1", rng)() >= 0
+        with pytest.raises(ValueError):
+            parse_latency("pareto:1")
@@ -0,0 +1,120 @@
+"""
+Precompiled text rules used by AIService post-processing.
+
+All patterns are compiled once at import. scan_text() is the single place where the
+source text is examined: it collects everything _postprocess_lead needs (profanity,
+first email, first phone) once per lead. A single combined regex over the text was
+measured to be about 2x slower in CPython's re than these separate searches, because
+the combined pattern loses sre's prefix optimizations.
+"""
+import re
+from typing import NamedTuple, Optional
+
+
+# Lightweight profanity detector (PL). Intentionally conservative.
+PROFANITY_PREFIXES = ("kurw", "chuj", "jeb", "pierdol", "skurw", "spierdol")
+PROFANITY_PATTERNS = tuple(rf"\b{prefix}\w*\b" for prefix in PROFANITY_PREFIXES)
+_PROFANITY = rf"\b(?:{'|'.join(PROFANITY_PREFIXES)})\w*\b"
+
+# The lookbehind only lets a match start at the beginning of a run of local-part
+# characters. Matches are the same (the leftmost match always starts there), but a
+# long run without "@" (base64, URLs) is scanned once instead of once per position,
+# which was quadratic: ~2 s for 32 KB (benchmarks/bench_cpu.py).
+EMAIL_PATTERN = r"(?<![a-zA-Z0-9._%+-])[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
+PHONE_PATTERN = r"\+?\d[\d\s\-()]{6,}\d"
+
+PROFANITY_RE = re.compile(_PROFANITY, re.IGNORECASE)
+EMAIL_RE = re.compile(EMAIL_PATTERN)
+PHONE_RE = re.compile(PHONE_PATTERN)
+
+_MULTI_SPACE_RE = re.compile(r"\s{2,}")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([,.;:!?])")
+_TYPO_RULES = (
+    (re.compile(r"fotowoltaj", re.IGNORECASE), "fotowoltaic"),
+    (re.compile(r"fotowoltai", re.IGNORECASE), "fotowoltaic"),
+)
+
+# Accept names like Jan, Jan Kowalski, Jan A. Kowalski (basic heuristic)
+_NAME_RE = re.compile(r"^[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+( [A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż\.]+){0,2}$")
+_NAME_NOISE_KEYWORDS = (
+    "pokoi", "pokoj", "pokoje", "wyceny", "wycena", "grupy", "grupa", "osób", "osoby", "osoba",
+    "tydzie", "dla", "proszę", "prosze", "rezerwac", "nocleg", "hotel", "klimatyz", "fotowolt",
+    "pompa", "rekuper", "budżet", "budzet", "termin", "ofert"
+)
+
+
+class TextScan(NamedTuple):
+    has_profanity: bool
+    email: Optional[str]
+    phone: Optional[str]
+
+
+def contains_profanity(text: Optional[str]) -> bool:
+    return PROFANITY_RE.search((text or "").lower()) is not None
+
+
+def extract_email(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    m = EMAIL_RE.search(text)
+    return m.group(0) if m else None
+
+
+def extract_phone(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    m = PHONE_RE.search(text)
+    return m.group(0).strip() if m else None
+
+
+def scan_text(text: Optional[str]) -> TextScan:
+    """Everything post-processing needs from the source text, computed once per lead."""
+    if not text:
+        return TextScan(False, None, None)
+    return TextScan(contains_profanity(text), extract_email(text), extract_phone(text))
+
+
+def remove_profanity_terms(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return text
+
+    # Every match spans a whole word, so one combined pass equals one pass per pattern.
+    sanitized = PROFANITY_RE.sub("", text)
+    sanitized = _MULTI_SPACE_RE.sub(" ", sanitized).strip()
+    sanitized = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", sanitized)
+    return sanitized
+
+
+def fix_common_summary_typos(summary: Optional[str]) -> Optional[str]:
+    if not summary:
+        return summary
+
+    fixed = summary
+    for pattern, replacement in _TYPO_RULES:
+        fixed = pattern.sub(replacement, fixed)
+    fixed = fixed.strip()
+    if fixed and fixed[0].islower():
+        fixed = fixed[0].upper() + fixed[1:]
+    if fixed and fixed[-1] not in ".!?":
+        fixed += "."
+    return fixed
+
+
+def sanitize_name(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    s = name.strip()
+    if not s:
+        return None
+    if len(s) > 60:
+        return None
+    if any(ch.isdigit() for ch in s):
+        return None
+    if "@" in s:
+        return None
+    s_l = s.lower()
+    if any(k in s_l for k in _NAME_NOISE_KEYWORDS):
+        return None
+    if _NAME_RE.match(s):
+        return s
+    return None
@@ -0,0 +1,247 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Awaitable, Callable, Optional
+
+from schemas import Lead, render_json
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the write-behind buffer is at capacity (backpressure)."""
+
+
+class LeadSpool:
+    """Durable local spool (SQLite in WAL mode) for leads whose bulk insert kept failing."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.open()
+
+    def open(self) -> None:
+        """Connect, unless already connected (the queue reopens its spool on every start)."""
+        with self._lock:
+            if self._db is not None:
+                return
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lead_spool (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def append(self, leads: list[Lead]) -> None:
+        now = time.time()
+        rows = [(render_json(lead).decode("utf-8"), now) for lead in leads]
+        with self._lock:
+            self._db.executemany("INSERT INTO lead_spool (payload, created_at) VALUES (?, ?)", rows)
+            self._db.commit()
+
+    def peek(self, limit: int) -> list[tuple[int, Lead]]:
+        with self._lock:
+            rows = self._db.execute("SELECT id, payload FROM lead_spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, Lead.model_validate_json(payload)) for row_id, payload in rows]
+
+    def delete(self, ids: list[int]) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM lead_spool WHERE id = ?", [(row_id,) for row_id in ids])
+            self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM lead_spool").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class WriteBehindQueue:
+    """
+    Buffers leads in memory and writes them with bulk inserts.
+
+    A flush happens when max_batch leads are waiting or every flush_interval seconds.
+    Failed flushes are retried with exponential backoff and jitter; what still fails
+    goes to the SQLite spool and is replayed every replay_interval seconds.
+    """
+
+    def __init__(
+        self,
+        insert_many: Callable[[list[Lead]], Awaitable[dict]],
+        max_batch: int = 50,
+        flush_interval: float = 1.0,
+        max_pending: int = 5000,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        spool_path: str = "lead_spool.sqlite",
+        replay_interval: float = 30.0,
+    ):
+        self.insert_many = insert_many
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.replay_interval = replay_interval
+        self.spool = LeadSpool(spool_path)
+
+        self._pending: list[Lead] = []
+        self._in_flight = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+        self._last_replay = 0.0
+
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.retries = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, insert_many: Callable[[list[Lead]], Awaitable[dict]]) -> "WriteBehindQueue":
+        return cls(
+            insert_many,
+            max_batch=int(os.getenv("WRITE_BEHIND_BATCH", "50")),
+            flush_interval=float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0")),
+            max_pending=int(os.getenv("WRITE_BEHIND_MAX_PENDING", "5000")),
+            max_retries=int(os.getenv("WRITE_BEHIND_RETRIES", "3")),
+            spool_path=os.getenv("WRITE_BEHIND_SPOOL", "lead_spool.sqlite"),
+        )
+
+    def start(self) -> None:
+        """Start (or restart on a new event loop) the background flusher."""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        # stop() closed the spool; the queue outlives one app lifespan
+        self.spool.open()
+        self._loop = loop
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def check_capacity(self, count: int = 1) -> None:
+        """
+        Raise QueueFullError when `count` more leads would not fit in the buffer.
+
+        Callers check before the LLM call, so backpressure never throws away a
+        lead that has already been paid for.
+        """
+        if len(self._pending) + self._in_flight + count > self.max_pending:
+            self.rejected += count
+            raise QueueFullError("Kolejka zapisu do bazy jest pełna, spróbuj ponownie później")
+
+    async def enqueue(self, lead: Lead) -> None:
+        await self.enqueue_many([lead])
+
+    async def enqueue_many(self, leads: list[Lead]) -> None:
+        """Buffer leads; what no longer fits (capacity raced away since the check) goes to the spool."""
+        self.start()
+        room = max(0, self.max_pending - len(self._pending) - self._in_flight)
+        accepted, overflow = leads[:room], leads[room:]
+        self._pending.extend(accepted)
+        self.enqueued += len(accepted)
+        if overflow:
+            logger.warning(f"Write-behind buffer full, spooling {len(overflow)} leads locally")
+            await asyncio.to_thread(self.spool.append, overflow)
+            self.spooled += len(overflow)
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        """Write everything that is buffered right now."""
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            self._in_flight += len(batch)
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                self._in_flight -= len(batch)
+
+    async def stop(self) -> None:
+        """Graceful shutdown: stop the flusher and write (or spool) what is left."""
+        self._stopping = True
+        if self._task is not None and not self._task.done() and self._loop is asyncio.get_running_loop():
+            self._wake.set()
+            await self._task
+        await self.flush()
+        self.spool.close()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_replay >= self.replay_interval:
+                    self._last_replay = time.monotonic()
+                    await self.replay_spool()
+            except Exception as e:
+                logger.exception(f"Write-behind flusher error: {str(e)}")
+
+    async def _write_with_retry(self, batch: list[Lead]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.insert_many(batch)
+                self.flushes += 1
+                self.written += len(batch)
+                return
+            except Exception as e:
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    delay = self.retry_base_delay * (2 ** attempt)
+                    delay += random.uniform(0, delay)  # jitter
+                    logger.warning(f"Bulk insert of {len(batch)} leads failed ({str(e)}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                else:
+                    logger.error(f"Bulk insert of {len(batch)} leads failed, spooling locally: {str(e)}")
+                    await asyncio.to_thread(self.spool.append, batch)
+                    self.spooled += len(batch)
+
+    async def replay_spool(self) -> None:
+        """Try to write spooled leads once; rows stay in the spool until written."""
+        while True:
+            rows = await asyncio.to_thread(self.spool.peek, self.max_batch)
+            if not rows:
+                return
+            try:
+                await self.insert_many([lead for _, lead in rows])
+            except Exception as e:
+                logger.warning(f"Spool replay failed, will retry later: {str(e)}")
+                return
+            await asyncio.to_thread(self.spool.delete, [row_id for row_id, _ in rows])
+            self.replayed += len(rows)
+            self.written += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "in_flight": self._in_flight,
+            "max_pending": self.max_pending,
+            "spooled_now": self.spool.count(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "retries": self.retries,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "rejected": self.rejected,
+        }